@@ -13,4 +13,19 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Imported after the application is set up, as they need the app registry
+from django.conf import settings  # noqa: E402
+from core.schema import warm_schema_cache  # noqa: E402
+from core.sse import events_app  # noqa: E402
+
+warm_schema_cache()
+
+
+async def application(scope, receive, send):
+    """Serve the change event stream, and everything else with Django."""
+    if scope['type'] == 'http' and scope['path'] == settings.EVENTS_PATH:
+        await events_app(scope, receive, send)
+    else:
+        await django_application(scope, receive, send)
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
 import os
+from importlib.util import find_spec
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +49,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -90,6 +92,21 @@ DATABASES = {
     }
 }
 
+# Extra databases holding user shards (see core.sharding), one per comma
+# separated alias in DB_SHARDS, on the default database's server. Only
+# ever append: a database's position gives its range of recipe, tag and
+# ingredient ids.
+for _alias in filter(None, os.environ.get('DB_SHARDS', '').split(',')):
+    DATABASES[_alias] = {
+        **DATABASES['default'],
+        'NAME': f'{DATABASES["default"]["NAME"]}_{_alias}',
+    }
+
+DATABASE_ROUTERS = ['core.sharding.UserShardRouter']
+# Databases new users are placed in, by a stable hash of their id. Move
+# existing users after changing it with `python manage.py rebalance_shards`
+RECIPE_SHARDS = os.environ.get('RECIPE_SHARDS', 'default').split(',')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -110,6 +127,35 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# The preferred hasher (PASSWORD_HASHER) and its work factor are configurable
+# per deployment. Stored hashes are upgraded on the next successful login.
+# https://docs.djangoproject.com/en/3.2/topics/auth/passwords/
+
+PASSWORD_HASHER_CLASSES = {
+    'pbkdf2': 'core.hashers.PBKDF2PasswordHasher',
+    'argon2': 'core.hashers.Argon2PasswordHasher',
+    'bcrypt': 'core.hashers.BCryptSHA256PasswordHasher',
+}
+PASSWORD_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2')
+PASSWORD_HASHERS = [PASSWORD_HASHER_CLASSES[PASSWORD_HASHER]] + [
+    hasher for name, hasher in PASSWORD_HASHER_CLASSES.items()
+    if name != PASSWORD_HASHER
+]
+
+
+def _env_int(name):
+    value = os.environ.get(name)
+    return int(value) if value else None
+
+
+# None keeps Django's default work factor
+PASSWORD_HASH_ITERATIONS = _env_int('PASSWORD_HASH_ITERATIONS')
+PASSWORD_HASH_ROUNDS = _env_int('PASSWORD_HASH_ROUNDS')
+PASSWORD_HASH_TIME_COST = _env_int('PASSWORD_HASH_TIME_COST')
+PASSWORD_HASH_MEMORY_COST = _env_int('PASSWORD_HASH_MEMORY_COST')
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/3.2/topics/i18n/
 
@@ -133,6 +179,28 @@ MEDIA_URL = '/static/media/'
 MEDIA_ROOT = '/vol/web/media'
 STATIC_ROOT = '/vol/web/static'
 
+# Uploaded files are hashed while they stream in, recipe images are stored
+# once per distinct content under their SHA-256 (see core.storage)
+FILE_UPLOAD_HANDLERS = [
+    'core.uploadhandlers.HashingMemoryFileUploadHandler',
+    'core.uploadhandlers.HashingTemporaryFileUploadHandler',
+]
+# Content addressed images never change, so they can be cached forever
+RECIPE_IMAGE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# How GET /api/recipe/recipes/<id>/image/ sends images once ownership is
+# checked: 'x-accel-redirect' (nginx, with an internal location mapping
+# MEDIA_ACCEL_REDIRECT_PREFIX to MEDIA_ROOT), 'x-sendfile' (Apache,
+# lighttpd), or unset to stream them from Django (see core.media)
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+MEDIA_ACCEL_REDIRECT_PREFIX = os.environ.get(
+    'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/'
+)
+
+# Seconds a replaced recipe image is kept before a background job deletes
+# it, unless it was reused meanwhile (see core.tasks)
+MEDIA_DELETE_DELAY = 300
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
@@ -141,9 +209,121 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'core.User'
 
 REST_FRAMEWORK = {
-    "DEFAULT_SCHEMA_CLASS": 'drf_spectacular.openapi.AutoSchema'
+    "DEFAULT_SCHEMA_CLASS": 'drf_spectacular.openapi.AutoSchema',
+    # orjson backed JSON renderer/parser, falling back to stdlib json.
+    # MessagePack and CBOR are added below when their packages are installed
+    "DEFAULT_RENDERER_CLASSES": [
+        'core.renderers.JSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        'core.parsers.JSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    "DEFAULT_THROTTLE_RATES": {
+        # Token endpoint (user.throttles)
+        'login_ip': os.environ.get('LOGIN_IP_THROTTLE_RATE', '30/min'),
+        'login_email': os.environ.get('LOGIN_EMAIL_THROTTLE_RATE', '5/min'),
+        # Recipe writes per user (recipe.views.RecipeViewSet)
+        'recipe_create': os.environ.get('RECIPE_CREATE_THROTTLE_RATE', '60/min'),
+        'recipe_update': os.environ.get('RECIPE_UPDATE_THROTTLE_RATE', '120/min'),
+        'recipe_upload_image': os.environ.get(
+            'RECIPE_UPLOAD_IMAGE_THROTTLE_RATE', '20/min'
+        ),
+    },
 }
 
+# Binary formats negotiated through Accept and Content-Type, after JSON so
+# it stays the default
+for package, renderer, parser in [
+    ('msgpack', 'core.renderers.MessagePackRenderer',
+     'core.parsers.MessagePackParser'),
+    ('cbor2', 'core.renderers.CBORRenderer', 'core.parsers.CBORParser'),
+]:
+    if find_spec(package):
+        REST_FRAMEWORK['DEFAULT_RENDERER_CLASSES'].append(renderer)
+        REST_FRAMEWORK['DEFAULT_PARSER_CLASSES'].append(parser)
+
+# Cache alias holding the sliding window throttle counters
+# (core.throttles). Falls back to a process local cache when not in CACHES.
+THROTTLE_CACHE_ALIAS = 'default'
+
+# Response compression (core.middleware.CompressionMiddleware). Brotli is
+# used when the `brotli` package is installed, gzip otherwise.
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 500))
+COMPRESSION_CONTENT_TYPES = [
+    'application/json',
+    'application/msgpack',
+    'application/cbor',
+    'application/vnd.oai.openapi',
+    'application/vnd.oai.openapi+json',
+    'application/javascript',
+    'text/css',
+    'text/html',
+    'text/plain',
+]
+COMPRESSION_BROTLI_QUALITY = 5
+# Cache the compressed bodies of cacheable responses (public or with a
+# max-age) so hot responses aren't recompressed on every hit. Use a cache
+# of its own, entries would evict the throttle and idempotency ones
+COMPRESSION_CACHE_ALIAS = os.environ.get('COMPRESSION_CACHE_ALIAS') or None
+COMPRESSION_CACHE_TIMEOUT = 300
+
+# Server-Sent Events change feed (core.sse), served by app/asgi.py.
+# The default broker only reaches connections in the same process.
+EVENTS_PATH = '/api/recipe/events/'
+EVENTS_BROKER = 'core.events.InProcessBroker'
+EVENTS_HEARTBEAT_INTERVAL = 15
+# Events queued per connection before a slow client is told to resync
+EVENTS_QUEUE_SIZE = 100
+
 SPECTACULAR_SETTINGS = {
     'COMPONENT_SPLIT_REQUEST': True
 }
+
+# The OpenAPI schema is generated once per code version (core.schema) and
+# cached in memory and in this directory. Warmed up when the app starts.
+SCHEMA_CACHE_DIR = os.environ.get('SCHEMA_CACHE_DIR', '/vol/web/schema')
+SCHEMA_CACHE_WARMUP = bool(int(os.environ.get('SCHEMA_CACHE_WARMUP', 1)))
+
+# Recipe statistics are cached per user and change sequence, so writes
+# invalidate them (see recipe.stats)
+RECIPE_STATS_CACHE_TIMEOUT = 3600
+
+# Maximum number of recipes fetched by one
+# GET /api/recipe/recipes/batch/?ids= request
+RECIPE_BATCH_MAX_SIZE = int(os.environ.get('RECIPE_BATCH_MAX_SIZE', 100))
+
+# Idempotency-Key handling of recipe creation and image uploads (see
+# core.idempotency). Responses are replayed for IDEMPOTENCY_TTL seconds,
+# retries wait up to IDEMPOTENCY_WAIT_TIMEOUT seconds for a request in
+# flight, and a request that never finishes holds its key for
+# IDEMPOTENCY_LOCK_TIMEOUT seconds.
+IDEMPOTENCY_CACHE_ALIAS = 'default'
+IDEMPOTENCY_TTL = int(os.environ.get('IDEMPOTENCY_TTL', 24 * 60 * 60))
+IDEMPOTENCY_WAIT_TIMEOUT = 10
+IDEMPOTENCY_LOCK_TIMEOUT = 60
+
+# Seconds the tombstones of deleted recipes, tags and ingredients are kept
+# for delta syncs, pruned by `python manage.py prune_tombstones`. Clients
+# syncing from an older token are asked for a full sync (see core.sync)
+SYNC_TOMBSTONE_RETENTION = 90 * 24 * 60 * 60
+
+# Maximum number of operations in a /api/batch/ request (see core.batch)
+BATCH_MAX_OPERATIONS = int(os.environ.get('BATCH_MAX_OPERATIONS', 20))
+
+# Number of users whose similar recipes index each process keeps in
+# memory (see recipe.similarity)
+SIMILARITY_INDEX_MAX_USERS = 1000
+
+# Background jobs (core.jobs), run by `python manage.py worker`. Failed
+# jobs are retried after JOBS_RETRY_BACKOFF * 2 ** (attempt - 1) seconds,
+# capped at JOBS_RETRY_BACKOFF_MAX, and jobs running for longer than
+# JOBS_TIMEOUT are assumed lost with their worker and queued again.
+JOBS_CONCURRENCY = int(os.environ.get('JOBS_CONCURRENCY', 4))
+JOBS_POLL_INTERVAL = 1
+JOBS_MAX_ATTEMPTS = 3
+JOBS_RETRY_BACKOFF = 10
+JOBS_RETRY_BACKOFF_MAX = 3600
+JOBS_TIMEOUT = 3600
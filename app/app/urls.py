@@ -13,9 +13,11 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
-from drf_spectacular.views import (
-    SpectacularAPIView,
-    SpectacularSwaggerView,
+from core.views import (
+    BatchView,
+    CachedSpectacularAPIView,
+    CachedSpectacularSwaggerView,
+    serve_media,
 )
 from django.contrib import admin
 from django.urls import path, include
@@ -24,18 +26,24 @@ from django.conf import settings
 
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/schema/', SpectacularAPIView.as_view(), name="api-schema"),
+    path(
+        'api/schema/',
+        CachedSpectacularAPIView.as_view(),
+        name="api-schema"
+    ),
     path(
         'api/docs/',
-        SpectacularSwaggerView.as_view(url_name="api-schema"),
+        CachedSpectacularSwaggerView.as_view(url_name="api-schema"),
         name="api-docs"
     ),
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
+    path('api/batch/', BatchView.as_view(), name='batch'),
 ]
 
 if settings.DEBUG:
     urlpatterns += static(
         settings.MEDIA_URL,
-        document_root=settings.MEDIA_ROOT
+        document_root=settings.MEDIA_ROOT,
+        view=serve_media
     )
@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'app.settings')
 
 application = get_wsgi_application()
+
+# Imported after the application is set up, as it needs the app registry
+from core.schema import warm_schema_cache  # noqa: E402
+
+warm_schema_cache()
@@ -1,11 +1,19 @@
 """Django admin customization"""
 
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.db import DEFAULT_DB_ALIAS
+from django.http import HttpResponseRedirect
 from core import models
+from core.sharding import use_shard
 # Good practice to use translation
 from django.utils.translation import gettext_lazy as _
 
+# Query parameter of the change list selecting the database to manage
+SHARD_PARAM = 'shard'
+SHARD_SESSION_KEY = 'admin_shard'
+
 
 # This class defines the information shown about users in admin page
 class UserAdmin(BaseUserAdmin):
@@ -57,10 +65,73 @@ class UserAdmin(BaseUserAdmin):
     )
 
 
+class ShardedModelAdmin(admin.ModelAdmin):
+    """Admin pages for a model stored in its user's shard (see
+    core.sharding). The pages work on one database at a time, picked on
+    the change list with ?shard=<alias> and kept in the session, so
+    objects can only be given users placed in that database."""
+
+    def get_shard(self, request):
+        """Return the database the admin pages work on."""
+        shard = request.session.get(SHARD_SESSION_KEY, DEFAULT_DB_ALIAS)
+        return shard if shard in settings.DATABASES else DEFAULT_DB_ALIAS
+
+    def _in_shard(self, request, view, *args, **kwargs):
+        """Run an admin view and render its response in the shard, as the
+        querysets of its template are only evaluated then."""
+        with use_shard(self.get_shard(request)):
+            response = view(request, *args, **kwargs)
+            if hasattr(response, 'render'):
+                response.render()
+
+        return response
+
+    def changelist_view(self, request, extra_context=None):
+        if SHARD_PARAM in request.GET:
+            params = request.GET.copy()
+            shard = params.pop(SHARD_PARAM)[-1]
+            if shard in settings.DATABASES:
+                request.session[SHARD_SESSION_KEY] = shard
+            query = params.urlencode()
+            return HttpResponseRedirect(
+                f'{request.path}?{query}' if query else request.path
+            )
+
+        extra_context = {
+            'subtitle': _('Database: %s') % self.get_shard(request),
+            **(extra_context or {}),
+        }
+        return self._in_shard(
+            request, super().changelist_view, extra_context
+        )
+
+    def changeform_view(self, request, *args, **kwargs):
+        return self._in_shard(request, super().changeform_view, *args,
+                              **kwargs)
+
+    def delete_view(self, request, *args, **kwargs):
+        return self._in_shard(request, super().delete_view, *args,
+                              **kwargs)
+
+    def history_view(self, request, *args, **kwargs):
+        return self._in_shard(request, super().history_view, *args,
+                              **kwargs)
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name == 'user':
+            # Only the users placed in the shard
+            kwargs['queryset'] = models.User.objects.filter(
+                shard=self.get_shard(request)
+            )
+
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+
 # If we don't incldue UserAdmin here (it's optional param),
 # then the default behavior would be to use the default model
 # manager with the CRUD operations
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Recipe)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
+admin.site.register(models.Recipe, ShardedModelAdmin)
+admin.site.register(models.Tag, ShardedModelAdmin)
+admin.site.register(models.Ingredient, ShardedModelAdmin)
+admin.site.register(models.Job)
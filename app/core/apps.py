@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        # Connect the signal handlers
+        from core import signals  # noqa: F401
+        from core.sharding import reserve_id_range
+
+        post_migrate.connect(reserve_id_range, sender=self)
@@ -0,0 +1,208 @@
+"""
+Batch requests: several API calls in one HTTP round trip.
+
+Each operation is dispatched as a sub-request through the project URLconf,
+so it goes through the same views, serializers, permissions and throttles
+as a direct call. The batch is authenticated once and its user and token
+are forced on the sub-requests, so they don't query them again. Operation
+paths can reference the results of earlier operations, like
+`/api/recipe/recipes/{0.id}/upload-image/`.
+
+Only DRF API views can be called, other paths are a 404. An operation
+raising an unexpected exception gets a 500 result, like a direct call
+would, without failing the rest of the batch.
+
+With atomic, the operations run in one user_transaction, on the default
+database and on the user's shard, which is rolled back as soon as one of
+them fails, and the operations after it are skipped.
+"""
+import io
+import json
+import logging
+import re
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import transaction
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+from django.urls import Resolver404, resolve
+from rest_framework.views import APIView
+
+from core.renderers import JSONEncoder
+from core.sharding import user_transaction
+
+# Response headers passed on in the operation results
+RESULT_HEADERS = ['Location', 'ETag', 'Last-Modified', 'Retry-After']
+# Status of the operations skipped after a failure in an atomic batch
+FAILED_DEPENDENCY = 424
+
+REFERENCE = re.compile(r'\{(\d+)\.(\w+)\}')
+
+logger = logging.getLogger(__name__)
+
+
+class BatchError(Exception):
+    """An operation that can't be dispatched."""
+
+    def __init__(self, status, detail):
+        super().__init__(detail)
+        self.status = status
+        self.detail = detail
+
+
+def resolve_references(path, results):
+    """Replace the {index.field} references in path with the fields of the
+    earlier results."""
+
+    def replace(match):
+        index, field = int(match.group(1)), match.group(2)
+        body = results[index]['body'] if index < len(results) else None
+        if not isinstance(body, dict) or field not in body:
+            raise BatchError(400, f'Invalid reference {match.group(0)}.')
+
+        return str(body[field])
+
+    return REFERENCE.sub(replace, path)
+
+
+def build_request(request, method, path, body=None, files=None):
+    """Return a sub-request of request, sharing its headers."""
+    path, _, query = path.partition('?')
+    if files:
+        for file in files.values():
+            file.seek(0)
+        content_type = MULTIPART_CONTENT
+        content = encode_multipart(BOUNDARY, {**(body or {}), **files})
+    elif body is not None:
+        content_type = 'application/json'
+        content = json.dumps(body, cls=JSONEncoder).encode()
+    else:
+        content_type, content = '', b''
+
+    environ = dict(request.META)
+    # The batch's key would clash across operations
+    environ.pop('HTTP_IDEMPOTENCY_KEY', None)
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'CONTENT_TYPE': content_type,
+        'CONTENT_LENGTH': str(len(content)),
+        'wsgi.input': io.BytesIO(content),
+        'wsgi.url_scheme': request.scheme,
+    })
+    sub_request = WSGIRequest(environ)
+    # Picked up by DRF's Request in place of the view's authenticators
+    sub_request._force_auth_user = request.user
+    sub_request._force_auth_token = request.auth
+
+    return sub_request
+
+
+def close_response(response):
+    """Close the resources a sub-response holds, like the file of a
+    FileResponse. response.close() would also send request_finished,
+    closing the database connections in the middle of the batch."""
+    for closer in getattr(response, '_resource_closers', []):
+        closer()
+    response._resource_closers = []
+
+
+def run_operation(request, operation, results):
+    """Dispatch one operation and return its result."""
+    path = resolve_references(operation['path'], results)
+    try:
+        match = resolve(path.partition('?')[0])
+    except Resolver404:
+        raise BatchError(404, 'Not found.')
+    view_class = getattr(match.func, 'cls', None)
+    if not (isinstance(view_class, type) and issubclass(view_class, APIView)):
+        # Other views expect the middleware to have run
+        raise BatchError(404, 'Not found.')
+    if match.func is request.resolver_match.func:
+        raise BatchError(400, 'Batches can\'t be nested.')
+
+    sub_request = build_request(
+        request,
+        operation['method'],
+        path,
+        operation.get('body'),
+        operation.get('files')
+    )
+    sub_request.resolver_match = match
+    response = match.func(sub_request, *match.args, **match.kwargs)
+    close_response(response)
+
+    return {
+        'status': response.status_code,
+        'headers': {
+            name: response[name] for name in RESULT_HEADERS
+            if response.has_header(name)
+        },
+        # Only API views return data, file responses have no body
+        'body': getattr(response, 'data', None),
+    }
+
+
+def _run_operations(request, operations, atomic):
+    """Run operations in order, stopping at the first failure if
+    atomic."""
+    user = request.user
+    results = []
+    for operation in operations:
+        if atomic and results and results[-1]['status'] >= 400:
+            results.append({
+                'status': FAILED_DEPENDENCY,
+                'headers': {},
+                'body': {'detail': 'Skipped after an earlier failure.'},
+            })
+            continue
+
+        try:
+            result = run_operation(request, operation, results)
+        except BatchError as exc:
+            result = {
+                'status': exc.status,
+                'headers': {},
+                'body': {'detail': exc.detail},
+            }
+        except Exception:
+            logger.exception('Batch operation %s %s failed.',
+                             operation['method'], operation['path'])
+            result = {
+                'status': 500,
+                'headers': {},
+                'body': {'detail': 'Internal server error.'},
+            }
+        results.append(result)
+
+        if operation['method'] != 'GET':
+            # Writes move the user's change sequence forward, which later
+            # operations read from the shared user
+            user.refresh_from_db(fields=['change_seq'])
+
+    return results
+
+
+def run_batch(request, operations, atomic=False):
+    """Run the operations of a batch request and return their results and
+    whether they were all committed."""
+    if not atomic:
+        return _run_operations(request, operations, atomic), True
+
+    with user_transaction(request.user) as databases:
+        results = _run_operations(request, operations, atomic)
+        committed = all(result['status'] < 400 for result in results)
+        if not committed:
+            for using in databases:
+                transaction.set_rollback(True, using=using)
+
+    if not committed:
+        request.user.refresh_from_db()
+
+    return results, committed
+
+
+def get_max_operations():
+    """Return the maximum number of operations in a batch."""
+    return getattr(settings, 'BATCH_MAX_OPERATIONS', 20)
@@ -0,0 +1,52 @@
+"""
+Helpers for the micro benchmarks run by the `benchmark` command.
+
+Each app can ship a `benchmarks.py` module registering functions with
+`register`. A benchmark function receives the number of iterations to run
+and returns a list of `(label, seconds_per_op)` rows.
+"""
+import time
+from contextlib import contextmanager
+
+from django.db import transaction
+
+_registry = {}
+
+
+class Rollback(Exception):
+    """Raised to roll back the data created by a benchmark."""
+
+
+def register(name):
+    """Register a benchmark function under the given name."""
+    def decorator(func):
+        _registry[name] = func
+        return func
+
+    return decorator
+
+
+def get_benchmarks():
+    """Return registered benchmarks sorted by name."""
+    return sorted(_registry.items())
+
+
+def timeit(func, number):
+    """Return the average time in seconds of calling func number times."""
+    start = time.perf_counter()
+    for _ in range(number):
+        func()
+
+    return (time.perf_counter() - start) / number
+
+
+@contextmanager
+def rollback():
+    """Run the block in a transaction that is always rolled back, so
+    benchmarks can create fixtures without leaving rows behind."""
+    try:
+        with transaction.atomic():
+            yield
+            raise Rollback
+    except Rollback:
+        pass
@@ -0,0 +1,102 @@
+"""
+Benchmarks for the shared core components.
+"""
+import io
+from decimal import Decimal
+
+from types import SimpleNamespace
+
+from rest_framework import renderers as drf_renderers
+from rest_framework import parsers as drf_parsers
+
+from core import renderers, parsers
+from core.benchmarking import register, timeit
+from core.throttles import ActionRateThrottle
+
+
+def sample_recipes(count=500):
+    """Return a recipe list payload shaped like the list API response."""
+    return [
+        {
+            'id': i,
+            'title': f'Recipe {i}',
+            'time_minutes': i % 90,
+            'price': Decimal('5.25'),
+            'link': f'https://example.com/recipes/{i}.pdf',
+            'tags': [{'id': t, 'name': f'Tag {t}'} for t in range(5)],
+            'ingredients': [
+                {'id': n, 'name': f'Ingredient {n}'} for n in range(10)
+            ],
+        }
+        for i in range(count)
+    ]
+
+
+@register('renderers')
+def bench_renderers(number):
+    """Compare DRF's stdlib JSON renderer/parser against core's."""
+    data = sample_recipes()
+    drf_renderer = drf_renderers.JSONRenderer()
+    renderer = renderers.JSONRenderer()
+    body = renderer.render(data)
+
+    def parse(parser):
+        return lambda: parser.parse(io.BytesIO(body))
+
+    number = max(number // 10, 1)
+    return [
+        ('render drf json', timeit(lambda: drf_renderer.render(data), number)),
+        ('render core json', timeit(lambda: renderer.render(data), number)),
+        ('parse drf json', timeit(parse(drf_parsers.JSONParser()), number)),
+        ('parse core json', timeit(parse(parsers.JSONParser()), number)),
+    ]
+
+
+@register('binary')
+def bench_binary(number):
+    """Compare the size and render/parse time of the MessagePack and CBOR
+    formats against JSON, for the formats whose packages are installed."""
+    data = sample_recipes()
+    formats = [('json', renderers.JSONRenderer(), parsers.JSONParser())]
+    if renderers.msgpack is not None:
+        formats.append((
+            'msgpack', renderers.MessagePackRenderer(),
+            parsers.MessagePackParser()
+        ))
+    if renderers.cbor2 is not None:
+        formats.append(
+            ('cbor', renderers.CBORRenderer(), parsers.CBORParser())
+        )
+
+    number = max(number // 10, 1)
+    results = []
+    for name, renderer, parser in formats:
+        body = renderer.render(data)
+        results += [
+            (f'render {name} ({len(body)} bytes)',
+             timeit(lambda: renderer.render(data), number)),
+            (f'parse {name}',
+             timeit(lambda: parser.parse(io.BytesIO(body)), number)),
+        ]
+
+    return results
+
+
+@register('throttle')
+def bench_throttle(number):
+    """Measure the overhead of the sliding window throttle check, which
+    should stay under 0.1 ms per request."""
+    user = SimpleNamespace(pk=1, is_authenticated=True)
+    request = SimpleNamespace(user=user, META={'REMOTE_ADDR': '127.0.0.1'})
+    view = SimpleNamespace(
+        action='create',
+        throttle_scopes={'create': 'benchmark'},
+    )
+
+    class Throttle(ActionRateThrottle):
+        THROTTLE_RATES = {'benchmark': f'{number * 2}/day'}
+
+    def check():
+        Throttle().allow_request(request, view)
+
+    return [('allow_request', timeit(check, number))]
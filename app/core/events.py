@@ -0,0 +1,120 @@
+"""
+Publish/subscribe of per user change events.
+
+Signal handlers publish an event whenever a user's recipes, tags,
+ingredients or images change, and the Server-Sent Events feed
+(core.sse) subscribes to them. The broker is set by EVENTS_BROKER. The
+default InProcessBroker only reaches subscribers in the same process, a
+broker backed by a shared service can be plugged in for multi-process
+deployments.
+"""
+import asyncio
+import threading
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+RESYNC_EVENT = {'type': 'resync'}
+
+
+class Subscription:
+    """Bounded queue of the events sent to one connection."""
+
+    def __init__(self, user_id, max_size):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_size)
+
+    def put(self, event):
+        """Queue an event. Must run in the subscription's event loop.
+
+        A client that can't keep up gets its backlog replaced by a single
+        resync event, so memory stays bounded and it catches up with a
+        delta sync instead."""
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC_EVENT)
+
+    async def get(self, timeout):
+        """Wait up to timeout seconds for the next event, or None."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class BaseBroker:
+    """Interface of the event brokers."""
+
+    def subscribe(self, user_id):
+        """Return a Subscription receiving the user's events. Must be
+        called from the event loop serving the connection."""
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        """Stop sending events to a subscription."""
+        raise NotImplementedError
+
+    def publish(self, user_id, event):
+        """Send an event to the user's subscriptions. Can be called from
+        any thread."""
+        raise NotImplementedError
+
+
+class InProcessBroker(BaseBroker):
+    """Broker delivering events to subscribers in this process.
+
+    Subscriptions are indexed by user, so publishing only touches that
+    user's connections however many idle ones the process holds."""
+
+    def __init__(self):
+        self.max_size = getattr(settings, 'EVENTS_QUEUE_SIZE', 100)
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, user_id):
+        subscription = Subscription(user_id, self.max_size)
+        with self._lock:
+            self._subscriptions.setdefault(user_id, set()).add(subscription)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def publish(self, user_id, event):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+
+        for subscription in subscriptions:
+            # Writes run in worker threads, queues belong to the loop
+            subscription.loop.call_soon_threadsafe(subscription.put, event)
+
+
+@lru_cache(maxsize=None)
+def get_broker():
+    """Return the configured broker."""
+    return import_string(
+        getattr(settings, 'EVENTS_BROKER', 'core.events.InProcessBroker')
+    )()
+
+
+def publish_change(user_id, kind, action, object_ids, seq):
+    """Publish a change event once the current transaction commits."""
+    event = {
+        'type': kind,
+        'action': action,
+        'ids': sorted(object_ids),
+        'token': str(seq),
+    }
+    transaction.on_commit(lambda: get_broker().publish(user_id, event))
@@ -0,0 +1,50 @@
+"""
+Password hashers with a work factor configurable per deployment.
+
+Django rehashes a password on the next successful login whenever the
+preferred hasher or its work factor changes, so changing these settings
+upgrades stored hashes transparently.
+"""
+from django.conf import settings
+from django.contrib.auth import hashers
+
+
+class PBKDF2PasswordHasher(hashers.PBKDF2PasswordHasher):
+    """PBKDF2 hasher using PASSWORD_HASH_ITERATIONS iterations."""
+
+    @property
+    def iterations(self):
+        return (
+            getattr(settings, 'PASSWORD_HASH_ITERATIONS', None)
+            or hashers.PBKDF2PasswordHasher.iterations
+        )
+
+
+class Argon2PasswordHasher(hashers.Argon2PasswordHasher):
+    """Argon2 hasher using PASSWORD_HASH_TIME_COST and
+    PASSWORD_HASH_MEMORY_COST."""
+
+    @property
+    def time_cost(self):
+        return (
+            getattr(settings, 'PASSWORD_HASH_TIME_COST', None)
+            or hashers.Argon2PasswordHasher.time_cost
+        )
+
+    @property
+    def memory_cost(self):
+        return (
+            getattr(settings, 'PASSWORD_HASH_MEMORY_COST', None)
+            or hashers.Argon2PasswordHasher.memory_cost
+        )
+
+
+class BCryptSHA256PasswordHasher(hashers.BCryptSHA256PasswordHasher):
+    """BCrypt hasher using PASSWORD_HASH_ROUNDS rounds."""
+
+    @property
+    def rounds(self):
+        return (
+            getattr(settings, 'PASSWORD_HASH_ROUNDS', None)
+            or hashers.BCryptSHA256PasswordHasher.rounds
+        )
@@ -0,0 +1,199 @@
+"""
+Idempotency keys, making retried writes safe.
+
+A client sends the same `Idempotency-Key` header with every attempt of a
+write. The first request with a key runs the view, and its response is
+stored per user and key for IDEMPOTENCY_TTL seconds. Retries get the
+stored response back, marked with `Idempotent-Replayed: true`, without
+running the view again. A retry arriving while the first request is still
+running waits for its response, up to IDEMPOTENCY_WAIT_TIMEOUT, then gets
+a 409. Reusing a key for another request (method, path or data) is a 422.
+
+Only returned responses are stored, once the request's transaction is
+committed, so a retry is never answered for writes that were rolled
+back. A view raising an exception, like a validation error, or answering
+with a 5xx releases the key, so the next attempt runs again. A request
+that never finishes, or fails to commit, holds its key for
+IDEMPOTENCY_LOCK_TIMEOUT.
+
+Keys are kept in IDEMPOTENCY_CACHE_ALIAS, which has to be shared by all
+the processes serving the API. Without it, a process local cache is used.
+"""
+import functools
+import hashlib
+import json
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.uploadedfile import UploadedFile
+from django.db import transaction
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from core.renderers import JSONEncoder
+from core.storage import get_content_hash
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+MAX_KEY_LENGTH = 255
+# Response headers stored with the response data
+STORED_HEADERS = ['Location', 'ETag', 'Last-Modified']
+# Seconds between checks for the response of a request in flight,
+# doubling up to the maximum
+POLL_INTERVAL = 0.05
+POLL_INTERVAL_MAX = 0.5
+
+_fallback_cache = LocMemCache('idempotency', {})
+
+
+class IdempotencyConflict(APIException):
+    """A request with the same key is still running."""
+    status_code = 409
+    default_detail = (
+        'A request with this Idempotency-Key is still in progress.'
+    )
+    default_code = 'idempotency_conflict'
+    # Sent as Retry-After
+    wait = 1
+
+
+class IdempotencyKeyReused(APIException):
+    """The key was used for another request."""
+    status_code = 422
+    default_detail = 'This Idempotency-Key was used for another request.'
+    default_code = 'idempotency_key_reused'
+
+
+class FingerprintEncoder(JSONEncoder):
+    """JSON encoder representing uploaded files by their hash."""
+
+    def default(self, obj):
+        if isinstance(obj, UploadedFile):
+            return get_content_hash(obj)
+
+        return super().default(obj)
+
+
+def get_idempotency_cache():
+    """Return the cache holding idempotency keys: IDEMPOTENCY_CACHE_ALIAS
+    when it's configured, a process local cache otherwise."""
+    alias = getattr(settings, 'IDEMPOTENCY_CACHE_ALIAS', None)
+    if alias and alias in settings.CACHES:
+        return caches[alias]
+
+    return _fallback_cache
+
+
+def get_cache_key(user, key):
+    """Return the cache key of a user's idempotency key."""
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return f'idempotency:{user.pk}:{digest}'
+
+
+def get_fingerprint(request):
+    """Return a hash of the method, path and data of a request."""
+    data = request.data
+    if hasattr(data, 'lists'):
+        data = dict(data.lists())
+    content = json.dumps(
+        [request.method, request.path, data],
+        cls=FingerprintEncoder,
+        sort_keys=True
+    )
+
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def _replay(stored):
+    """Return a stored response."""
+    return Response(
+        stored['data'],
+        status=stored['status'],
+        headers={**stored['headers'], REPLAYED_HEADER: 'true'}
+    )
+
+
+def _release(cache, cache_key, claim):
+    """Release a key, unless its claim expired and it was claimed
+    again."""
+    if cache.get(cache_key) == claim:
+        cache.delete(cache_key)
+
+
+def run_idempotent(request, run):
+    """Return the response of run(), or the stored response of an earlier
+    request with the same Idempotency-Key."""
+    key = request.headers.get(HEADER)
+    if key is None:
+        return run()
+    if not key or len(key) > MAX_KEY_LENGTH:
+        raise ValidationError(
+            {HEADER: f'Must be 1 to {MAX_KEY_LENGTH} characters long.'}
+        )
+
+    cache = get_idempotency_cache()
+    cache_key = get_cache_key(request.user, key)
+    fingerprint = get_fingerprint(request)
+    claim = {'fingerprint': fingerprint, 'claim': uuid.uuid4().hex}
+    deadline = time.monotonic() + getattr(
+        settings, 'IDEMPOTENCY_WAIT_TIMEOUT', 10
+    )
+    interval = POLL_INTERVAL
+    lock_timeout = getattr(settings, 'IDEMPOTENCY_LOCK_TIMEOUT', 60)
+    while not cache.add(cache_key, claim, lock_timeout):
+        stored = cache.get(cache_key)
+        if stored is None:
+            # Released by a failed request, claim it again
+            continue
+        if stored['fingerprint'] != fingerprint:
+            raise IdempotencyKeyReused()
+        if 'status' in stored:
+            return _replay(stored)
+        if time.monotonic() >= deadline:
+            raise IdempotencyConflict()
+
+        time.sleep(interval)
+        interval = min(interval * 2, POLL_INTERVAL_MAX)
+
+    try:
+        response = run()
+    except BaseException:
+        _release(cache, cache_key, claim)
+        raise
+
+    if response.status_code >= 500:
+        _release(cache, cache_key, claim)
+        return response
+
+    stored = {
+        'fingerprint': fingerprint,
+        'status': response.status_code,
+        'data': response.data,
+        'headers': {
+            name: response[name] for name in STORED_HEADERS
+            if response.has_header(name)
+        },
+    }
+    # API writes commit when the view returns (see
+    # core.sharding.user_transaction), the default database last
+    transaction.on_commit(lambda: cache.set(
+        cache_key, stored, getattr(settings, 'IDEMPOTENCY_TTL', 24 * 60 * 60)
+    ))
+
+    return response
+
+
+def idempotent(method):
+    """Decorate an API view method to honour the Idempotency-Key
+    header."""
+
+    @functools.wraps(method)
+    def wrapper(self, request, *args, **kwargs):
+        return run_idempotent(
+            request, lambda: method(self, request, *args, **kwargs)
+        )
+
+    return wrapper
@@ -0,0 +1,166 @@
+"""
+Database backed background jobs.
+
+`enqueue` stores a job in the jobs table, in the caller's transaction, so
+a job is only run if the work that queued it is committed. The `worker`
+command claims due jobs with SELECT ... FOR UPDATE SKIP LOCKED, so any
+number of workers can poll the table without blocking each other, and no
+broker is needed. Failed jobs are retried with exponential backoff until
+they run out of attempts.
+
+A job still running after JOBS_TIMEOUT is assumed lost with its worker
+and queued again, so a slow job can run twice at the same time: tasks
+must be idempotent. Only the run holding the latest claim records its
+outcome, the outcome of a superseded run is dropped.
+"""
+import logging
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count, F, Min, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from core.models import Job
+
+logger = logging.getLogger(__name__)
+
+
+def get_task_path(task):
+    """Return the dotted path of a task function."""
+    if isinstance(task, str):
+        return task
+
+    return f'{task.__module__}.{task.__qualname__}'
+
+
+def enqueue(task, run_at=None, max_attempts=None, **kwargs):
+    """Queue a call of task, a function or its dotted path, with kwargs.
+    kwargs must be JSON serializable."""
+    return Job.objects.create(
+        task=get_task_path(task),
+        kwargs=kwargs,
+        run_at=run_at or timezone.now(),
+        max_attempts=max_attempts or getattr(settings, 'JOBS_MAX_ATTEMPTS', 3)
+    )
+
+
+def claim_jobs(limit):
+    """Mark up to limit due jobs as running and return them. Rows locked by
+    other workers are skipped rather than waited for."""
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            Job.objects.select_for_update(skip_locked=True).filter(
+                status=Job.QUEUED,
+                run_at__lte=now
+            ).order_by('run_at', 'id').values_list('id', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+
+        Job.objects.filter(id__in=ids).update(
+            status=Job.RUNNING,
+            started_at=now,
+            attempts=F('attempts') + 1
+        )
+
+    return list(Job.objects.filter(id__in=ids).order_by('run_at', 'id'))
+
+
+def get_retry_delay(attempts):
+    """Return the delay before retrying a job that failed attempts times:
+    exponential backoff, with jitter so failed jobs don't retry in step."""
+    base = getattr(settings, 'JOBS_RETRY_BACKOFF', 10)
+    maximum = getattr(settings, 'JOBS_RETRY_BACKOFF_MAX', 3600)
+    delay = min(base * 2 ** (attempts - 1), maximum)
+
+    return timedelta(seconds=delay * random.uniform(0.5, 1))
+
+
+def run_job(job):
+    """Run a claimed job and record its outcome. Returns the job status."""
+    try:
+        import_string(job.task)(**job.kwargs)
+    except Exception:
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + get_retry_delay(job.attempts)
+        else:
+            job.status = Job.FAILED
+            job.finished_at = timezone.now()
+        logger.warning(
+            'Job %s (%s) failed, attempt %s of %s.',
+            job.id, job.task, job.attempts, job.max_attempts
+        )
+    else:
+        job.status = Job.SUCCEEDED
+        job.finished_at = timezone.now()
+
+    # Only complete the claim this run holds, the job may have been
+    # requeued and claimed again meanwhile
+    updated = Job.objects.filter(
+        id=job.id, status=Job.RUNNING, attempts=job.attempts
+    ).update(
+        status=job.status,
+        run_at=job.run_at,
+        finished_at=job.finished_at,
+        last_error=job.last_error
+    )
+    if not updated:
+        logger.warning(
+            'Job %s (%s) was requeued while running, attempt %s dropped.',
+            job.id, job.task, job.attempts
+        )
+
+    return job.status
+
+
+def requeue_stale_jobs():
+    """Queue again the jobs left running by a worker that died, or fail
+    them if they ran out of attempts. Returns the number requeued."""
+    timeout = getattr(settings, 'JOBS_TIMEOUT', 3600)
+    now = timezone.now()
+    stale = Job.objects.filter(
+        status=Job.RUNNING,
+        started_at__lt=now - timedelta(seconds=timeout)
+    )
+    stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED,
+        finished_at=now,
+        last_error='Timed out.'
+    )
+
+    return stale.update(status=Job.QUEUED, run_at=now)
+
+
+def get_job_metrics():
+    """Return the number of jobs per status, the lag of the oldest due job
+    and the average run time of succeeded jobs, in seconds."""
+    now = timezone.now()
+    metrics = {status: 0 for status, _ in Job.STATUS_CHOICES}
+    metrics.update(
+        Job.objects.order_by().values_list('status').annotate(Count('id'))
+    )
+
+    stats = Job.objects.aggregate(
+        oldest_due=Min(
+            'run_at', filter=Q(status=Job.QUEUED, run_at__lte=now)
+        ),
+        average_run_time=Avg(
+            F('finished_at') - F('started_at'),
+            filter=Q(status=Job.SUCCEEDED)
+        ),
+    )
+    oldest_due = stats['oldest_due']
+    average_run_time = stats['average_run_time']
+    metrics['lag'] = (now - oldest_due).total_seconds() if oldest_due else 0
+    metrics['average_run_time'] = (
+        average_run_time.total_seconds() if average_run_time else 0
+    )
+
+    return metrics
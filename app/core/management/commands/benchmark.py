@@ -0,0 +1,38 @@
+"""
+Django command to run the registered micro benchmarks
+"""
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import autodiscover_modules
+
+from core.benchmarking import get_benchmarks
+
+
+class Command(BaseCommand):
+    """Django command to run benchmarks."""
+    help = "Run the benchmarks registered in each app's benchmarks.py"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names',
+            nargs='*',
+            help='Only run the benchmarks with these names.'
+        )
+        parser.add_argument(
+            '--number',
+            type=int,
+            default=1000,
+            help='Iterations per measurement.'
+        )
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        autodiscover_modules('benchmarks')
+        names = options['names']
+
+        for name, func in get_benchmarks():
+            if names and name not in names:
+                continue
+
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            for label, seconds in func(options['number']):
+                self.stdout.write(f"  {label:<40} {seconds * 1e6:>12.2f} us")
@@ -0,0 +1,164 @@
+"""
+Django command to delete recipe images no recipe references anymore
+
+Content addressed images can be reused by a new upload at any time, which
+refreshes the file's mtime and increments its StoredFile reference count.
+So each batch of orphans is checked again just before its files are
+removed, with the StoredFile rows locked: files in use again or modified
+since the grace period started are kept.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Recipe, StoredFile
+from core.sharding import get_shard_databases
+from core.storage import delete_files
+
+RECIPE_IMAGE_DIR = 'uploads/recipe'
+
+
+def walk_files(storage, directory, max_mtime):
+    """Return the (name, size) of the files under a storage directory
+    last modified before max_mtime."""
+    files = []
+    pending = [directory]
+    while pending:
+        current = pending.pop()
+        try:
+            entries = os.scandir(storage.path(current))
+        except FileNotFoundError:
+            continue
+
+        with entries:
+            for entry in entries:
+                name = f'{current}/{entry.name}'
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(name)
+                    continue
+
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime < max_mtime:
+                    files.append((name, stat.st_size))
+
+    return files
+
+
+def get_referenced_images(chunk_size=2000):
+    """Return the names of the images referenced by recipes, streamed from
+    the databases in chunks."""
+    referenced = set()
+    for using in get_shard_databases():
+        names = Recipe.objects.using(using).exclude(image='').exclude(
+            image__isnull=True
+        ).values_list('image', flat=True)
+        referenced.update(names.iterator(chunk_size=chunk_size))
+
+    return referenced
+
+
+def delete_batch(pool, storage, names, max_mtime, workers):
+    """Delete a batch of orphaned files that are still unused, with their
+    StoredFile rows, returning the number deleted."""
+    with transaction.atomic():
+        # Uploads reusing a file wait for the lock to count their
+        # reference, and the files they reuse are skipped on their mtime
+        in_use = set(StoredFile.objects.select_for_update().filter(
+            name__in=names, ref_count__gt=0
+        ).values_list('name', flat=True))
+        names = [name for name in names if name not in in_use]
+
+        chunks = [names[i::workers] for i in range(workers)]
+        deleted = [
+            name for chunk in pool.map(
+                lambda chunk: delete_files(storage, chunk, max_mtime),
+                chunks
+            )
+            for name in chunk
+        ]
+        StoredFile.objects.filter(name__in=deleted, ref_count=0).delete()
+
+    return len(deleted)
+
+
+class Command(BaseCommand):
+    """Django command to garbage collect orphaned recipe images."""
+    help = "Delete recipe images that no recipe references anymore"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the files that would be deleted.'
+        )
+        parser.add_argument(
+            '--grace-period',
+            type=int,
+            default=24 * 60 * 60,
+            help=(
+                'Keep files modified in the last N seconds (default one '
+                'day), so uploads in flight are never deleted.'
+            )
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Number of files deleted per batch.'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of threads deleting the files of a batch.'
+        )
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        storage = Recipe._meta.get_field('image').storage
+        # Files written or reused after the start are at most grace period
+        # old, so the references read below can't miss them
+        max_mtime = time.time() - options['grace_period']
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            # Walk the file system while the database streams references
+            walk = pool.submit(
+                walk_files, storage, RECIPE_IMAGE_DIR, max_mtime
+            )
+            referenced = get_referenced_images()
+            files = walk.result()
+
+            orphans = sorted(
+                (name, size) for name, size in files
+                if name not in referenced
+            )
+            names = [name for name, _ in orphans]
+            size = sum(size for _, size in orphans)
+
+            self.stdout.write(
+                f"{len(files)} files older than the grace period, "
+                f"{len(orphans)} unreferenced ({size} bytes)"
+            )
+            if options['verbosity'] > 1:
+                for name in names:
+                    self.stdout.write(f"  {name}")
+
+            if options['dry_run']:
+                return
+
+            batch_size = options['batch_size']
+            deleted = sum(
+                delete_batch(
+                    pool,
+                    storage,
+                    names[i:i + batch_size],
+                    max_mtime,
+                    options['workers']
+                )
+                for i in range(0, len(names), batch_size)
+            )
+
+        self.stdout.write(self.style.SUCCESS(f"{deleted} files deleted!"))
@@ -0,0 +1,43 @@
+"""
+Django command to precompute the cached OpenAPI schema
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.schema import (
+    clear_schema_cache,
+    generate_schema,
+    get_cache_path,
+    get_code_fingerprint,
+    write_disk_cache,
+)
+
+
+class Command(BaseCommand):
+    """Django command to generate the schema cache."""
+    help = "Generate the OpenAPI schema and store it in SCHEMA_CACHE_DIR"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lang',
+            action='append',
+            default=[],
+            help='Also generate the schema for this language.'
+        )
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        clear_schema_cache()
+        languages = dict(settings.LANGUAGES)
+
+        for lang in [None] + options['lang']:
+            if lang is not None and lang not in languages:
+                self.stderr.write(f"Unknown language {lang}, skipping.")
+                continue
+
+            write_disk_cache(generate_schema(lang=lang), lang)
+            self.stdout.write(f"Schema written to {get_cache_path(lang)}")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Schema cache generated for version {get_code_fingerprint()}"
+        ))
@@ -0,0 +1,57 @@
+"""
+Django command to partition the recipe tables by user on PostgreSQL
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+
+from core.partitioning import PartitioningError, get_partition_sql
+
+
+class Command(BaseCommand):
+    """Django command to hash partition the recipe tables by user_id."""
+    help = (
+        "Partition the recipe, recipe tag and recipe ingredient tables by "
+        "HASH (user_id). The tables are rebuilt in one transaction, so "
+        "they're locked until it's done."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--partitions',
+            type=int,
+            default=16,
+            help='Number of partitions of each table.'
+        )
+        parser.add_argument(
+            '--database',
+            default=DEFAULT_DB_ALIAS,
+            help='Database to partition.'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only print the SQL statements.'
+        )
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        connection = connections[options['database']]
+        try:
+            statements = get_partition_sql(connection, options['partitions'])
+        except PartitioningError as exc:
+            raise CommandError(str(exc))
+
+        if options['dry_run']:
+            for statement in statements:
+                self.stdout.write(f"{statement};")
+            return
+
+        with transaction.atomic(using=options['database']):
+            with connection.cursor() as cursor:
+                for statement in statements:
+                    cursor.execute(statement)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Recipe tables partitioned in {options['partitions']} "
+            f"partitions!"
+        ))
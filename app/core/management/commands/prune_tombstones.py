@@ -0,0 +1,51 @@
+"""
+Django command to delete the sync tombstones older than the retention
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.sharding import get_shard_databases
+from core.sync import prune_tombstones
+
+
+class Command(BaseCommand):
+    """Django command to prune sync tombstones."""
+    help = "Delete sync tombstones older than SYNC_TOMBSTONE_RETENTION"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention',
+            type=int,
+            default=None,
+            help=(
+                'Keep tombstones written in the last N seconds, '
+                'SYNC_TOMBSTONE_RETENTION by default.'
+            )
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of tombstones deleted per transaction.'
+        )
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        retention = options['retention']
+        if retention is None:
+            retention = getattr(
+                settings, 'SYNC_TOMBSTONE_RETENTION', 90 * 24 * 60 * 60
+            )
+        before = timezone.now() - timedelta(seconds=retention)
+
+        deleted = sum(
+            prune_tombstones(before, using, options['batch_size'])
+            for using in get_shard_databases()
+        )
+
+        self.stdout.write(
+            self.style.SUCCESS(f"{deleted} tombstones deleted!")
+        )
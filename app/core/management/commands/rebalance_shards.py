@@ -0,0 +1,72 @@
+"""
+Django command to move users between the databases holding their recipes
+"""
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import User
+from core.rebalancing import move_user
+from core.sharding import get_shards, get_user_shard, pick_shard
+
+
+class Command(BaseCommand):
+    """Django command to move users to their shard."""
+    help = (
+        "Move users to the shard they hash to among RECIPE_SHARDS, or to "
+        "--to. Each user's writes are rejected while they're moved."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--users',
+            nargs='+',
+            type=int,
+            help='Ids of the users to move, all of them by default.'
+        )
+        parser.add_argument(
+            '--to',
+            help='Database to move the users to.'
+        )
+        parser.add_argument(
+            '--grace-period',
+            type=float,
+            default=5,
+            help=(
+                'Seconds to wait for a user\'s writes in flight before '
+                'copying their rows.'
+            )
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the users that would be moved.'
+        )
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        target = options['to']
+        shards = get_shards()
+        for alias in [target] if target else shards:
+            if alias not in settings.DATABASES:
+                raise CommandError(f"Unknown database {alias}.")
+
+        users = User.objects.order_by('pk')
+        if options['users']:
+            users = users.filter(pk__in=options['users'])
+
+        moved = 0
+        for user in users.iterator():
+            source = get_user_shard(user)
+            destination = target or pick_shard(user.pk, shards)
+            if source == destination:
+                continue
+
+            self.stdout.write(f"{user.email}: {source} -> {destination}")
+            if not options['dry_run']:
+                move_user(user, destination, options['grace_period'])
+            moved += 1
+
+        if options['dry_run']:
+            self.stdout.write(f"{moved} users to move")
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{moved} users moved!"))
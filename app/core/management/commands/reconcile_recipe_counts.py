@@ -0,0 +1,58 @@
+"""
+Django command to recompute the denormalized recipe counts of tags and
+ingredients
+"""
+from django.core.management.base import BaseCommand
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from core.models import Recipe, Tag, Ingredient
+from core.sharding import get_shard_databases
+
+
+def get_actual_counts(model):
+    """Return a subquery counting the recipes using each row of model."""
+    field = 'tags' if model is Tag else 'ingredients'
+    through = getattr(Recipe, field).through
+    target = f'{model._meta.model_name}_id'
+
+    counts = through.objects.filter(**{target: OuterRef('pk')}).values(
+        target
+    ).annotate(count=Count('*')).values('count')
+
+    return Coalesce(Subquery(counts), 0)
+
+
+class Command(BaseCommand):
+    """Django command to reconcile recipe counts."""
+    help = "Fix recipe_count on tags and ingredients that drifted"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Only report the rows with a wrong count.'
+        )
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        for model in (Tag, Ingredient):
+            ids = []
+            for using in get_shard_databases():
+                objects = model.objects.using(using)
+                drifted = objects.annotate(
+                    actual=get_actual_counts(model)
+                ).exclude(recipe_count=F('actual'))
+                shard_ids = list(drifted.values_list('id', flat=True))
+
+                if shard_ids and not options['dry_run']:
+                    objects.filter(id__in=shard_ids).update(
+                        recipe_count=get_actual_counts(model)
+                    )
+                ids += shard_ids
+
+            name = model._meta.verbose_name_plural
+            self.stdout.write(f"{len(ids)} {name} with a wrong recipe count")
+
+        if not options['dry_run']:
+            self.stdout.write(self.style.SUCCESS("Recipe counts reconciled!"))
@@ -0,0 +1,148 @@
+"""
+Django command to run queued background jobs
+"""
+import signal
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core import jobs
+from core.models import Job
+
+# How often stale jobs are requeued and queue metrics are reported
+MAINTENANCE_INTERVAL = 60
+
+
+class InlineExecutor:
+    """Executor running calls in the calling thread, for a concurrency of
+    one."""
+
+    def submit(self, func, *args):
+        future = Future()
+        future.set_result(func(*args))
+        return future
+
+    def shutdown(self, wait=True):
+        pass
+
+
+class Command(BaseCommand):
+    """Django command to process background jobs."""
+    help = "Run queued background jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--concurrency',
+            type=int,
+            default=getattr(settings, 'JOBS_CONCURRENCY', 4),
+            help='Number of jobs run in parallel.'
+        )
+        parser.add_argument(
+            '--poll-interval',
+            type=float,
+            default=getattr(settings, 'JOBS_POLL_INTERVAL', 1),
+            help='Seconds to wait before polling an empty queue again.'
+        )
+        parser.add_argument(
+            '--burst',
+            action='store_true',
+            help='Exit once no job is due instead of waiting for more.'
+        )
+        parser.add_argument(
+            '--metrics',
+            action='store_true',
+            help='Only report the queue metrics.'
+        )
+
+    def write_metrics(self):
+        """Write the queue metrics on one line."""
+        metrics = jobs.get_job_metrics()
+        self.stdout.write(' '.join(
+            f'{name}={value:g}' if isinstance(value, float)
+            else f'{name}={value}'
+            for name, value in metrics.items()
+        ))
+
+    def stop(self, signum, frame):
+        """Finish the running jobs, then exit."""
+        self.stdout.write("Stopping once running jobs are done...")
+        self.stopping = True
+
+    def run_job(self, job):
+        """Run a job in a pool thread, which has its own connection."""
+        close_old_connections()
+        try:
+            return jobs.run_job(job)
+        finally:
+            close_old_connections()
+
+    def handle(self, *args, **options):
+        """Entry point for command."""
+        if options['metrics']:
+            self.write_metrics()
+            return
+
+        concurrency = max(options['concurrency'], 1)
+        if concurrency == 1:
+            executor, run_job = InlineExecutor(), jobs.run_job
+        else:
+            executor = ThreadPoolExecutor(max_workers=concurrency)
+            run_job = self.run_job
+
+        self.stopping = False
+        handlers = {
+            signum: signal.signal(signum, self.stop)
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        self.stdout.write(f"Worker started, concurrency {concurrency}")
+
+        counts = Counter()
+        running = set()
+        next_maintenance = 0
+        while not self.stopping:
+            if time.monotonic() >= next_maintenance:
+                requeued = jobs.requeue_stale_jobs()
+                if requeued:
+                    self.stdout.write(f"Requeued {requeued} stale jobs")
+                if options['verbosity'] > 1:
+                    self.write_metrics()
+                next_maintenance = time.monotonic() + MAINTENANCE_INTERVAL
+
+            free = concurrency - len(running)
+            claimed = jobs.claim_jobs(free) if free else []
+            for job in claimed:
+                running.add(executor.submit(run_job, job))
+
+            done = {future for future in running if future.done()}
+            if not claimed and not done:
+                if not running:
+                    if options['burst']:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                # Wake up when a slot frees up, or to poll again
+                done, _ = wait(
+                    running,
+                    timeout=options['poll_interval'],
+                    return_when=FIRST_COMPLETED
+                )
+
+            running -= done
+            counts.update(future.result() for future in done)
+
+        executor.shutdown(wait=True)
+        counts.update(future.result() for future in running)
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+
+        retried = counts[Job.QUEUED]
+        self.stdout.write(self.style.SUCCESS(
+            f"Processed {sum(counts.values())} jobs: "
+            f"{counts[Job.SUCCEEDED]} succeeded, {retried} retried, "
+            f"{counts[Job.FAILED]} failed"
+        ))
@@ -0,0 +1,159 @@
+"""
+Serving of protected media files.
+
+Views check permissions and let the web server send the file with
+X-Accel-Redirect (nginx) or X-Sendfile (Apache, lighttpd) when
+MEDIA_SENDFILE is set. Otherwise Django streams the file itself, with
+support for conditional and range requests.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import (
+    FileResponse,
+    Http404,
+    HttpResponse,
+    StreamingHttpResponse,
+)
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+X_ACCEL_REDIRECT = 'x-accel-redirect'
+X_SENDFILE = 'x-sendfile'
+
+
+def parse_range(header, size):
+    """Return the inclusive (start, end) byte range requested by a Range
+    header, or None to serve the whole file. Raises ValueError when the
+    range can't be satisfied."""
+    match = RANGE_RE.match(header.replace(' ', ''))
+    if match is None:
+        # Invalid and multiple ranges are ignored
+        return None
+
+    start, end = match.groups()
+    if not start:
+        if not end:
+            return None
+        # Suffix range, the last `end` bytes
+        length = int(end)
+        if length == 0 or size == 0:
+            raise ValueError('Unsatisfiable range.')
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size:
+        raise ValueError('Unsatisfiable range.')
+    if end < start:
+        return None
+
+    return start, end
+
+
+def _iter_range(f, length, chunk_size=FileResponse.block_size):
+    """Yield length bytes of an open file, closing it when done."""
+    with f:
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def _range_requested(request, etag, last_modified):
+    """Check the Range header applies, honouring If-Range."""
+    if 'HTTP_RANGE' not in request.META:
+        return False
+
+    if_range = request.META.get('HTTP_IF_RANGE')
+    return not if_range or if_range in (etag, http_date(last_modified))
+
+
+def _file_response(request, path, size, etag, last_modified, content_type):
+    """Stream a file from Django, or the requested range of it."""
+    byte_range = None
+    if _range_requested(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+    f = open(path, 'rb')
+    if byte_range is None:
+        response = FileResponse(f, content_type=content_type)
+    else:
+        start, end = byte_range
+        f.seek(start)
+        response = StreamingHttpResponse(
+            _iter_range(f, end - start + 1),
+            status=206,
+            content_type=content_type
+        )
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _sendfile_response(backend, name, path, content_type):
+    """Return an empty response handing the file off to the web server."""
+    response = HttpResponse(content_type=content_type)
+    if backend == X_ACCEL_REDIRECT:
+        prefix = getattr(
+            settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/'
+        )
+        response['X-Accel-Redirect'] = quote(prefix.rstrip('/') + '/' + name)
+    else:
+        response['X-Sendfile'] = path
+
+    return response
+
+
+def serve_file(request, storage, name, etag=None):
+    """Serve a file of a file system storage to a request allowed to read
+    it. The ETag defaults to one derived from the file's size and mtime,
+    callers knowing the file's content hash should pass it instead."""
+    path = storage.path(name)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404('File not found.')
+
+    last_modified = int(stat.st_mtime)
+    etag = quote_etag(etag or f'{stat.st_size:x}-{stat.st_mtime_ns:x}')
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        backend = getattr(settings, 'MEDIA_SENDFILE', None)
+        if backend in (X_ACCEL_REDIRECT, X_SENDFILE):
+            response = _sendfile_response(
+                backend, name, path, content_type
+            )
+        else:
+            response = _file_response(
+                request,
+                path,
+                stat.st_size,
+                etag,
+                last_modified,
+                content_type
+            )
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # Clients revalidate, which is a cheap 304 as long as it didn't change
+    patch_cache_control(response, private=True, no_cache=True)
+
+    return response
@@ -0,0 +1,169 @@
+"""
+Middleware shared by the APIs.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.cache import cc_delim_re, patch_vary_headers
+from django.utils.deprecation import MiddlewareMixin
+from django.utils.text import compress_string
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+DEFAULT_COMPRESSION_CONTENT_TYPES = [
+    'application/json',
+    'application/vnd.oai.openapi',
+    'application/vnd.oai.openapi+json',
+    'application/javascript',
+    'text/css',
+    'text/html',
+    'text/plain',
+]
+
+
+def parse_accept_encoding(header):
+    """Return the set of codings accepted by the client, ignoring the ones
+    explicitly refused with q=0."""
+    codings = set()
+    for part in header.split(','):
+        coding, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if params.startswith('q='):
+            try:
+                if float(params[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if coding:
+            codings.add(coding.lower())
+
+    return codings
+
+
+class CompressionMiddleware(MiddlewareMixin):
+    """
+    Compress responses with brotli (when installed) or gzip.
+
+    Only responses larger than COMPRESSION_MIN_SIZE whose content type is in
+    COMPRESSION_CONTENT_TYPES are compressed. When COMPRESSION_CACHE_ALIAS
+    is set, the compressed bodies of cacheable responses (public, or with
+    a max-age, like the ones of the cache middleware) are cached next to a
+    digest of the raw body, so hot responses aren't recompressed on every
+    hit. Per user responses are never requested again, and would only
+    evict the entries of other caches sharing the backend.
+    """
+
+    def __init__(self, get_response=None):
+        super().__init__(get_response)
+        self.min_size = getattr(settings, 'COMPRESSION_MIN_SIZE', 500)
+        self.content_types = set(getattr(
+            settings,
+            'COMPRESSION_CONTENT_TYPES',
+            DEFAULT_COMPRESSION_CONTENT_TYPES
+        ))
+        self.brotli_quality = getattr(
+            settings, 'COMPRESSION_BROTLI_QUALITY', 5
+        )
+        self.cache_alias = getattr(settings, 'COMPRESSION_CACHE_ALIAS', None)
+        self.cache_timeout = getattr(
+            settings, 'COMPRESSION_CACHE_TIMEOUT', 300
+        )
+
+    def get_encoding(self, request):
+        """Return the best encoding accepted by the client, if any."""
+        accepted = parse_accept_encoding(
+            request.META.get('HTTP_ACCEPT_ENCODING', '')
+        )
+        if brotli is not None and 'br' in accepted:
+            return 'br'
+        if 'gzip' in accepted:
+            return 'gzip'
+
+        return None
+
+    def should_compress(self, response):
+        """Check the response is worth compressing."""
+        if response.streaming or response.has_header('Content-Encoding'):
+            return False
+
+        content_type = response.get('Content-Type', '')
+        content_type = content_type.split(';')[0].strip().lower()
+        if content_type not in self.content_types:
+            return False
+
+        return len(response.content) >= self.min_size
+
+    def compress(self, content, encoding):
+        """Compress content with the given encoding."""
+        if encoding == 'br':
+            return brotli.compress(content, quality=self.brotli_quality)
+
+        return compress_string(content)
+
+    def get_cache_key(self, content, encoding):
+        """Build the cache key of the compressed form of a body. Hashing is
+        far cheaper than compressing, and keying by content can't leak a
+        response across users."""
+        digest = hashlib.blake2b(content, digest_size=16).hexdigest()
+        return f'compression:{encoding}:{digest}'
+
+    def is_cacheable(self, response):
+        """Check the response may be cached by shared caches."""
+        directives = {}
+        for directive in cc_delim_re.split(response.get('Cache-Control', '')):
+            name, _, value = directive.strip().lower().partition('=')
+            directives[name] = value
+        if directives.keys() & {'private', 'no-store', 'no-cache'}:
+            return False
+        if 'public' in directives:
+            return True
+
+        return any(
+            directives.get(name, '').isdigit() and int(directives[name]) > 0
+            for name in ('max-age', 's-maxage')
+        )
+
+    def get_compressed(self, response, encoding):
+        """Return the compressed content, using the cache for cacheable
+        responses if enabled."""
+        if self.cache_alias is None or not self.is_cacheable(response):
+            return self.compress(response.content, encoding)
+
+        cache = caches[self.cache_alias]
+        key = self.get_cache_key(response.content, encoding)
+        compressed = cache.get(key)
+        if compressed is None:
+            compressed = self.compress(response.content, encoding)
+            cache.set(key, compressed, self.cache_timeout)
+
+        return compressed
+
+    def process_response(self, request, response):
+        if not self.should_compress(response):
+            return response
+
+        patch_vary_headers(response, ('Accept-Encoding',))
+
+        encoding = self.get_encoding(request)
+        if encoding is None:
+            return response
+
+        compressed = self.get_compressed(response, encoding)
+        # Return the compressed content only if it's actually shorter.
+        if len(compressed) >= len(response.content):
+            return response
+
+        response.content = compressed
+        response.headers['Content-Length'] = str(len(compressed))
+
+        # A strong ETag must become weak once the body is re-encoded.
+        etag = response.get('ETag')
+        if etag and etag.startswith('"'):
+            response.headers['ETag'] = 'W/' + etag
+        response.headers['Content-Encoding'] = encoding
+
+        return response
@@ -0,0 +1,50 @@
+# Generated by Django 3.2.25 on 2026-10-19 09:10
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def populate_recipe_counts(apps, schema_editor):
+    """Count the recipes already using each tag and ingredient."""
+    Recipe = apps.get_model('core', 'Recipe')
+    for field, model_name in (('tags', 'Tag'), ('ingredients', 'Ingredient')):
+        through = getattr(Recipe, field).through
+        target = f'{model_name.lower()}_id'
+        counts = through.objects.filter(**{target: OuterRef('pk')}).values(
+            target
+        ).annotate(count=Count('*')).values('count')
+        apps.get_model('core', model_name).objects.update(
+            recipe_count=Coalesce(Subquery(counts), 0)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_recipe_image'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddIndex(
+            model_name='ingredient',
+            index=models.Index(fields=['user', 'recipe_count'], name='core_ingred_user_id_de1121_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['user', 'recipe_count'], name='core_tag_user_id_699afc_idx'),
+        ),
+        migrations.RunPython(
+            populate_recipe_counts, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 3.2.25 on 2026-10-19 10:12
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_user_shard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tombstone',
+            name='deleted_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='sync_horizon',
+            field=models.BigIntegerField(default=0, editable=False),
+        ),
+    ]
@@ -1,25 +1,25 @@
 """Database models."""
-import uuid
 import os
 
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin
 )
 
+from core.sharding import pick_shard
+from core.storage import get_recipe_image_storage
 
-def recipe_image_file_path(instance, filename):
-    """Generate file path for new recipe image"""
-    ext = os.path.splitext(filename)[1]
-    filename = f"{uuid.uuid4()}{ext}"
 
-    if instance:
-        return os.path.join('uploads', 'recipe', str(instance.id), filename)
+def recipe_image_file_path(instance, filename):
+    """Generate file path for new recipe image. The storage names it after
+    the hash of its content, so identical images are only stored once"""
+    ext = os.path.splitext(filename)[1].lower()
 
-    return os.path.join('uploads', 'recipe', filename)
+    return os.path.join('uploads', 'recipe', f"image{ext}")
 
 
 class UserManager(BaseUserManager):
@@ -36,6 +36,9 @@ class UserManager(BaseUserManager):
         user = self.model(email=self.normalize_email(email), **extra_fields)
         user.set_password(password)
         user.save(using=self._db)
+        # Placed by its id, known once saved
+        user.shard = pick_shard(user.pk)
+        user.save(using=self._db, update_fields=['shard'])
 
         return user
 
@@ -55,6 +58,16 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    # Latest change sequence of the user's recipes, tags and ingredients,
+    # so a sync with no changes doesn't have to query them
+    change_seq = models.BigIntegerField(default=0, editable=False)
+    # Latest change_seq of the user's pruned tombstones: syncs from before
+    # it may have missed deletions
+    sync_horizon = models.BigIntegerField(default=0, editable=False)
+    # Database holding the user's recipes, tags and ingredients, and
+    # whether they're being moved to another one (see core.sharding)
+    shard = models.CharField(max_length=100, default='default', editable=False)
+    shard_moving = models.BooleanField(default=False, editable=False)
 
     # this is how you assign a User Manager in Django
     objects = UserManager()
@@ -64,9 +77,11 @@ class User(AbstractBaseUser, PermissionsMixin):
 
 class Recipe(models.Model):
     """Recipe object"""
+    # Not constrained, the user can be in another database
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        db_constraint=False,
         editable=False
     )
     title = models.CharField(max_length=255)
@@ -74,9 +89,25 @@ class Recipe(models.Model):
     time_minutes = models.IntegerField()
     price = models.DecimalField(max_digits=5, decimal_places=2)
     link = models.CharField(max_length=255, blank=True)
-    tags = models.ManyToManyField('Tag')
-    ingredients = models.ManyToManyField('Ingredient')
-    image = models.ImageField(null=True, upload_to=recipe_image_file_path)
+    tags = models.ManyToManyField('Tag', through='RecipeTag')
+    ingredients = models.ManyToManyField(
+        'Ingredient', through='RecipeIngredient'
+    )
+    image = models.ImageField(
+        null=True,
+        upload_to=recipe_image_file_path,
+        storage=get_recipe_image_storage
+    )
+    # Set from core.sync.next_change_seq on every change, for delta syncs
+    change_seq = models.BigIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'change_seq']),
+            # Range filters and ordering on price and time within a user
+            models.Index(fields=['user', 'price']),
+            models.Index(fields=['user', 'time_minutes']),
+        ]
 
     def __str__(self):
         return self.title
@@ -84,12 +115,24 @@ class Recipe(models.Model):
 
 class Tag(models.Model):
     """Tag for filtering recipes"""
+    # Not constrained, the user can be in another database
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        db_constraint=False,
         editable=False
     )
     name = models.CharField(max_length=255)
+    # Number of recipes using it, maintained by core.signals
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+    # Set from core.sync.next_change_seq on every change, for delta syncs
+    change_seq = models.BigIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'recipe_count']),
+            models.Index(fields=['user', 'change_seq']),
+        ]
 
     def __str__(self):
         return self.name
@@ -97,12 +140,183 @@ class Tag(models.Model):
 
 class Ingredient(models.Model):
     """Ingredients in recipes"""
+    # Not constrained, the user can be in another database
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
+        db_constraint=False,
         editable=False
     )
     name = models.CharField(max_length=255)
+    # Number of recipes using it, maintained by core.signals
+    recipe_count = models.PositiveIntegerField(default=0, editable=False)
+    # Set from core.sync.next_change_seq on every change, for delta syncs
+    change_seq = models.BigIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'recipe_count']),
+            models.Index(fields=['user', 'change_seq']),
+        ]
 
     def __str__(self):
         return self.name
+
+
+class RecipeLinkQuerySet(models.QuerySet):
+    """QuerySet of recipe links, filling in the user of new links."""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        """Create links, taking the user of those without one, like the
+        links added by recipe.tags.add(), from their recipe."""
+        objs = list(objs)
+        recipe_ids = {obj.recipe_id for obj in objs if obj.user_id is None}
+        if recipe_ids:
+            users = dict(Recipe.objects.using(self.db).filter(
+                id__in=recipe_ids
+            ).values_list('id', 'user_id'))
+            for obj in objs:
+                if obj.user_id is None:
+                    obj.user_id = users.get(obj.recipe_id)
+
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class RecipeLink(models.Model):
+    """Link between a recipe and a tag or ingredient. Links store the
+    recipe's user, so the link tables can be partitioned by user like the
+    recipes (see core.partitioning) and filtered within a user."""
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='+',
+        db_constraint=False,
+        db_index=False,
+        editable=False
+    )
+
+    objects = RecipeLinkQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self.user_id is None:
+            self.user_id = self.recipe.user_id
+        super().save(*args, **kwargs)
+
+
+class RecipeTag(RecipeLink):
+    """Tag of a recipe"""
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = 'core_recipe_tags'
+        unique_together = [['recipe', 'tag']]
+        indexes = [
+            models.Index(
+                fields=['user', 'tag'], name='core_recipe_tags_user_tag_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id} {self.tag_id}'
+
+
+class RecipeIngredient(RecipeLink):
+    """Ingredient of a recipe"""
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = 'core_recipe_ingredients'
+        unique_together = [['recipe', 'ingredient']]
+        indexes = [
+            models.Index(
+                fields=['user', 'ingredient'],
+                name='core_recipe_ingr_user_ingr_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe_id} {self.ingredient_id}'
+
+
+class ChangeSequence(models.Model):
+    """Source of change sequence numbers on databases without native
+    sequences. On PostgreSQL the core_change_seq sequence is used."""
+
+
+class Tombstone(models.Model):
+    """Records a deleted recipe, tag or ingredient for delta syncs"""
+    RECIPE = 'recipe'
+    TAG = 'tag'
+    INGREDIENT = 'ingredient'
+    KIND_CHOICES = [
+        (RECIPE, 'Recipe'),
+        (TAG, 'Tag'),
+        (INGREDIENT, 'Ingredient'),
+    ]
+
+    # Not a foreign key: tombstones are written while the user's objects
+    # are being deleted, and removed along with the user
+    user_id = models.BigIntegerField()
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    change_seq = models.BigIntegerField()
+    # Tombstones are pruned after SYNC_TOMBSTONE_RETENTION
+    deleted_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', 'change_seq']),
+        ]
+
+    def __str__(self):
+        return f'{self.kind} {self.object_id}'
+
+
+class StoredFile(models.Model):
+    """Number of recipes referencing a content addressed image file"""
+    name = models.CharField(max_length=255, unique=True)
+    ref_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return self.name
+
+
+class Job(models.Model):
+    """Background job run by the `worker` command (see core.jobs)"""
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+    ]
+
+    # Dotted path of the function to call with kwargs
+    task = models.CharField(max_length=255)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(
+        max_length=20, choices=STATUS_CHOICES, default=QUEUED
+    )
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=3)
+    run_at = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            # Workers claim due jobs in run_at order
+            models.Index(fields=['status', 'run_at']),
+        ]
+
+    def __str__(self):
+        return f'{self.task} ({self.status})'
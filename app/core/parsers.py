@@ -0,0 +1,61 @@
+"""
+Parsers shared by the APIs.
+"""
+import codecs
+
+from django.conf import settings
+from rest_framework import parsers
+from rest_framework.exceptions import ParseError
+
+from core import renderers
+from core.renderers import cbor2, msgpack, orjson
+
+
+class JSONParser(parsers.JSONParser):
+    """Parses JSON-serialized data using orjson when available."""
+    renderer_class = renderers.JSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """Parse the incoming bytestream as JSON."""
+        if orjson is None:
+            return super().parse(stream, media_type, parser_context)
+
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+
+        try:
+            body = stream.read() if stream is not None else b''
+            if codecs.lookup(encoding).name != 'utf-8':
+                body = body.decode(encoding)
+            # orjson always rejects NaN and Infinity, like strict mode
+            return orjson.loads(body)
+        except (ValueError, LookupError) as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
+
+
+class MessagePackParser(parsers.BaseParser):
+    """Parses MessagePack-serialized data."""
+    media_type = 'application/msgpack'
+    renderer_class = renderers.MessagePackRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """Parse the incoming bytestream as MessagePack."""
+        try:
+            body = stream.read() if stream is not None else b''
+            return msgpack.unpackb(body, raw=False)
+        except (ValueError, TypeError, msgpack.UnpackException) as exc:
+            raise ParseError('MessagePack parse error - %s' % str(exc))
+
+
+class CBORParser(parsers.BaseParser):
+    """Parses CBOR-serialized data."""
+    media_type = 'application/cbor'
+    renderer_class = renderers.CBORRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        """Parse the incoming bytestream as CBOR."""
+        try:
+            body = stream.read() if stream is not None else b''
+            return cbor2.loads(body)
+        except (ValueError, TypeError, cbor2.CBORError) as exc:
+            raise ParseError('CBOR parse error - %s' % str(exc))
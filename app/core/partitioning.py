@@ -0,0 +1,173 @@
+"""
+Optional PostgreSQL hash partitioning of the recipe tables by user.
+
+`get_partition_sql` returns the statements turning the recipes table and
+its tag and ingredient link tables into tables partitioned by
+HASH (user_id), so each user's rows live in a single partition of each
+table. Vacuum and index maintenance then work on smaller tables, and
+queries filtering on the user, like all the recipe API queries, only read
+one partition.
+
+PostgreSQL needs the partition key in every unique constraint, so primary
+keys become (id, user_id), links are unique on (user_id, recipe_id,
+tag_id or ingredient_id) and reference recipes through (recipe_id,
+user_id). Ids still come from the same sequences, so they stay unique and
+the ORM keeps looking rows up by id. Later migrations apply to the
+partitioned tables as usual, as long as they don't add unique constraints
+without user_id.
+
+Run it with `python manage.py partition_recipes`.
+"""
+from core.models import Recipe, RecipeIngredient, RecipeTag
+
+
+class PartitioningError(Exception):
+    """The tables can't be partitioned."""
+
+
+def get_tables():
+    """Return the (table, link target column) of the partitioned tables,
+    recipes first. Recipes have no link target."""
+    return [
+        (Recipe._meta.db_table, None),
+        (RecipeTag._meta.db_table, 'tag_id'),
+        (RecipeIngredient._meta.db_table, 'ingredient_id'),
+    ]
+
+
+def is_partitioned(cursor, table):
+    """Check a table is partitioned."""
+    cursor.execute(
+        'SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass',
+        [table]
+    )
+    return cursor.fetchone() is not None
+
+
+def _get_indexes(cursor, table):
+    """Return the definitions of the non unique indexes of a table, the
+    unique ones are recreated with the partition key."""
+    cursor.execute(
+        """
+        SELECT pg_get_indexdef(i.indexrelid)
+        FROM pg_index i
+        WHERE i.indrelid = %s::regclass AND NOT i.indisunique
+        ORDER BY i.indexrelid
+        """,
+        [table]
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _get_foreign_keys(cursor, table):
+    """Return the (name, columns, definition) of a table's foreign keys."""
+    cursor.execute(
+        """
+        SELECT
+            c.conname,
+            array_agg(a.attname::text),
+            pg_get_constraintdef(c.oid)
+        FROM pg_constraint c
+        JOIN pg_attribute a
+          ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+        WHERE c.conrelid = %s::regclass AND c.contype = 'f'
+        GROUP BY c.oid, c.conname
+        ORDER BY c.conname
+        """,
+        [table]
+    )
+    return cursor.fetchall()
+
+
+def _get_referencing_tables(cursor, table):
+    """Return the tables with foreign keys to table."""
+    cursor.execute(
+        """
+        SELECT DISTINCT conrelid::regclass::text FROM pg_constraint
+        WHERE confrelid = %s::regclass AND contype = 'f'
+        """,
+        [table]
+    )
+    return {row[0] for row in cursor.fetchall()}
+
+
+def get_partition_sql(connection, partitions):
+    """Return the statements partitioning the recipe tables in the given
+    number of hash partitions. Run them in one transaction: the tables
+    are rebuilt, so they're locked while the rows are copied."""
+    if connection.vendor != 'postgresql':
+        raise PartitioningError('Partitioning needs PostgreSQL.')
+    if partitions < 2:
+        raise PartitioningError('At least 2 partitions are needed.')
+
+    tables = get_tables()
+    recipes = tables[0][0]
+    names = {table for table, _ in tables}
+    with connection.cursor() as cursor:
+        if any(is_partitioned(cursor, table) for table in names):
+            raise PartitioningError('The recipe tables are partitioned.')
+
+        extra = _get_referencing_tables(cursor, recipes) - names
+        if extra:
+            raise PartitioningError(
+                f'{", ".join(sorted(extra))} reference {recipes}, which '
+                f'would need a user_id to reference a partitioned table.'
+            )
+
+        schema = {}
+        for table, _ in tables:
+            cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+            schema[table] = (
+                cursor.fetchone()[0],
+                _get_indexes(cursor, table),
+                _get_foreign_keys(cursor, table),
+            )
+
+    quote = connection.ops.quote_name
+    # Tables with pending deferred foreign key checks can't be altered
+    create, drop, constrain = ['SET CONSTRAINTS ALL IMMEDIATE'], [], []
+    for table, target in tables:
+        sequence, indexes, foreign_keys = schema[table]
+        old = quote(f'{table}_unpartitioned')
+        create += [
+            f'ALTER TABLE {quote(table)} RENAME TO {old}',
+            f'CREATE TABLE {quote(table)} (LIKE {old} INCLUDING DEFAULTS '
+            f'INCLUDING CONSTRAINTS) PARTITION BY HASH (user_id)',
+        ] + [
+            f'CREATE TABLE {quote(f"{table}_p{remainder}")} PARTITION OF '
+            f'{quote(table)} FOR VALUES WITH (MODULUS {partitions}, '
+            f'REMAINDER {remainder})'
+            for remainder in range(partitions)
+        ] + [
+            f'INSERT INTO {quote(table)} SELECT * FROM {old}',
+            # Dropping the old table would drop the sequence it owns
+            f'ALTER SEQUENCE {sequence} OWNED BY {quote(table)}.id',
+        ]
+        drop.append(f'DROP TABLE {old}')
+
+        constrain += [
+            f'ALTER TABLE {quote(table)} ADD CONSTRAINT '
+            f'{quote(f"{table}_pkey")} PRIMARY KEY (id, user_id)',
+        ] + indexes
+        if target:
+            constrain.append(
+                f'ALTER TABLE {quote(table)} ADD CONSTRAINT '
+                f'{quote(f"{table}_user_recipe_{target}_uniq")} '
+                f'UNIQUE (user_id, recipe_id, {target})'
+            )
+        for name, columns, definition in foreign_keys:
+            if columns == ['recipe_id']:
+                definition = (
+                    f'FOREIGN KEY (recipe_id, user_id) REFERENCES '
+                    f'{quote(recipes)} (id, user_id) '
+                    f'DEFERRABLE INITIALLY DEFERRED'
+                )
+            constrain.append(
+                f'ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} '
+                f'{definition}'
+            )
+        constrain.append(f'ANALYZE {quote(table)}')
+
+    # Links reference the old recipes table, so they're dropped first, and
+    # the old indexes' names are only free once their tables are dropped
+    return create + drop[::-1] + constrain
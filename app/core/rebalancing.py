@@ -0,0 +1,106 @@
+"""
+Moving users between shards (see core.sharding).
+
+A move first flags the user as moving, which makes the API reject their
+writes with 503 while reads keep going to the old shard. API writes hold
+a lock on the user's row until they commit and check the flag again
+once they have it (see core.sharding.user_transaction), so the move then
+takes the lock to wait for the writes already in flight. It also waits a
+grace period for writes made outside the API, like the admin's. The
+rows are copied to the new shard in one transaction, with their ids, the
+user is switched to it, and the rows are deleted from the old shard. The
+copy and the deletion skip signals: the rows aren't changing, only
+moving.
+"""
+import time
+from itertools import islice
+
+from django.db import connections, transaction
+
+from core.models import (
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    RecipeTag,
+    Tag,
+    Tombstone,
+    User,
+)
+from core.sharding import get_id_range_tables, get_last_id, set_last_id
+
+# In insertion order, the later ones reference the earlier ones
+MOVED_MODELS = [
+    Tag, Ingredient, Recipe, RecipeTag, RecipeIngredient, Tombstone
+]
+# Copied with new ids, nothing references them
+RENUMBERED_MODELS = {RecipeTag, RecipeIngredient, Tombstone}
+
+
+def delete_user_rows(user_id, using):
+    """Delete a user's sharded rows from a database."""
+    connection = connections[using]
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for model in reversed(MOVED_MODELS):
+            cursor.execute(
+                f'DELETE FROM {quote(model._meta.db_table)} '
+                f'WHERE user_id = %s',
+                [user_id]
+            )
+
+
+def copy_user_rows(user_id, source, target, batch_size=1000):
+    """Replace a user's sharded rows in target with those in source."""
+    connection = connections[target]
+    with transaction.atomic(using=target):
+        # Explicit ids move SQLite's sequences past them, out of the
+        # target's range
+        last_ids = {
+            table: get_last_id(connection, table)
+            for table in get_id_range_tables()
+        }
+        delete_user_rows(user_id, target)
+
+        for model in MOVED_MODELS:
+            rows = model._base_manager.using(source).filter(
+                user_id=user_id
+            ).order_by('pk').iterator(chunk_size=batch_size)
+            while True:
+                batch = list(islice(rows, batch_size))
+                if not batch:
+                    break
+                if model in RENUMBERED_MODELS:
+                    for obj in batch:
+                        obj.pk = None
+                model._base_manager.using(target).bulk_create(batch)
+
+        for table, last_id in last_ids.items():
+            if last_id is not None:
+                set_last_id(connection, table, last_id)
+
+
+def move_user(user, target, grace_period=5):
+    """Move a user's recipes, tags and ingredients to the target shard.
+    Returns False if they're already there."""
+    source = user.shard
+    if source == target:
+        return False
+
+    users = User.objects.filter(pk=user.pk)
+    users.update(shard_moving=True)
+    try:
+        with transaction.atomic():
+            list(users.select_for_update().values_list('pk', flat=True))
+        time.sleep(grace_period)
+        copy_user_rows(user.pk, source, target)
+        users.update(shard=target, shard_moving=False)
+    except BaseException:
+        users.update(shard_moving=False)
+        raise
+
+    with transaction.atomic(using=source):
+        delete_user_rows(user.pk, source)
+    user.shard = target
+    user.shard_moving = False
+
+    return True
@@ -0,0 +1,135 @@
+"""
+Renderers shared by the APIs.
+
+`JSONRenderer` uses orjson when it is installed and falls back to the
+standard library `json` module otherwise. `MessagePackRenderer` and
+`CBORRenderer` render the same data in binary formats, for clients that
+ask for them in Accept; they need the `msgpack` and `cbor2` packages.
+"""
+import decimal
+
+from rest_framework import renderers
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+try:
+    import cbor2
+except ImportError:  # pragma: no cover
+    cbor2 = None
+
+
+def encode_decimal(value):
+    """Encode a Decimal the same way DecimalField does by default, as a
+    string, so no precision is lost on prices."""
+    if api_settings.COERCE_DECIMAL_TO_STRING:
+        return str(value)
+
+    return float(value)
+
+
+class JSONEncoder(encoders.JSONEncoder):
+    """JSON encoder that keeps Decimal values exact."""
+
+    def default(self, obj):
+        if isinstance(obj, decimal.Decimal):
+            return encode_decimal(obj)
+
+        return super().default(obj)
+
+
+_encoder = JSONEncoder()
+
+
+def _orjson_default(obj):
+    """Fallback for types orjson can't serialize natively."""
+    if isinstance(obj, decimal.Decimal):
+        return encode_decimal(obj)
+
+    return _encoder.default(obj)
+
+
+class JSONRenderer(renderers.JSONRenderer):
+    """Renderer which serializes to JSON using orjson when available."""
+    encoder_class = JSONEncoder
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render `data` into JSON, returning a bytestring."""
+        if orjson is None or data is None:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        # orjson only supports compact output or a 2 space indent
+        if indent not in (None, 2) or not self.compact or self.ensure_ascii:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        option = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+
+        ret = orjson.dumps(data, default=_orjson_default, option=option)
+
+        # Match DRF and escape \u2028 and \u2029, which are valid JSON
+        # but not valid inside javascript string literals.
+        if b'\xe2\x80\xa8' in ret or b'\xe2\x80\xa9' in ret:
+            ret = ret.replace(b'\xe2\x80\xa8', b'\\u2028')
+            ret = ret.replace(b'\xe2\x80\xa9', b'\\u2029')
+
+        return ret
+
+
+def _msgpack_default(obj):
+    """Fallback for types MessagePack can't serialize natively."""
+    if isinstance(obj, decimal.Decimal):
+        return encode_decimal(obj)
+
+    return _encoder.default(obj)
+
+
+def _cbor_default(encoder, obj):
+    """Fallback for types cbor2 can't serialize natively."""
+    encoder.encode(_encoder.default(obj))
+
+
+class MessagePackRenderer(renderers.BaseRenderer):
+    """Renderer which serializes to MessagePack.
+
+    MessagePack has no decimal type, so Decimal values are encoded like
+    the JSON renderer does."""
+    media_type = 'application/msgpack'
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render `data` into MessagePack, returning a bytestring."""
+        if data is None:
+            return b''
+
+        return msgpack.packb(data, default=_msgpack_default)
+
+
+class CBORRenderer(renderers.BaseRenderer):
+    """Renderer which serializes to CBOR.
+
+    Decimal values are encoded as CBOR decimal fractions, which are exact."""
+    media_type = 'application/cbor'
+    format = 'cbor'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Render `data` into CBOR, returning a bytestring."""
+        if data is None:
+            return b''
+
+        return cbor2.dumps(data, default=_cbor_default)
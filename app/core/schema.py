@@ -0,0 +1,155 @@
+"""
+Precomputed OpenAPI schema.
+
+Generating the schema introspects every view and serializer, so it's built
+once per code version and cached in memory and on disk. The cache is keyed
+by a fingerprint of the project's source code, so it's rebuilt only when
+the code changes.
+"""
+import hashlib
+import json
+import logging
+import os
+from contextlib import nullcontext
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils import translation
+from drf_spectacular import __version__ as spectacular_version
+from drf_spectacular.settings import spectacular_settings
+
+logger = logging.getLogger(__name__)
+
+_schemas = {}
+_rendered = {}
+
+
+@lru_cache(maxsize=None)
+def get_code_fingerprint():
+    """Return a digest of the project's python sources and schema
+    settings. Computed once per process."""
+    digest = hashlib.sha256()
+    digest.update(spectacular_version.encode())
+    digest.update(repr(sorted(
+        getattr(settings, 'SPECTACULAR_SETTINGS', {}).items()
+    )).encode())
+
+    base_dir = str(settings.BASE_DIR)
+    for root, dirs, files in os.walk(base_dir):
+        dirs[:] = sorted(
+            d for d in dirs if d not in ('__pycache__', 'tests')
+        )
+        for name in sorted(files):
+            if not name.endswith('.py'):
+                continue
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, base_dir).encode())
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+
+    return digest.hexdigest()[:32]
+
+
+def get_schema_etag(lang=None, format=None):
+    """Return the ETag of the schema for the current code version, in a
+    format (YAML or JSON) and language."""
+    parts = [get_code_fingerprint(), format, lang]
+    return '"{}"'.format('-'.join(part for part in parts if part))
+
+
+def get_cache_path(lang=None):
+    """Return the path of the on disk schema cache."""
+    suffix = f'.{lang}' if lang else ''
+    return os.path.join(settings.SCHEMA_CACHE_DIR, f'schema{suffix}.json')
+
+
+def generate_schema(request=None, lang=None):
+    """Introspect the API and return the OpenAPI schema."""
+    generator = spectacular_settings.DEFAULT_GENERATOR_CLASS(
+        urlconf=spectacular_settings.SERVE_URLCONF
+    )
+    with translation.override(lang) if lang else nullcontext():
+        return generator.get_schema(
+            request=request,
+            public=spectacular_settings.SERVE_PUBLIC
+        )
+
+
+def _read_disk_cache(lang):
+    """Return the schema stored on disk if it matches the code version."""
+    try:
+        with open(get_cache_path(lang), 'rb') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if cached.get('fingerprint') != get_code_fingerprint():
+        return None
+
+    return cached.get('schema')
+
+
+def write_disk_cache(schema, lang=None):
+    """Store the schema on disk along with the code version."""
+    path = get_cache_path(lang)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({
+            'fingerprint': get_code_fingerprint(),
+            'schema': schema,
+        }, f)
+    # Atomic so concurrent workers never read a partial file
+    os.replace(tmp_path, path)
+
+
+def get_schema(request=None, lang=None):
+    """Return the schema from memory, disk, or generate and cache it."""
+    key = (get_code_fingerprint(), lang)
+    schema = _schemas.get(key)
+    if schema is not None:
+        return schema
+
+    schema = _read_disk_cache(lang)
+    if schema is None:
+        schema = generate_schema(request, lang)
+        # Round trip through JSON so memory and disk hold the same data
+        schema = json.loads(json.dumps(schema, default=str))
+        try:
+            write_disk_cache(schema, lang)
+        except OSError:
+            logger.warning('Unable to write the schema cache to disk.')
+
+    _schemas[key] = schema
+    return schema
+
+
+def get_rendered_schema(renderer, media_type, lang=None):
+    """Return the schema rendered by renderer, rendering it only once per
+    code version and media type."""
+    key = (get_code_fingerprint(), lang, media_type)
+    content = _rendered.get(key)
+    if content is None:
+        content = renderer.render(get_schema(lang=lang), media_type, {})
+        _rendered[key] = content
+
+    return content
+
+
+def clear_schema_cache():
+    """Drop the in memory schemas."""
+    _schemas.clear()
+    _rendered.clear()
+
+
+def warm_schema_cache():
+    """Load or build the schema at startup, so the first request doesn't
+    pay for it. Failures are logged as the schema view can still build it
+    lazily."""
+    if not getattr(settings, 'SCHEMA_CACHE_WARMUP', False):
+        return
+
+    try:
+        get_schema()
+    except Exception:
+        logger.exception('Unable to warm the schema cache.')
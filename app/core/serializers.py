@@ -0,0 +1,63 @@
+"""Serializers for the core APIs"""
+from rest_framework import serializers
+
+from core.batch import get_max_operations
+
+
+class BatchOperationSerializer(serializers.Serializer):
+    """Serializer for an operation of a batch request"""
+    method = serializers.ChoiceField(
+        choices=['GET', 'POST', 'PUT', 'PATCH', 'DELETE']
+    )
+    path = serializers.RegexField(
+        r'^/', help_text='Path with the query string, which may reference '
+                         'an earlier result like /recipes/{0.id}/'
+    )
+    body = serializers.JSONField(required=False)
+    files = serializers.DictField(
+        child=serializers.CharField(),
+        required=False,
+        help_text='Map of file fields to the name of a file part of a '
+                  'multipart batch request'
+    )
+
+    def validate(self, attrs):
+        """Check the body of a file upload can be sent as form fields."""
+        body = attrs.get('body')
+        if attrs.get('files') and body is not None:
+            if not isinstance(body, dict) or None in body.values():
+                raise serializers.ValidationError({
+                    'body': 'Operations with files need an object body '
+                            'without null values.'
+                })
+
+        return attrs
+
+
+class BatchRequestSerializer(serializers.Serializer):
+    """Serializer for a batch request"""
+    atomic = serializers.BooleanField(default=False)
+    operations = BatchOperationSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, value):
+        """Limit the number of operations."""
+        max_operations = get_max_operations()
+        if len(value) > max_operations:
+            raise serializers.ValidationError(
+                f'At most {max_operations} operations are allowed.'
+            )
+
+        return value
+
+
+class BatchResultSerializer(serializers.Serializer):
+    """Serializer for the result of a batch operation"""
+    status = serializers.IntegerField()
+    headers = serializers.DictField(child=serializers.CharField())
+    body = serializers.JSONField(allow_null=True)
+
+
+class BatchResponseSerializer(serializers.Serializer):
+    """Serializer for the results of a batch request"""
+    committed = serializers.BooleanField()
+    results = BatchResultSerializer(many=True)
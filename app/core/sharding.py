@@ -0,0 +1,255 @@
+"""
+User sharding: each user's recipes, tags, ingredients and tombstones live
+in one database, the user's shard.
+
+The shard is stored on the user (`User.shard`), so it's known as soon as
+a request is authenticated, without another query. New users are placed
+in one of RECIPE_SHARDS by rendezvous hashing their id: the placement is
+stable, and adding a shard only claims the users it now wins, which
+`python manage.py rebalance_shards` then moves (see core.rebalancing).
+Users, tokens, jobs and everything else stay in the default database.
+Every database gets the full schema, migrate each one with
+`python manage.py migrate --database <alias>`.
+
+Views using UserShardMixin route their queries to the shard of the
+request's user through UserShardRouter, and run writes in
+`user_transaction(user)`. Code outside of them runs in
+`use_shard(get_user_shard(user))`, and objects loaded from a shard keep
+using it for their related objects.
+
+Each database allocates recipe, tag and ingredient ids from its own
+range, so users keep their ids when they move. A database's range follows
+its position in DATABASES, so new databases are only ever added last.
+"""
+import hashlib
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import SAFE_METHODS
+
+# Models stored in the shard of their user
+SHARDED_MODELS = {
+    'core.Recipe',
+    'core.Tag',
+    'core.Ingredient',
+    'core.RecipeTag',
+    'core.RecipeIngredient',
+    'core.Tombstone',
+}
+# Models keeping their ids when their user moves
+ID_RANGE_MODELS = ['core.Recipe', 'core.Tag', 'core.Ingredient']
+ID_RANGE_SIZE = 2 ** 40
+
+_current_shard = ContextVar('current_shard', default=None)
+
+
+class ShardMoving(APIException):
+    """The user is being moved to another shard."""
+    status_code = 503
+    default_detail = 'Your recipes are being moved, try again shortly.'
+    default_code = 'shard_moving'
+    # Sent as Retry-After
+    wait = 5
+
+
+def get_shards():
+    """Return the aliases of the databases new users are placed in."""
+    return list(getattr(settings, 'RECIPE_SHARDS', [DEFAULT_DB_ALIAS]))
+
+
+def pick_shard(user_id, shards=None):
+    """Return the shard a user hashes to among shards, RECIPE_SHARDS by
+    default."""
+    def weight(shard):
+        return hashlib.sha256(f'{shard}:{user_id}'.encode()).digest()
+
+    return max(get_shards() if shards is None else shards, key=weight)
+
+
+def get_user_shard(user):
+    """Return the alias of the database holding the user's recipes."""
+    return user.shard
+
+
+def get_shard_databases():
+    """Return the aliases of the databases holding users' recipes."""
+    shards = get_user_model().objects.values_list('shard', flat=True)
+    return sorted({DEFAULT_DB_ALIAS, *shards.distinct()})
+
+
+def get_current_shard():
+    """Return the shard queries are routed to, None outside of
+    use_shard."""
+    return _current_shard.get()
+
+
+@contextmanager
+def use_shard(alias):
+    """Route the queries of sharded models to alias within the block."""
+    token = _current_shard.set(alias)
+    try:
+        yield alias
+    finally:
+        _current_shard.reset(token)
+
+
+@contextmanager
+def user_transaction(user):
+    """Run the block in a transaction on the default database and one on
+    the user's shard, with the user's row locked until they commit.
+    Yields the aliases of the databases.
+
+    Changes get their change_seq before they're committed, so the lock
+    makes a user's changes commit in the order of their numbers. The shard
+    commits first and the default database, holding the user's watermark,
+    last: a sync reading watermark N finds every change up to N.
+
+    The user's shard and shard_moving are read again once the row is
+    locked, as the user may have been moved since they were loaded."""
+    with ExitStack() as stack:
+        stack.enter_context(transaction.atomic(using=DEFAULT_DB_ALIAS))
+        locked = get_user_model().objects.select_for_update().filter(
+            pk=user.pk
+        ).values('shard', 'shard_moving').first()
+        if locked is not None:
+            user.shard = locked['shard']
+            user.shard_moving = locked['shard_moving']
+
+        databases = list(dict.fromkeys([
+            DEFAULT_DB_ALIAS, get_user_shard(user)
+        ]))
+        for using in databases[1:]:
+            stack.enter_context(transaction.atomic(using=using))
+
+        yield databases
+
+
+def is_sharded(model):
+    """Check the rows of model live in their user's shard."""
+    return model._meta.label in SHARDED_MODELS
+
+
+class UserShardRouter:
+    """Database router sending sharded models to the current shard."""
+
+    def _db_for_model(self, model, **hints):
+        if not is_sharded(model):
+            return None
+
+        instance = hints.get('instance')
+        if isinstance(instance, get_user_model()):
+            # Related objects of a user, like user.recipe_set
+            return get_user_shard(instance)
+        if instance is not None and instance._state.db:
+            # Related objects of an object loaded from a shard
+            return instance._state.db
+
+        return get_current_shard()
+
+    db_for_read = _db_for_model
+    db_for_write = _db_for_model
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """Allow sharded objects to reference users, which are in the
+        default database."""
+        user_model = get_user_model()
+        for user, obj in [(obj1, obj2), (obj2, obj1)]:
+            if isinstance(user, user_model) and is_sharded(type(obj)):
+                return True
+
+        return None
+
+
+class UserShardMixin:
+    """Route the queries of an API view to the shard of the request's
+    user. Writes run in user_transaction, and are rejected while the user
+    is being moved."""
+
+    def dispatch(self, request, *args, **kwargs):
+        with use_shard(None), ExitStack() as self._transaction:
+            return super().dispatch(request, *args, **kwargs)
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        user = request.user
+        if not user.is_authenticated:
+            return
+
+        if request.method not in SAFE_METHODS:
+            if user.shard_moving:
+                raise ShardMoving()
+            # Read the body first, so the lock isn't held while a slow
+            # client uploads it
+            request.data
+            self._transaction.enter_context(user_transaction(user))
+            # Checked again on the locked row, move_user waits for the
+            # writes that got the lock before it
+            if user.shard_moving:
+                raise ShardMoving()
+        _current_shard.set(get_user_shard(user))
+
+
+def get_id_range_start(alias):
+    """Return the last id before the id range of a database."""
+    return list(settings.DATABASES).index(alias) * ID_RANGE_SIZE
+
+
+def get_last_id(connection, table):
+    """Return the last id allocated in a table, None if unknown."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT pg_get_serial_sequence(%s, 'id')", [table]
+            )
+            cursor.execute(f'SELECT last_value FROM {cursor.fetchone()[0]}')
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                'SELECT seq FROM sqlite_sequence WHERE name = %s', [table]
+            )
+        else:
+            return None
+
+        row = cursor.fetchone()
+        return row[0] if row else 0
+
+
+def set_last_id(connection, table, value):
+    """Make value the last id allocated in a table."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT setval(pg_get_serial_sequence(%s, 'id'), %s)",
+                [table, value]
+            )
+        elif connection.vendor == 'sqlite':
+            cursor.execute(
+                'DELETE FROM sqlite_sequence WHERE name = %s', [table]
+            )
+            cursor.execute(
+                'INSERT INTO sqlite_sequence (name, seq) VALUES (%s, %s)',
+                [table, value]
+            )
+
+
+def get_id_range_tables():
+    """Return the tables of the models keeping their ids."""
+    return [apps.get_model(label)._meta.db_table for label in ID_RANGE_MODELS]
+
+
+def reserve_id_range(using=DEFAULT_DB_ALIAS, **kwargs):
+    """Move the recipe, tag and ingredient id sequences of a database to
+    its range. Connected to post_migrate."""
+    start = get_id_range_start(using)
+    if not start:
+        return
+
+    connection = connections[using]
+    for table in get_id_range_tables():
+        last_id = get_last_id(connection, table)
+        if last_id is not None and last_id < start:
+            set_last_id(connection, table, start)
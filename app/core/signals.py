@@ -0,0 +1,254 @@
+"""
+Signal handlers keeping denormalized data in sync.
+
+- Tag and Ingredient recipe_count columns follow the recipe many-to-many
+  relations. m2m_changed covers every add, remove and clear, whichever
+  side of the relation they're made from. Deleting a recipe removes its
+  through rows without sending m2m_changed, so that's handled on
+  pre_delete.
+- Recipes, tags and ingredients get a new change_seq whenever they (or a
+  recipe's tags and ingredients) change, and leave a Tombstone when
+  deleted, for the delta sync API. Each change is also published to the
+  change event feed.
+- Deleting a user deletes their recipes, tags and ingredients from their
+  shard, which the cascade from the default database doesn't reach.
+- StoredFile counts the recipes referencing each content addressed image.
+"""
+from django.contrib.auth import get_user_model
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.signals import (
+    m2m_changed,
+    pre_delete,
+    pre_save,
+    post_init,
+    post_save,
+    post_delete,
+)
+from django.dispatch import receiver
+
+from core.events import publish_change
+from core.models import Recipe, Tag, Ingredient, Tombstone, StoredFile
+from core.sharding import get_user_shard, use_shard
+from core.sync import next_change_seq, record_change
+
+RELATIONS = {
+    Recipe.tags.through: 'tag',
+    Recipe.ingredients.through: 'ingredient',
+}
+
+
+def _linked_pairs(through, target, instance, reverse, pk_set=None):
+    """Return the (recipe_id, target_id) pairs linked to instance,
+    optionally limited to the given pk_set."""
+    if reverse:
+        links = through.objects.filter(**{f'{target}_id': instance.pk})
+        if pk_set is not None:
+            links = links.filter(recipe_id__in=pk_set)
+    else:
+        links = through.objects.filter(recipe_id=instance.pk)
+        if pk_set is not None:
+            links = links.filter(**{f'{target}_id__in': pk_set})
+
+    return list(links.values_list('recipe_id', f'{target}_id'))
+
+
+def _update_counts(model, target_ids, delta):
+    """Add delta to recipe_count once per occurrence of a target id."""
+    counts = {}
+    for target_id in target_ids:
+        counts[target_id] = counts.get(target_id, 0) + 1
+
+    by_count = {}
+    for target_id, count in counts.items():
+        by_count.setdefault(count, []).append(target_id)
+
+    for count, ids in by_count.items():
+        model.objects.filter(pk__in=ids).update(
+            recipe_count=F('recipe_count') + delta * count
+        )
+
+
+@receiver(m2m_changed)
+def recipe_relations_changed(sender, instance, action, reverse, model,
+                             pk_set, **kwargs):
+    """Keep recipe_count in sync with recipe tags and ingredients, and
+    mark the recipes whose relations changed as changed."""
+    target = RELATIONS.get(sender)
+    if target is None:
+        return
+
+    if action in ('pre_remove', 'pre_clear'):
+        # pk_set may include ids that aren't linked, and clear has none,
+        # so record what will actually be removed before it happens
+        instance._removed_recipe_links = _linked_pairs(
+            sender, target, instance, reverse, pk_set
+        )
+        return
+
+    if action in ('post_remove', 'post_clear'):
+        pairs = instance.__dict__.pop('_removed_recipe_links', [])
+        delta = -1
+    elif action == 'post_add' and pk_set:
+        # Django only reports the ids that were actually added
+        if reverse:
+            pairs = [(recipe_id, instance.pk) for recipe_id in pk_set]
+        else:
+            pairs = [(instance.pk, target_id) for target_id in pk_set]
+        delta = 1
+    else:
+        return
+
+    if not pairs:
+        return
+
+    target_model = sender._meta.get_field(target).related_model
+    _update_counts(target_model, [t for _, t in pairs], delta)
+
+    seq = next_change_seq()
+    recipe_ids = {recipe_id for recipe_id, _ in pairs}
+    Recipe.objects.filter(pk__in=recipe_ids).update(change_seq=seq)
+    if not reverse:
+        instance.change_seq = seq
+    record_change(instance.user_id, seq)
+    publish_change(
+        instance.user_id, Tombstone.RECIPE, 'saved', recipe_ids, seq
+    )
+
+
+@receiver(pre_delete, sender=Recipe)
+def decrement_recipe_counts(sender, instance, **kwargs):
+    """Decrement counts of the tags and ingredients of a deleted recipe."""
+    for through, target in RELATIONS.items():
+        target_model = through._meta.get_field(target).related_model
+        pairs = _linked_pairs(through, target, instance, reverse=False)
+        _update_counts(target_model, [t for _, t in pairs], -1)
+
+
+SYNCED_MODELS = {
+    Recipe: Tombstone.RECIPE,
+    Tag: Tombstone.TAG,
+    Ingredient: Tombstone.INGREDIENT,
+}
+
+
+@receiver(pre_save)
+def set_change_seq(sender, instance, raw=False, **kwargs):
+    """Give every saved recipe, tag and ingredient a new change_seq."""
+    if sender in SYNCED_MODELS and not raw:
+        instance.change_seq = next_change_seq()
+
+
+@receiver(post_save)
+def record_saved_change(sender, instance, raw=False, **kwargs):
+    """Move the owner's watermark to the saved change."""
+    if sender in SYNCED_MODELS and not raw:
+        record_change(instance.user_id, instance.change_seq)
+        publish_change(
+            instance.user_id,
+            SYNCED_MODELS[sender],
+            'saved',
+            [instance.pk],
+            instance.change_seq
+        )
+
+
+@receiver(post_delete)
+def create_tombstone(sender, instance, **kwargs):
+    """Record deleted recipes, tags and ingredients for delta syncs."""
+    kind = SYNCED_MODELS.get(sender)
+    if kind is None:
+        return
+
+    seq = next_change_seq()
+    Tombstone.objects.create(
+        user_id=instance.user_id,
+        kind=kind,
+        object_id=instance.pk,
+        change_seq=seq
+    )
+    record_change(instance.user_id, seq)
+    publish_change(instance.user_id, kind, 'deleted', [instance.pk], seq)
+
+
+@receiver(pre_delete, sender=get_user_model())
+def delete_sharded_objects(sender, instance, **kwargs):
+    """Delete the recipes, tags and ingredients of a user whose shard
+    isn't the user's database."""
+    shard = get_user_shard(instance)
+    if shard == instance._state.db:
+        return
+
+    with use_shard(shard):
+        for model in SYNCED_MODELS:
+            model.objects.filter(user_id=instance.pk).delete()
+
+
+@receiver(post_delete, sender=get_user_model())
+def delete_tombstones(sender, instance, **kwargs):
+    """Drop the tombstones of a deleted user, including the ones written
+    while their recipes, tags and ingredients were deleted."""
+    Tombstone.objects.using(get_user_shard(instance)).filter(
+        user_id=instance.pk
+    ).delete()
+
+
+# Marks recipes loaded without their image column
+IMAGE_DEFERRED = object()
+
+
+def _image_name(instance):
+    """Return the image name of a recipe without loading deferred
+    fields, IMAGE_DEFERRED if it isn't loaded."""
+    if 'image' not in instance.__dict__:
+        return IMAGE_DEFERRED
+
+    value = instance.__dict__['image']
+    return getattr(value, 'name', value) or None
+
+
+def _change_references(name, delta):
+    """Add delta to the reference count of a stored file."""
+    updated = StoredFile.objects.filter(name=name).update(
+        ref_count=F('ref_count') + delta
+    )
+    if updated or delta < 0:
+        return
+
+    try:
+        with transaction.atomic():
+            StoredFile.objects.create(name=name, ref_count=delta)
+    except IntegrityError:
+        # Created concurrently
+        StoredFile.objects.filter(name=name).update(
+            ref_count=F('ref_count') + delta
+        )
+
+
+@receiver(post_init, sender=Recipe)
+def remember_image(sender, instance, **kwargs):
+    """Remember the image a recipe was loaded with."""
+    instance._stored_image = _image_name(instance)
+
+
+@receiver(post_save, sender=Recipe)
+def update_image_references(sender, instance, raw=False, **kwargs):
+    """Move the reference from the previous image to the new one."""
+    old = instance._stored_image
+    new = _image_name(instance)
+    if raw or IMAGE_DEFERRED in (old, new) or old == new:
+        return
+
+    if new:
+        _change_references(new, 1)
+    if old:
+        _change_references(old, -1)
+    instance._stored_image = new
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_image_reference(sender, instance, **kwargs):
+    """Drop the reference of a deleted recipe to its image."""
+    name = _image_name(instance)
+    if name and name is not IMAGE_DEFERRED:
+        _change_references(name, -1)
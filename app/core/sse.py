@@ -0,0 +1,134 @@
+"""
+Server-Sent Events feed of the authenticated user's changes.
+
+Served as a plain ASGI application (routed in app/asgi.py) rather than a
+Django view: Django iterates streaming responses synchronously, which would
+tie up the event loop for the lifetime of every connection. Here an idle
+connection costs a queue and a pending timer.
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.authtoken.models import Token
+
+from core.events import get_broker
+
+
+@sync_to_async
+def get_user(key):
+    """Return the active user owning the token key, or None."""
+    try:
+        token = Token.objects.select_related('user').get(key=key)
+    except Token.DoesNotExist:
+        return None
+
+    return token.user if token.user.is_active else None
+
+
+def get_token_key(scope):
+    """Return the token key from the Authorization header, or from the
+    token query parameter as browsers' EventSource can't set headers."""
+    for name, value in scope.get('headers', []):
+        if name == b'authorization':
+            parts = value.decode('latin1').split()
+            if len(parts) == 2 and parts[0].lower() == 'token':
+                return parts[1]
+
+    query = parse_qs(scope.get('query_string', b'').decode('latin1'))
+    return query.get('token', [None])[0]
+
+
+def format_event(event):
+    """Encode an event in the text/event-stream format."""
+    lines = []
+    if 'token' in event:
+        # Lets clients resume with a delta sync from the last event
+        lines.append(f"id: {event['token']}")
+    lines.append(f"event: {event['type']}")
+    lines.append(f"data: {json.dumps(event)}")
+
+    return ('\n'.join(lines) + '\n\n').encode()
+
+
+async def send_error(send, status, detail):
+    """Send a JSON error response."""
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({
+        'type': 'http.response.body',
+        'body': json.dumps({'detail': detail}).encode(),
+    })
+
+
+async def wait_for_disconnect(receive):
+    """Return once the client disconnects."""
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def events_app(scope, receive, send):
+    """Stream the user's change events until the client disconnects."""
+    if scope['method'] != 'GET':
+        await send_error(send, 405, 'Method not allowed.')
+        return
+
+    key = get_token_key(scope)
+    user = await get_user(key) if key else None
+    if user is None:
+        await send_error(send, 401, 'Invalid token.')
+        return
+
+    heartbeat = getattr(settings, 'EVENTS_HEARTBEAT_INTERVAL', 15)
+    broker = get_broker()
+    subscription = broker.subscribe(user.id)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    next_event = None
+
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                # Stop nginx from buffering the stream
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        await send({
+            'type': 'http.response.body',
+            'body': b'retry: 5000\n\n',
+            'more_body': True,
+        })
+
+        while True:
+            # Wait on the disconnect too, so an idle closed connection is
+            # unsubscribed right away rather than at the next heartbeat
+            next_event = asyncio.ensure_future(subscription.get(heartbeat))
+            await asyncio.wait(
+                {next_event, disconnected},
+                return_when=asyncio.FIRST_COMPLETED
+            )
+            if disconnected.done():
+                break
+            event = next_event.result()
+            # A comment line keeps proxies from closing idle connections
+            body = format_event(event) if event else b': ping\n\n'
+            await send({
+                'type': 'http.response.body',
+                'body': body,
+                'more_body': True,
+            })
+    finally:
+        if next_event:
+            next_event.cancel()
+        disconnected.cancel()
+        broker.unsubscribe(subscription)
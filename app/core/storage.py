@@ -0,0 +1,93 @@
+"""
+Content addressed storage for recipe images.
+
+Images are named after the SHA-256 of their content, so identical uploads
+share a single file and a file never changes once written, which makes
+it safe to cache forever.
+"""
+import hashlib
+import os
+import uuid
+
+from django.core.files.storage import FileSystemStorage
+
+
+def get_content_hash(file):
+    """Return the SHA-256 of a file, using the hash computed while it was
+    uploaded when available."""
+    content_hash = getattr(file, 'content_hash', None)
+    if content_hash:
+        return content_hash
+
+    digest = hashlib.sha256()
+    if hasattr(file, 'seek'):
+        file.seek(0)
+    for chunk in file.chunks():
+        digest.update(chunk)
+    if hasattr(file, 'seek'):
+        file.seek(0)
+
+    return digest.hexdigest()
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """File system storage naming files after the hash of their content.
+
+    `dir/name.ext` is stored as `dir/<hash[:2]>/<hash>.ext`, the prefix
+    directory keeping directories small. As a name always maps to the same
+    content, a file that already exists is never written again."""
+
+    def save(self, name, content, max_length=None):
+        content_hash = get_content_hash(content)
+        directory, filename = os.path.split(name)
+        ext = os.path.splitext(filename)[1].lower()
+        name = os.path.join(
+            directory, content_hash[:2], f'{content_hash}{ext}'
+        )
+
+        return super().save(name, content, max_length=max_length)
+
+    def get_available_name(self, name, max_length=None):
+        # An existing file with this name already has this content
+        return name
+
+    def _save(self, name, content):
+        if self.exists(name):
+            # Refresh the mtime, so the file counts as recently used and
+            # clean_media keeps it
+            try:
+                os.utime(self.path(name))
+                return name
+            except FileNotFoundError:
+                # Deleted by clean_media meanwhile, write it again
+                pass
+
+        # Write to a unique name and rename it, so concurrent uploads of
+        # the same content never see a partially written file
+        tmp_name = super()._save(f'{name}.{uuid.uuid4().hex}.tmp', content)
+        os.replace(self.path(tmp_name), self.path(name))
+
+        return name
+
+
+def delete_files(storage, names, max_mtime):
+    """Delete the files still last modified before max_mtime, returning
+    the names of the deleted ones."""
+    deleted = []
+    for name in names:
+        path = storage.path(name)
+        try:
+            if os.stat(path).st_mtime >= max_mtime:
+                # Reused since it was found unused
+                continue
+            os.remove(path)
+        except FileNotFoundError:
+            continue
+        deleted.append(name)
+
+    return deleted
+
+
+def get_recipe_image_storage():
+    """Return the storage of recipe images."""
+    return ContentAddressedStorage()
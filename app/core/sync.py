@@ -0,0 +1,77 @@
+"""
+Change sequence used by the delta sync API.
+
+Every change to a recipe, tag or ingredient gets a number from a single
+monotonic sequence, stored on the changed row and as the owner's
+`User.change_seq` watermark. Clients keep the latest number they've seen
+and ask for anything above it. Numbers are taken before the changes
+commit, so API writes run in core.sharding.user_transaction, which keeps
+a user's changes committing in order.
+
+Tombstones are pruned after SYNC_TOMBSTONE_RETENTION by
+`python manage.py prune_tombstones`, which moves the user's
+`sync_horizon` to the latest pruned one. Syncs from tokens before the
+horizon may have missed deletions, and get a 410 asking for a full sync.
+"""
+from django.db import connections, transaction
+from django.db.models import F, Max
+from django.db.models.functions import Greatest
+from rest_framework.exceptions import APIException
+
+from core.models import ChangeSequence, Tombstone, User
+
+# Rows kept in the ChangeSequence fallback table
+CHANGE_SEQUENCE_PRUNE_EVERY = 1000
+
+
+class SyncTokenExpired(APIException):
+    """The tombstones the sync token needs were pruned."""
+    status_code = 410
+    default_detail = 'Sync token expired, sync again without it.'
+    default_code = 'sync_token_expired'
+
+
+def next_change_seq(using='default'):
+    """Return the next number of the change sequence."""
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT nextval('core_change_seq')")
+            return cursor.fetchone()[0]
+
+    seq = ChangeSequence.objects.using(using).create().pk
+    if seq % CHANGE_SEQUENCE_PRUNE_EVERY == 0:
+        ChangeSequence.objects.using(using).filter(pk__lt=seq).delete()
+
+    return seq
+
+
+def record_change(user_id, seq):
+    """Move the user's watermark forward to seq."""
+    User.objects.filter(pk=user_id).update(
+        change_seq=Greatest(F('change_seq'), seq)
+    )
+
+
+def prune_tombstones(before, using='default', batch_size=1000):
+    """Delete the tombstones of a database written before a datetime,
+    moving their users' sync horizon past them first. Returns the number
+    deleted."""
+    deleted = 0
+    while True:
+        with transaction.atomic(using=using):
+            ids = list(Tombstone.objects.using(using).filter(
+                deleted_at__lt=before
+            ).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+
+            pruned = Tombstone.objects.using(using).filter(pk__in=ids)
+            horizons = pruned.order_by().values('user_id').annotate(
+                seq=Max('change_seq')
+            )
+            for row in horizons:
+                User.objects.filter(pk=row['user_id']).update(
+                    sync_horizon=Greatest(F('sync_horizon'), row['seq'])
+                )
+            deleted += pruned.delete()[0]
@@ -0,0 +1,31 @@
+"""
+Background tasks, queued with core.jobs.enqueue and run by the `worker`
+command.
+"""
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+from core.models import Recipe, StoredFile
+from core.storage import delete_files
+
+
+def delete_unused_image(name):
+    """Delete a replaced recipe image if no recipe references it anymore
+    and it wasn't reused in the last MEDIA_DELETE_DELAY seconds. Images
+    without a reference count, or kept, are left to clean_media."""
+    storage = Recipe._meta.get_field('image').storage
+    max_mtime = time.time() - getattr(settings, 'MEDIA_DELETE_DELAY', 300)
+
+    with transaction.atomic():
+        # Uploads reusing the image wait for the lock to count their
+        # reference
+        stored = StoredFile.objects.select_for_update().filter(
+            name=name
+        ).first()
+        if stored is None or stored.ref_count:
+            return
+
+        if delete_files(storage, [name], max_mtime):
+            stored.delete()
@@ -1,11 +1,22 @@
 """Tests for the Django admin modifications"""
 
+from decimal import Decimal
+from unittest import skipUnless
+
 # We use TestCase because we need db for these tests
-from django.test import TestCase
+from django.conf import settings
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 from django.test import Client
 
+from core.models import Recipe, Tombstone
+from core.sharding import use_shard
+
+SHARD = next(
+    (alias for alias in settings.DATABASES if alias != 'default'), None
+)
+
 
 class AdminSiteTests(TestCase):
     """Tests for Django admin."""
@@ -50,3 +61,56 @@ class AdminSiteTests(TestCase):
         res = self.client.get(url)
 
         self.assertEqual(res.status_code, 200)
+
+
+@skipUnless(SHARD, 'Needs a second database')
+class ShardedAdminTests(TestCase):
+    """Test the admin pages of models stored in users' shards."""
+    databases = {'default', SHARD} - {None}
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(get_user_model().objects.create_superuser(
+            email='admin@example.com',
+            password='testpassword123'
+        ))
+        with override_settings(RECIPE_SHARDS=[SHARD]):
+            self.user = get_user_model().objects.create_user(
+                email='user@example.com',
+                password='testpass123'
+            )
+        with use_shard(SHARD):
+            self.recipe = Recipe.objects.create(
+                user=self.user,
+                title='Sharded curry',
+                time_minutes=5,
+                price=Decimal('5.00')
+            )
+
+    def test_recipes_of_selected_shard(self):
+        """Test the recipe pages work on the database picked with
+        ?shard="""
+        url = reverse('admin:core_recipe_changelist')
+
+        res = self.client.get(url)
+
+        self.assertNotContains(res, self.recipe.title)
+
+        res = self.client.get(url, {'shard': SHARD})
+
+        self.assertRedirects(res, url)
+        res = self.client.get(url)
+        self.assertContains(res, self.recipe.title)
+        res = self.client.get(
+            reverse('admin:core_recipe_change', args=[self.recipe.id])
+        )
+        self.assertContains(res, self.recipe.title)
+
+        res = self.client.post(
+            reverse('admin:core_recipe_delete', args=[self.recipe.id]),
+            {'post': 'yes'}
+        )
+
+        self.assertEqual(res.status_code, 302)
+        self.assertFalse(Recipe.objects.using(SHARD).exists())
+        self.assertTrue(Tombstone.objects.using(SHARD).exists())
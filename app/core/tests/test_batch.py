@@ -0,0 +1,291 @@
+"""Tests for the batch request API."""
+import io
+import json
+import os
+from decimal import Decimal
+from unittest.mock import patch
+
+from PIL import Image
+
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.signals import request_finished
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Recipe
+
+BATCH_URL = reverse('batch')
+RECIPES_PATH = reverse('recipe:recipe-list')
+ME_PATH = reverse('user:me')
+
+
+def create_recipe_operation(title='Batch recipe', **params):
+    """Return an operation creating a recipe."""
+    body = {'title': title, 'time_minutes': 5, 'price': '2.50'}
+    body.update(params)
+    return {'method': 'POST', 'path': RECIPES_PATH, 'body': body}
+
+
+def create_image():
+    """Return an uploaded 10x10 px JPEG image."""
+    content = io.BytesIO()
+    Image.new('RGB', (10, 10)).save(content, format='JPEG')
+
+    return SimpleUploadedFile('photo.jpg', content.getvalue(), 'image/jpeg')
+
+
+class PublicBatchApiTests(TestCase):
+    """Test unauthenticated batch requests."""
+
+    def test_auth_required(self):
+        """Test auth is required to run a batch"""
+        res = APIClient().post(BATCH_URL, {
+            'operations': [{'method': 'GET', 'path': ME_PATH}]
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateBatchApiTests(TestCase):
+    """Test authenticated batch requests."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com', password='pass12345', name='Name'
+        )
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def post(self, operations, **params):
+        """Post a batch and return the response."""
+        return self.client.post(
+            BATCH_URL, {'operations': operations, **params}, format='json'
+        )
+
+    def test_operations_run_in_order(self):
+        """Test operations run in order and return their statuses, with
+        later paths referencing earlier results"""
+        res = self.post([
+            create_recipe_operation(tags=[{'name': 'Quick'}]),
+            {
+                'method': 'PATCH',
+                'path': RECIPES_PATH + '{0.id}/',
+                'body': {'price': '3.75'},
+            },
+            {'method': 'PATCH', 'path': ME_PATH, 'body': {'name': 'New'}},
+            {'method': 'GET', 'path': RECIPES_PATH + '?fields=id,price'},
+        ])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.data['committed'])
+        statuses = [result['status'] for result in res.data['results']]
+        self.assertEqual(statuses, [201, 200, 200, 200])
+        recipe = Recipe.objects.get(user=self.user)
+        self.assertEqual(recipe.price, Decimal('3.75'))
+        self.assertEqual(recipe.tags.get().name, 'Quick')
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.name, 'New')
+        self.assertEqual(
+            res.data['results'][3]['body'],
+            [{'id': recipe.id, 'price': '3.75'}]
+        )
+
+    def test_authenticates_once(self):
+        """Test the token is only looked up for the batch itself"""
+        with CaptureQueriesContext(connection) as queries:
+            res = self.post([{'method': 'GET', 'path': ME_PATH}] * 3)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        token_queries = [
+            query for query in queries.captured_queries
+            if 'authtoken_token' in query['sql']
+        ]
+        self.assertEqual(len(token_queries), 1)
+
+    def test_failure_not_atomic(self):
+        """Test a failed operation doesn't stop the others by default"""
+        res = self.post([
+            create_recipe_operation(price='not a price'),
+            create_recipe_operation(),
+        ])
+
+        self.assertTrue(res.data['committed'])
+        statuses = [result['status'] for result in res.data['results']]
+        self.assertEqual(statuses, [400, 201])
+        self.assertIn('price', res.data['results'][0]['body'])
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 1)
+
+    def test_failure_atomic_rolls_back(self):
+        """Test a failed operation rolls back an atomic batch and skips
+        the following operations"""
+        res = self.post([
+            create_recipe_operation(),
+            create_recipe_operation(price='not a price'),
+            create_recipe_operation(),
+        ], atomic=True)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse(res.data['committed'])
+        statuses = [result['status'] for result in res.data['results']]
+        self.assertEqual(statuses, [201, 400, 424])
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+
+    def test_atomic_commits(self):
+        """Test an atomic batch without failures is committed"""
+        res = self.post([create_recipe_operation()] * 2, atomic=True)
+
+        self.assertTrue(res.data['committed'])
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 2)
+
+    def test_atomic_keeps_connection(self):
+        """Test operations don't finish the request, which closes the
+        database connections in the middle of the batch's transaction on
+        databases other than in-memory SQLite"""
+        finished = []
+
+        def record(**kwargs):
+            finished.append(kwargs)
+
+        request_finished.connect(record)
+        self.addCleanup(request_finished.disconnect, record)
+        res = self.post([create_recipe_operation()] * 2, atomic=True)
+
+        self.assertTrue(res.data['committed'])
+        # Only the batch request itself finished
+        self.assertEqual(len(finished), 1)
+
+    def test_invalid_operations(self):
+        """Test unknown paths, bad references and nested batches fail
+        without stopping the batch"""
+        res = self.post([
+            {'method': 'GET', 'path': '/api/unknown/'},
+            {'method': 'GET', 'path': RECIPES_PATH + '{5.id}/'},
+            {'method': 'POST', 'path': BATCH_URL, 'body': {}},
+            {'method': 'GET', 'path': ME_PATH},
+        ])
+
+        statuses = [result['status'] for result in res.data['results']]
+        self.assertEqual(statuses, [404, 400, 400, 200])
+
+    def test_non_api_views_not_found(self):
+        """Test paths of views outside the API aren't dispatched"""
+        res = self.post([
+            {'method': 'GET', 'path': '/admin/'},
+            {'method': 'GET', 'path': ME_PATH},
+        ])
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        statuses = [result['status'] for result in res.data['results']]
+        self.assertEqual(statuses, [404, 200])
+
+    def test_operation_error(self):
+        """Test an operation raising an error gets a 500 result, which
+        rolls back an atomic batch"""
+        view = 'recipe.views.RecipeViewSet.list'
+        with patch(view, side_effect=RuntimeError), \
+                self.assertLogs('core.batch', 'ERROR'):
+            res = self.post([
+                create_recipe_operation(),
+                {'method': 'GET', 'path': RECIPES_PATH},
+                {'method': 'GET', 'path': ME_PATH},
+            ], atomic=True)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertFalse(res.data['committed'])
+        statuses = [result['status'] for result in res.data['results']]
+        self.assertEqual(statuses, [201, 500, 424])
+        self.assertFalse(Recipe.objects.filter(user=self.user).exists())
+
+    def test_other_user_recipe_not_found(self):
+        """Test operations are limited to the user's own recipes"""
+        other = get_user_model().objects.create_user(
+            email='other@example.com', password='pass12345'
+        )
+        recipe = Recipe.objects.create(
+            user=other, title='Other', time_minutes=5, price=Decimal('1.00')
+        )
+
+        res = self.post([{
+            'method': 'DELETE', 'path': RECIPES_PATH + f'{recipe.id}/'
+        }])
+
+        self.assertEqual(res.data['results'][0]['status'], 404)
+        self.assertTrue(Recipe.objects.filter(id=recipe.id).exists())
+
+    @override_settings(BATCH_MAX_OPERATIONS=2)
+    def test_too_many_operations(self):
+        """Test batches are limited to BATCH_MAX_OPERATIONS"""
+        res = self.post([{'method': 'GET', 'path': ME_PATH}] * 3)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_batch(self):
+        """Test malformed batches are rejected"""
+        for operations in [[], [{'method': 'GET', 'path': 'no-slash'}]]:
+            res = self.post(operations)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upload_image(self):
+        """Test creating a recipe and uploading its image in one multipart
+        batch"""
+        operations = [
+            create_recipe_operation(),
+            {
+                'method': 'POST',
+                'path': RECIPES_PATH + '{0.id}/upload-image/',
+                'files': {'image': 'photo'},
+            },
+        ]
+
+        res = self.client.post(BATCH_URL, {
+            'operations': json.dumps(operations),
+            'photo': create_image(),
+        }, format='multipart')
+
+        statuses = [result['status'] for result in res.data['results']]
+        self.assertEqual(statuses, [201, 200])
+        recipe = Recipe.objects.get(user=self.user)
+        self.assertTrue(recipe.image)
+        self.assertTrue(os.path.exists(recipe.image.path))
+        recipe.image.delete()
+
+    def test_upload_invalid_body(self):
+        """Test file operations need an object body without nulls"""
+        for body in [['title'], {'title': None}]:
+            operations = [{
+                'method': 'POST',
+                'path': RECIPES_PATH + '1/upload-image/',
+                'body': body,
+                'files': {'image': 'photo'},
+            }]
+
+            res = self.client.post(BATCH_URL, {
+                'operations': json.dumps(operations),
+                'photo': create_image(),
+            }, format='multipart')
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_upload_missing_file_part(self):
+        """Test referencing a missing file part is rejected"""
+        operations = [{
+            'method': 'POST',
+            'path': RECIPES_PATH + '1/upload-image/',
+            'files': {'image': 'photo'},
+        }]
+
+        res = self.client.post(
+            BATCH_URL, {'operations': json.dumps(operations)},
+            format='multipart'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
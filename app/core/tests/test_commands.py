@@ -1,11 +1,28 @@
 """Test custom Django management commands."""
+import os
+import tempfile
+import time
+from decimal import Decimal
+from io import StringIO
+from unittest import skipIf, skipUnless
 from unittest.mock import patch
 
 from psycopg2 import OperationalError as Psycopg2Error
 
+from core.management.commands.clean_media import (
+    get_referenced_images,
+    walk_files,
+)
+from core.models import Recipe, RecipeTag, Tag, StoredFile
+from core.partitioning import is_partitioned
+
 from django.core.management import call_command
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management.base import CommandError
+from django.db import connection
 from django.db.utils import OperationalError
-from django.test import SimpleTestCase
+from django.test import SimpleTestCase, TestCase, override_settings
 
 # We use SimpleTestCase because we don't need db for these tests
 
@@ -39,3 +56,192 @@ class CommandTests(SimpleTestCase):
 
         self.assertEqual(patched_check.call_count, 6)
         patched_check.assert_called_with(databases=['default'])
+
+
+class BenchmarkCommandTests(SimpleTestCase):
+    """Test the benchmark command."""
+
+    def test_benchmark_runs_selected(self):
+        """Test running a selected benchmark reports its results"""
+        out = StringIO()
+
+        call_command('benchmark', 'renderers', number=10, stdout=out)
+
+        self.assertIn('render core json', out.getvalue())
+
+
+class ReconcileRecipeCountsTests(TestCase):
+    """Test the reconcile_recipe_counts command."""
+
+    def test_reconcile_fixes_drifted_counts(self):
+        """Test counts that drifted are recomputed"""
+        user = get_user_model().objects.create_user(
+            email='test@example.com',
+            password='testpass123'
+        )
+        recipe = Recipe.objects.create(
+            user=user, title='Recipe', time_minutes=5, price='5.50'
+        )
+        tag = Tag.objects.create(user=user, name='Tag')
+        recipe.tags.add(tag)
+        Tag.objects.update(recipe_count=7)
+
+        out = StringIO()
+        call_command('reconcile_recipe_counts', stdout=out)
+
+        tag.refresh_from_db()
+        self.assertEqual(tag.recipe_count, 1)
+        self.assertIn('1 tags with a wrong recipe count', out.getvalue())
+
+
+class PartitionRecipesTests(TestCase):
+    """Test the partition_recipes command."""
+
+    @skipIf(connection.vendor == 'postgresql', 'PostgreSQL can partition')
+    def test_requires_postgresql(self):
+        """Test partitioning is refused on other databases"""
+        with self.assertRaises(CommandError):
+            call_command('partition_recipes', stdout=StringIO())
+
+    @skipUnless(connection.vendor == 'postgresql', 'Needs PostgreSQL')
+    def test_partition(self):
+        """Test the tables are partitioned with their rows, and the ORM
+        keeps working on them"""
+        user = get_user_model().objects.create_user(
+            email='test@example.com',
+            password='testpass123'
+        )
+        recipe = Recipe.objects.create(
+            user=user, title='Recipe', time_minutes=5, price='5.50'
+        )
+        tag = Tag.objects.create(user=user, name='Tag')
+        recipe.tags.add(tag)
+
+        call_command('partition_recipes', partitions=4, stdout=StringIO())
+
+        with connection.cursor() as cursor:
+            for table in ['core_recipe', 'core_recipe_tags']:
+                self.assertTrue(is_partitioned(cursor, table))
+        self.assertEqual(list(Recipe.objects.filter(tags=tag)), [recipe])
+        other = Recipe.objects.create(
+            user=user, title='Other', time_minutes=5, price='5.50'
+        )
+        self.assertGreater(other.id, recipe.id)
+        other.tags.add(tag)
+        recipe.delete()
+        self.assertEqual(
+            list(RecipeTag.objects.values_list('recipe_id', flat=True)),
+            [other.id]
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', 'Needs PostgreSQL')
+    def test_partition_dry_run(self):
+        """Test a dry run only prints the statements"""
+        out = StringIO()
+        call_command('partition_recipes', dry_run=True, stdout=out)
+
+        self.assertIn('PARTITION BY HASH (user_id)', out.getvalue())
+        with connection.cursor() as cursor:
+            self.assertFalse(is_partitioned(cursor, 'core_recipe'))
+
+
+class CleanMediaTests(TestCase):
+    """Test garbage collecting orphaned recipe images."""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='testpass123'
+        )
+        self.recipe = Recipe.objects.create(
+            user=user,
+            title='Recipe',
+            time_minutes=5,
+            price=Decimal('5.00')
+        )
+        self.storage = Recipe._meta.get_field('image').storage
+
+    def age(self, name, seconds):
+        """Set the mtime of a stored file seconds in the past."""
+        mtime = time.time() - seconds
+        os.utime(self.storage.path(name), (mtime, mtime))
+
+    def test_clean_media_deletes_old_orphans(self):
+        """Test unreferenced files past the grace period are deleted"""
+        self.recipe.image.save('old.jpg', ContentFile(b'old'))
+        orphan = self.recipe.image.name
+        self.recipe.image.save('new.jpg', ContentFile(b'new'))
+        referenced = self.recipe.image.name
+        recent = self.storage.save(
+            'uploads/recipe/recent.jpg', ContentFile(b'recent')
+        )
+        for name in (orphan, referenced):
+            self.age(name, 7200)
+
+        out = StringIO()
+        call_command('clean_media', '--grace-period', '3600', stdout=out)
+
+        self.assertFalse(self.storage.exists(orphan))
+        self.assertTrue(self.storage.exists(referenced))
+        self.assertTrue(self.storage.exists(recent))
+        self.assertFalse(StoredFile.objects.filter(name=orphan).exists())
+        self.assertIn('1 files deleted', out.getvalue())
+
+    def test_clean_media_keeps_reused_files(self):
+        """Test orphans reused after the walk aren't deleted"""
+        self.recipe.image.save('old.jpg', ContentFile(b'old'))
+        reused = self.recipe.image.name
+        self.recipe.image.save('new.jpg', ContentFile(b'new'))
+        touched = self.storage.save(
+            'uploads/recipe/touched.jpg', ContentFile(b'touched')
+        )
+        for name in (reused, touched):
+            self.age(name, 7200)
+
+        def walk_then_touch(*args):
+            files = walk_files(*args)
+            # An upload of the same content refreshes the file
+            os.utime(self.storage.path(touched))
+            return files
+
+        def read_then_reuse():
+            referenced = get_referenced_images()
+            # A recipe picks the image up again
+            StoredFile.objects.filter(name=reused).update(ref_count=1)
+            return referenced
+
+        command = 'core.management.commands.clean_media'
+        out = StringIO()
+        with patch(f'{command}.walk_files', walk_then_touch), \
+                patch(f'{command}.get_referenced_images', read_then_reuse):
+            call_command(
+                'clean_media', '--grace-period', '3600', stdout=out
+            )
+
+        self.assertTrue(self.storage.exists(reused))
+        self.assertTrue(self.storage.exists(touched))
+        self.assertTrue(StoredFile.objects.filter(name=reused).exists())
+        self.assertIn('0 files deleted', out.getvalue())
+
+    def test_clean_media_dry_run(self):
+        """Test a dry run only reports the orphaned files"""
+        name = self.storage.save(
+            'uploads/recipe/orphan.jpg', ContentFile(b'orphan')
+        )
+        self.age(name, 7200)
+
+        out = StringIO()
+        call_command(
+            'clean_media', '--dry-run', '--grace-period', '3600',
+            verbosity=2, stdout=out
+        )
+
+        self.assertTrue(self.storage.exists(name))
+        self.assertIn('1 unreferenced (6 bytes)', out.getvalue())
+        self.assertIn(name, out.getvalue())
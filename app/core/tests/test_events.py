@@ -0,0 +1,189 @@
+"""Tests for the change event broker and Server-Sent Events feed."""
+import asyncio
+import threading
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from rest_framework.authtoken.models import Token
+
+from core.events import InProcessBroker, RESYNC_EVENT
+from core.models import Recipe
+from core.sse import events_app
+
+
+class InProcessBrokerTests(SimpleTestCase):
+    """Test the in process broker."""
+
+    async def test_publish_from_other_thread(self):
+        """Test events published from a worker thread are delivered"""
+        broker = InProcessBroker()
+        subscription = broker.subscribe(1)
+        other = broker.subscribe(2)
+
+        thread = threading.Thread(
+            target=broker.publish, args=(1, {'type': 'recipe'})
+        )
+        thread.start()
+        thread.join()
+
+        self.assertEqual(await subscription.get(1), {'type': 'recipe'})
+        self.assertIsNone(await other.get(0.01))
+
+    async def test_slow_subscriber_gets_resync(self):
+        """Test a full queue is replaced by a resync event"""
+        with override_settings(EVENTS_QUEUE_SIZE=2):
+            broker = InProcessBroker()
+        subscription = broker.subscribe(1)
+
+        for i in range(3):
+            broker.publish(1, {'type': 'recipe', 'ids': [i]})
+        await asyncio.sleep(0)
+
+        self.assertEqual(await subscription.get(1), RESYNC_EVENT)
+        self.assertIsNone(await subscription.get(0.01))
+
+    async def test_unsubscribe(self):
+        """Test unsubscribed connections stop receiving events"""
+        broker = InProcessBroker()
+        subscription = broker.subscribe(1)
+
+        broker.unsubscribe(subscription)
+        broker.publish(1, {'type': 'recipe'})
+        await asyncio.sleep(0)
+
+        self.assertIsNone(await subscription.get(0.01))
+
+
+class PublishChangeTests(TestCase):
+    """Test changes are published once committed."""
+
+    def test_recipe_save_published(self):
+        """Test saving a recipe publishes an event for its owner"""
+        user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='testpass123'
+        )
+
+        with patch('core.events.get_broker') as get_broker:
+            with self.captureOnCommitCallbacks(execute=True):
+                recipe = Recipe.objects.create(
+                    user=user,
+                    title='Recipe',
+                    time_minutes=5,
+                    price=Decimal('5.50')
+                )
+
+        get_broker().publish.assert_called_once_with(user.id, {
+            'type': 'recipe',
+            'action': 'saved',
+            'ids': [recipe.id],
+            'token': str(recipe.change_seq),
+        })
+
+
+@override_settings(EVENTS_HEARTBEAT_INTERVAL=0.01)
+class EventsAppTests(TestCase):
+    """Test the Server-Sent Events ASGI application."""
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='testpass123'
+        )
+        self.token = Token.objects.create(user=self.user)
+
+    async def stream(self, headers, on_start=None):
+        """Run the app until its first event or heartbeat is sent, and
+        return the messages it sent."""
+        sent = []
+        streaming = asyncio.Event()
+
+        async def receive():
+            await streaming.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if message['type'] == 'http.response.start' and on_start:
+                on_start()
+            if len(sent) > 2:
+                streaming.set()
+
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/api/recipe/events/',
+            'headers': headers,
+            'query_string': b'',
+        }
+        await asyncio.wait_for(events_app(scope, receive, send), 5)
+
+        return sent
+
+    async def test_invalid_token(self):
+        """Test a valid token is required"""
+        sent = await self.stream([(b'authorization', b'Token invalid')])
+
+        self.assertEqual(sent[0]['status'], 401)
+
+    async def test_streams_events(self):
+        """Test published events are streamed to the user"""
+        broker = InProcessBroker()
+        event = {'type': 'recipe', 'action': 'saved', 'ids': [1], 'token': '7'}
+
+        def publish():
+            broker.publish(self.user.id, event)
+
+        with patch('core.sse.get_broker', return_value=broker):
+            sent = await self.stream(
+                [(b'authorization', f'Token {self.token.key}'.encode())],
+                on_start=publish
+            )
+
+        self.assertEqual(sent[0]['status'], 200)
+        self.assertIn(
+            (b'content-type', b'text/event-stream'), sent[0]['headers']
+        )
+        body = sent[2]['body'].decode()
+        self.assertTrue(body.startswith('id: 7\nevent: recipe\ndata: {'))
+        # The connection was unsubscribed on disconnect
+        self.assertEqual(broker._subscriptions, {})
+
+    async def test_heartbeat(self):
+        """Test idle connections get heartbeat comments"""
+        sent = await self.stream(
+            [(b'authorization', f'Token {self.token.key}'.encode())]
+        )
+
+        self.assertEqual(sent[2]['body'], b': ping\n\n')
+
+    @override_settings(EVENTS_HEARTBEAT_INTERVAL=60)
+    async def test_idle_disconnect(self):
+        """Test idle connections are closed without waiting for a heartbeat"""
+        broker = InProcessBroker()
+        sent = []
+
+        async def receive():
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+
+        scope = {
+            'type': 'http',
+            'method': 'GET',
+            'path': '/api/recipe/events/',
+            'headers': [
+                (b'authorization', f'Token {self.token.key}'.encode())
+            ],
+            'query_string': b'',
+        }
+        with patch('core.sse.get_broker', return_value=broker):
+            await asyncio.wait_for(events_app(scope, receive, send), 5)
+
+        # Only the response start and the retry interval were sent
+        self.assertEqual(len(sent), 2)
+        self.assertEqual(broker._subscriptions, {})
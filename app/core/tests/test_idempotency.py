@@ -0,0 +1,128 @@
+"""Tests for the Idempotency-Key handling."""
+import threading
+from types import SimpleNamespace
+
+from django.db import transaction
+from django.test import SimpleTestCase, override_settings
+
+from rest_framework.parsers import JSONParser
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APIRequestFactory
+
+from core.idempotency import (
+    IdempotencyConflict,
+    get_cache_key,
+    get_idempotency_cache,
+    run_idempotent,
+)
+
+
+def create_request(key='key-1', user_id=1, data=None):
+    """Return a JSON POST request with an Idempotency-Key."""
+    request = Request(
+        APIRequestFactory().post(
+            '/api/recipe/recipes/',
+            data or {'title': 'Curry'},
+            format='json',
+            HTTP_IDEMPOTENCY_KEY=key
+        ),
+        parsers=[JSONParser()]
+    )
+    request.user = SimpleNamespace(pk=user_id)
+
+    return request
+
+
+@override_settings(IDEMPOTENCY_CACHE_ALIAS=None)
+class RunIdempotentTests(SimpleTestCase):
+    """Test running requests once per Idempotency-Key."""
+    databases = {'default'}
+
+    def setUp(self):
+        get_idempotency_cache().clear()
+
+    def test_concurrent_duplicate_waits(self):
+        """Test a duplicate of a request in flight waits for its response
+        instead of running again"""
+        started, finish = threading.Event(), threading.Event()
+        calls = []
+
+        def run():
+            calls.append(1)
+            started.set()
+            finish.wait(5)
+            return Response({'id': 1}, status=201)
+
+        first = threading.Thread(
+            target=run_idempotent, args=(create_request(), run)
+        )
+        first.start()
+        started.wait(5)
+        threading.Timer(0.2, finish.set).start()
+
+        res = run_idempotent(create_request(), run)
+        first.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res.data, {'id': 1})
+        self.assertEqual(res['Idempotent-Replayed'], 'true')
+
+    @override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0)
+    def test_wait_timeout(self):
+        """Test a duplicate gives up waiting after the timeout"""
+        def run():
+            with self.assertRaises(IdempotencyConflict):
+                run_idempotent(create_request(), run)
+            return Response({'id': 1}, status=201)
+
+        res = run_idempotent(create_request(), run)
+
+        self.assertEqual(res.status_code, 201)
+
+    def test_server_error_not_stored(self):
+        """Test 5xx responses release the key"""
+        responses = [Response(status=503), Response({'id': 1}, status=201)]
+
+        first = run_idempotent(create_request(), lambda: responses[0])
+        retry = run_idempotent(create_request(), lambda: responses[1])
+
+        self.assertEqual(first.status_code, 503)
+        self.assertEqual(retry.status_code, 201)
+        self.assertFalse(retry.has_header('Idempotent-Replayed'))
+
+    def test_no_key(self):
+        """Test requests without a key always run"""
+        request = create_request()
+        del request._request.META['HTTP_IDEMPOTENCY_KEY']
+        calls = []
+
+        for _ in range(2):
+            run_idempotent(request, lambda: calls.append(1) or Response())
+
+        self.assertEqual(len(calls), 2)
+
+    def test_stored_on_commit(self):
+        """Test responses are only stored once their transaction commits,
+        and not at all when it's rolled back"""
+        class Rollback(Exception):
+            pass
+
+        def run():
+            return Response({'id': 1}, status=201)
+
+        with self.assertRaises(Rollback), transaction.atomic():
+            run_idempotent(create_request(), run)
+            self.assertNotIn('status', get_idempotency_cache().get(
+                get_cache_key(SimpleNamespace(pk=1), 'key-1')
+            ))
+            raise Rollback()
+
+        get_idempotency_cache().clear()
+        with transaction.atomic():
+            run_idempotent(create_request(), run)
+        res = run_idempotent(create_request(), lambda: Response(status=500))
+
+        self.assertEqual(res.status_code, 201)
+        self.assertEqual(res['Idempotent-Replayed'], 'true')
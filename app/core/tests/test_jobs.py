@@ -0,0 +1,208 @@
+"""
+Tests for the background jobs.
+"""
+import os
+import tempfile
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import jobs
+from core.models import Job, Recipe, StoredFile
+from core.tasks import delete_unused_image
+
+calls = []
+
+
+def record_call(**kwargs):
+    """Task recording its calls."""
+    calls.append(kwargs)
+
+
+def fail(**kwargs):
+    """Task always failing."""
+    raise RuntimeError('Task failed')
+
+
+class JobTests(TestCase):
+    """Test queueing and running jobs."""
+
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_and_run(self):
+        """Test a queued job is claimed and run with its arguments"""
+        job = jobs.enqueue(record_call, recipe_id=1)
+        self.assertEqual(job.task, 'core.tests.test_jobs.record_call')
+
+        claimed = jobs.claim_jobs(10)
+        self.assertEqual(claimed, [job])
+        self.assertEqual(claimed[0].status, Job.RUNNING)
+        self.assertEqual(claimed[0].attempts, 1)
+        self.assertEqual(jobs.claim_jobs(10), [])
+
+        self.assertEqual(jobs.run_job(claimed[0]), Job.SUCCEEDED)
+        self.assertEqual(calls, [{'recipe_id': 1}])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_claim_only_due_jobs(self):
+        """Test jobs scheduled in the future aren't claimed"""
+        jobs.enqueue(
+            record_call, run_at=timezone.now() + timedelta(minutes=5)
+        )
+
+        self.assertEqual(jobs.claim_jobs(10), [])
+
+    @override_settings(JOBS_RETRY_BACKOFF=10)
+    def test_failed_job_retried_with_backoff(self):
+        """Test failed jobs are retried later until out of attempts"""
+        job = jobs.enqueue(fail, max_attempts=2)
+
+        claimed, = jobs.claim_jobs(1)
+        with patch('core.jobs.logger'):
+            self.assertEqual(jobs.run_job(claimed), Job.QUEUED)
+        job.refresh_from_db()
+        self.assertGreater(job.run_at, timezone.now() + timedelta(seconds=4))
+        self.assertIn('Task failed', job.last_error)
+
+        Job.objects.filter(id=job.id).update(run_at=timezone.now())
+        claimed, = jobs.claim_jobs(1)
+        with patch('core.jobs.logger'):
+            self.assertEqual(jobs.run_job(claimed), Job.FAILED)
+
+    def test_retry_delay_is_exponential(self):
+        """Test the retry delay doubles per attempt up to the maximum"""
+        with override_settings(
+            JOBS_RETRY_BACKOFF=10, JOBS_RETRY_BACKOFF_MAX=60
+        ), patch('core.jobs.random.uniform', return_value=1):
+            delays = [
+                jobs.get_retry_delay(attempt).total_seconds()
+                for attempt in range(1, 6)
+            ]
+
+        self.assertEqual(delays, [10, 20, 40, 60, 60])
+
+    @override_settings(JOBS_TIMEOUT=60)
+    def test_requeue_stale_jobs(self):
+        """Test jobs left running by a dead worker are queued again"""
+        job = jobs.enqueue(record_call)
+        jobs.claim_jobs(1)
+        Job.objects.filter(id=job.id).update(
+            started_at=timezone.now() - timedelta(minutes=5)
+        )
+
+        self.assertEqual(jobs.requeue_stale_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+
+    @override_settings(JOBS_TIMEOUT=60)
+    def test_superseded_run_dropped(self):
+        """Test a run whose job was requeued and claimed again doesn't
+        record its outcome"""
+        job = jobs.enqueue(record_call)
+        stale, = jobs.claim_jobs(1)
+        Job.objects.filter(id=job.id).update(
+            started_at=timezone.now() - timedelta(minutes=5)
+        )
+        jobs.requeue_stale_jobs()
+        jobs.claim_jobs(1)
+
+        with patch('core.jobs.logger') as logger:
+            jobs.run_job(stale)
+
+        logger.warning.assert_called_once()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.RUNNING)
+        self.assertEqual(job.attempts, 2)
+
+    def test_job_metrics(self):
+        """Test metrics count jobs per status"""
+        jobs.enqueue(record_call)
+        jobs.enqueue(record_call)
+        jobs.run_job(jobs.claim_jobs(1)[0])
+
+        metrics = jobs.get_job_metrics()
+
+        self.assertEqual(metrics[Job.QUEUED], 1)
+        self.assertEqual(metrics[Job.SUCCEEDED], 1)
+        self.assertEqual(metrics[Job.FAILED], 0)
+        self.assertGreaterEqual(metrics['lag'], 0)
+        self.assertGreaterEqual(metrics['average_run_time'], 0)
+
+    def test_worker_command_burst(self):
+        """Test the worker runs the due jobs and exits in burst mode"""
+        for recipe_id in range(3):
+            jobs.enqueue(record_call, recipe_id=recipe_id)
+
+        out = StringIO()
+        call_command(
+            'worker', '--burst', '--concurrency', '1', stdout=out
+        )
+
+        self.assertEqual(len(calls), 3)
+        self.assertIn('Processed 3 jobs: 3 succeeded', out.getvalue())
+
+
+@override_settings(MEDIA_DELETE_DELAY=300)
+class DeleteUnusedImageTests(TestCase):
+    """Test deleting replaced recipe images in the background."""
+
+    def setUp(self):
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        user = get_user_model().objects.create_user(
+            email='user@example.com',
+            password='testpass123'
+        )
+        self.recipe = Recipe.objects.create(
+            user=user,
+            title='Recipe',
+            time_minutes=5,
+            price=Decimal('5.00')
+        )
+        self.storage = Recipe._meta.get_field('image').storage
+        self.recipe.image.save('old.jpg', ContentFile(b'old'))
+        self.old = self.recipe.image.name
+        self.recipe.image.save('new.jpg', ContentFile(b'new'))
+
+    def age(self, name, seconds):
+        """Set the mtime of a stored file seconds in the past."""
+        mtime = time.time() - seconds
+        os.utime(self.storage.path(name), (mtime, mtime))
+
+    def test_delete_replaced_image(self):
+        """Test a replaced image nothing references is deleted"""
+        self.age(self.old, 600)
+
+        delete_unused_image(name=self.old)
+
+        self.assertFalse(self.storage.exists(self.old))
+        self.assertFalse(StoredFile.objects.filter(name=self.old).exists())
+        self.assertTrue(self.storage.exists(self.recipe.image.name))
+
+    def test_keep_reused_image(self):
+        """Test images referenced or uploaded again since are kept"""
+        delete_unused_image(name=self.old)
+
+        self.assertTrue(self.storage.exists(self.old))
+
+        self.age(self.old, 600)
+        StoredFile.objects.filter(name=self.old).update(ref_count=1)
+
+        delete_unused_image(name=self.old)
+
+        self.assertTrue(self.storage.exists(self.old))
@@ -0,0 +1,31 @@
+"""
+Tests for serving media files.
+"""
+from django.test import SimpleTestCase
+
+from core.media import parse_range
+
+
+class ParseRangeTests(SimpleTestCase):
+    """Test parsing Range headers."""
+
+    def test_parse_range(self):
+        """Test byte ranges are resolved against the file size"""
+        self.assertEqual(parse_range('bytes=0-9', 100), (0, 9))
+        self.assertEqual(parse_range('bytes=90-', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=90-200', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-200', 100), (0, 99))
+
+    def test_parse_range_ignored(self):
+        """Test invalid and multiple ranges serve the whole file"""
+        self.assertIsNone(parse_range('bytes=5-2', 100))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range('items=0-1', 100))
+
+    def test_parse_range_unsatisfiable(self):
+        """Test ranges past the end of the file raise ValueError"""
+        with self.assertRaises(ValueError):
+            parse_range('bytes=100-', 100)
+        with self.assertRaises(ValueError):
+            parse_range('bytes=-0', 100)
@@ -0,0 +1,111 @@
+"""Tests for custom middleware."""
+import gzip
+from unittest.mock import patch
+
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import SimpleTestCase, RequestFactory, override_settings
+
+from core.middleware import CompressionMiddleware, parse_accept_encoding
+
+PAYLOAD = b'{"title": "Sample recipe"}' * 100
+
+
+def make_response(content=PAYLOAD, content_type='application/json'):
+    """Create and return a sample response."""
+    return HttpResponse(content, content_type=content_type)
+
+
+@patch('core.middleware.brotli', None)
+@override_settings(
+    COMPRESSION_MIN_SIZE=200,
+    COMPRESSION_CONTENT_TYPES=['application/json'],
+    COMPRESSION_CACHE_ALIAS=None,
+)
+class CompressionMiddlewareTests(SimpleTestCase):
+    """Test the compression middleware."""
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def process(self, response, accept_encoding='gzip, deflate'):
+        """Run a response through the middleware."""
+        request = self.factory.get(
+            '/', HTTP_ACCEPT_ENCODING=accept_encoding
+        )
+        middleware = CompressionMiddleware(lambda request: response)
+        return middleware(request)
+
+    def test_compresses_json(self):
+        """Test JSON responses are gzip compressed"""
+        res = self.process(make_response())
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(res['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(res.content), PAYLOAD)
+        self.assertEqual(res['Content-Length'], str(len(res.content)))
+
+    def test_small_response_not_compressed(self):
+        """Test responses under the size threshold are left alone"""
+        res = self.process(make_response(b'{"id": 1}'))
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertEqual(res.content, b'{"id": 1}')
+
+    def test_content_type_not_allowed(self):
+        """Test content types outside the allowlist are left alone"""
+        res = self.process(make_response(content_type='image/png'))
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+
+    def test_client_refuses_encoding(self):
+        """Test nothing is compressed when the client refuses gzip"""
+        res = self.process(make_response(), accept_encoding='gzip;q=0')
+
+        self.assertFalse(res.has_header('Content-Encoding'))
+        self.assertEqual(res['Vary'], 'Accept-Encoding')
+
+    def test_strong_etag_made_weak(self):
+        """Test a strong ETag becomes weak once compressed"""
+        response = make_response()
+        response['ETag'] = '"abc"'
+
+        res = self.process(response)
+
+        self.assertEqual(res['ETag'], 'W/"abc"')
+
+    @override_settings(COMPRESSION_CACHE_ALIAS='default')
+    def test_compressed_body_cached(self):
+        """Test hot responses reuse the cached compressed body"""
+        cache.clear()
+
+        with patch('core.middleware.compress_string') as compress:
+            compress.return_value = b'compressed'
+            for _ in range(2):
+                response = make_response()
+                response['Cache-Control'] = 'public, max-age=60'
+                res = self.process(response)
+
+        compress.assert_called_once_with(PAYLOAD)
+        self.assertEqual(res.content, b'compressed')
+
+    @override_settings(COMPRESSION_CACHE_ALIAS='default')
+    def test_private_body_not_cached(self):
+        """Test responses that can't be cached aren't stored"""
+        cache.clear()
+
+        for cache_control in [None, 'private, max-age=60', 'no-cache']:
+            response = make_response()
+            if cache_control:
+                response['Cache-Control'] = cache_control
+            self.process(response)
+
+        self.assertIsNone(cache.get(
+            CompressionMiddleware().get_cache_key(PAYLOAD, 'gzip')
+        ))
+
+    def test_parse_accept_encoding(self):
+        """Test parsing the Accept-Encoding header"""
+        res = parse_accept_encoding('gzip;q=1.0, br; q=0, identity')
+
+        self.assertEqual(res, {'gzip', 'identity'})
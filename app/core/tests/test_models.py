@@ -1,11 +1,17 @@
 """Tests for models."""
 
-from unittest.mock import patch
+import hashlib
+import os
+import tempfile
 from decimal import Decimal
 # We use TestCase because we need db for these tests
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from core import models
+from core.storage import ContentAddressedStorage
 
 
 def create_user(**params):
@@ -108,25 +114,234 @@ class ModelTests(TestCase):
 
         self.assertEqual(str(ingredient), ingredient.name)
 
-    @patch('core.models.uuid.uuid4')
-    def test_recipe_file_name_uuid(self, mock_uuid):
+    def test_recipe_file_name(self):
         """Test generating image path"""
-        uuid = 'test-uuid'
-        mock_uuid.return_value = uuid
+        file_path = models.recipe_image_file_path(None, 'example.JPG')
 
-        user = create_user(
+        self.assertEqual(file_path, "uploads/recipe/image.jpg")
+
+
+class RecipeCountTests(TestCase):
+    """Test the denormalized recipe counts of tags and ingredients."""
+
+    def setUp(self):
+        self.user = create_user(
             email="test@example.com",
             password="testpassword123"
         )
+        self.recipe = models.Recipe.objects.create(
+            user=self.user,
+            title="Sample recipe name",
+            time_minutes=5,
+            price=Decimal('5.50'),
+        )
+        self.tag = models.Tag.objects.create(user=self.user, name="Tag1")
+        self.ingredient = models.Ingredient.objects.create(
+            user=self.user,
+            name="Ingredient 1"
+        )
 
-        recipe = models.Recipe.objects.create(
-            user=user,
+    def assertCounts(self, tag_count, ingredient_count):
+        """Check the stored counts of the sample tag and ingredient."""
+        self.tag.refresh_from_db()
+        self.ingredient.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, tag_count)
+        self.assertEqual(self.ingredient.recipe_count, ingredient_count)
+
+    def test_add_and_remove(self):
+        """Test counts follow adds and removes, ignoring no-ops"""
+        self.recipe.tags.add(self.tag)
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(self.ingredient)
+        self.assertCounts(1, 1)
+
+        self.recipe.tags.remove(self.tag)
+        self.recipe.tags.remove(self.tag)
+        self.assertCounts(0, 1)
+
+    def test_clear(self):
+        """Test counts are decremented when clearing a recipe"""
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(self.ingredient)
+
+        self.recipe.tags.clear()
+        self.recipe.ingredients.clear()
+
+        self.assertCounts(0, 0)
+
+    def test_reverse_relation(self):
+        """Test changes made from the tag side are counted"""
+        recipe2 = models.Recipe.objects.create(
+            user=self.user,
+            title="Another recipe",
+            time_minutes=5,
+            price=Decimal('5.50'),
+        )
+
+        self.tag.recipe_set.add(self.recipe, recipe2)
+        self.assertCounts(2, 0)
+
+        self.tag.recipe_set.clear()
+        self.assertCounts(0, 0)
+
+    def test_delete_recipe(self):
+        """Test deleting a recipe decrements its tags and ingredients"""
+        self.recipe.tags.add(self.tag)
+        self.recipe.ingredients.add(self.ingredient)
+
+        self.recipe.delete()
+
+        self.assertCounts(0, 0)
+
+    def test_delete_user_removes_tombstones(self):
+        """Test deleting a user cascades without leaving tombstones"""
+        self.recipe.tags.add(self.tag)
+
+        self.user.delete()
+
+        self.assertFalse(models.Tombstone.objects.exists())
+        self.assertFalse(models.Tag.objects.exists())
+
+
+class RecipeLinkTests(TestCase):
+    """Test the links between recipes and their tags and ingredients."""
+
+    def setUp(self):
+        self.user = create_user(
+            email="test@example.com",
+            password="testpassword123"
+        )
+        self.recipe = models.Recipe.objects.create(
+            user=self.user,
             title="Sample recipe name",
             time_minutes=5,
             price=Decimal('5.50'),
-            description="Sample recipe description."
         )
+        self.tag = models.Tag.objects.create(user=self.user, name="Tag1")
 
-        file_path = models.recipe_image_file_path(recipe, 'example.jpg')
+    def test_links_store_recipe_user(self):
+        """Test links added without a user get their recipe's"""
+        ingredient = models.Ingredient.objects.create(
+            user=self.user,
+            name="Ingredient 1"
+        )
+
+        self.recipe.tags.add(self.tag)
+        ingredient.recipe_set.add(self.recipe)
+
+        self.assertEqual(models.RecipeTag.objects.get().user, self.user)
+        self.assertEqual(
+            models.RecipeIngredient.objects.get().user, self.user
+        )
+
+    def test_link_through_defaults(self):
+        """Test links added with their user don't look up the recipe"""
+        with CaptureQueriesContext(connection) as queries:
+            self.recipe.tags.add(
+                self.tag, through_defaults={'user_id': self.user.id}
+            )
+
+        self.assertFalse(any(
+            'FROM "core_recipe"' in query['sql']
+            for query in queries.captured_queries
+        ))
+        self.assertTrue(models.RecipeTag.objects.filter(
+            user=self.user, tag=self.tag
+        ).exists())
+
+    def test_link_save(self):
+        """Test saving a link without a user sets its recipe's"""
+        link = models.RecipeTag(recipe=self.recipe, tag=self.tag)
+        link.save()
+
+        self.assertEqual(link.user_id, self.user.id)
+
+
+class ContentAddressedImageTests(TestCase):
+    """Test storing recipe images once per distinct content."""
+
+    def setUp(self):
+        self.media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(self.media_root.cleanup)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root.name
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.user = create_user(
+            email="test@example.com",
+            password="testpassword123"
+        )
 
-        self.assertEqual(file_path, f"uploads/recipe/{recipe.id}/{uuid}.jpg")
+    def create_recipe(self, title):
+        return models.Recipe.objects.create(
+            user=self.user,
+            title=title,
+            time_minutes=5,
+            price=Decimal('5.50')
+        )
+
+    def set_image(self, recipe, content):
+        recipe.image.save('image.jpg', ContentFile(content))
+
+    def get_ref_count(self, name):
+        return models.StoredFile.objects.get(name=name).ref_count
+
+    def test_identical_images_stored_once(self):
+        """Test identical images share one file and are reference counted"""
+        recipe1 = self.create_recipe('Recipe 1')
+        recipe2 = self.create_recipe('Recipe 2')
+
+        self.set_image(recipe1, b'same content')
+        self.set_image(recipe2, b'same content')
+
+        self.assertEqual(recipe1.image.name, recipe2.image.name)
+        directory = os.path.dirname(recipe1.image.path)
+        self.assertEqual(os.listdir(directory), [
+            os.path.basename(recipe1.image.name)
+        ])
+        self.assertEqual(self.get_ref_count(recipe1.image.name), 2)
+
+    def test_replacing_and_deleting_release_references(self):
+        """Test references are released when images change or recipes
+        are deleted"""
+        recipe1 = self.create_recipe('Recipe 1')
+        recipe2 = self.create_recipe('Recipe 2')
+        self.set_image(recipe1, b'first')
+        self.set_image(recipe2, b'first')
+        first = recipe1.image.name
+
+        self.set_image(recipe1, b'second')
+        second = recipe1.image.name
+        self.assertEqual(self.get_ref_count(first), 1)
+        self.assertEqual(self.get_ref_count(second), 1)
+
+        models.Recipe.objects.get(id=recipe2.id).delete()
+        self.assertEqual(self.get_ref_count(first), 0)
+
+    def test_deferred_image_is_not_counted(self):
+        """Test saving a recipe loaded without its image keeps counts"""
+        recipe = self.create_recipe('Recipe')
+        self.set_image(recipe, b'content')
+
+        deferred = models.Recipe.objects.only('title').get(id=recipe.id)
+        deferred.title = 'New title'
+        deferred.save()
+
+        self.assertEqual(self.get_ref_count(recipe.image.name), 1)
+
+    def test_storage_names_files_by_content_hash(self):
+        """Test files are named after their hash and written once"""
+        storage = ContentAddressedStorage(location=self.media_root.name)
+        content_hash = hashlib.sha256(b'content').hexdigest()
+
+        name1 = storage.save('a/file.TXT', ContentFile(b'content'))
+        name2 = storage.save('a/other.txt', ContentFile(b'content'))
+
+        expected = f'a/{content_hash[:2]}/{content_hash}.txt'
+        self.assertEqual(name1, expected)
+        self.assertEqual(name2, expected)
+        self.assertEqual(
+            os.listdir(storage.path(f'a/{content_hash[:2]}')),
+            [f'{content_hash}.txt']
+        )
@@ -0,0 +1,149 @@
+"""Tests for the JSON and binary renderers and parsers."""
+import io
+import json
+from datetime import datetime, timezone
+from decimal import Decimal
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.test import SimpleTestCase
+
+from rest_framework.exceptions import ParseError
+
+from core.renderers import (
+    CBORRenderer,
+    JSONRenderer,
+    MessagePackRenderer,
+    cbor2,
+    msgpack,
+)
+from core.parsers import CBORParser, JSONParser, MessagePackParser
+
+
+class JSONRendererTests(SimpleTestCase):
+    """Test the JSON renderer."""
+
+    def test_render_decimal_as_string(self):
+        """Test Decimal values are rendered without losing precision"""
+        res = JSONRenderer().render({'price': Decimal('5.10')})
+
+        self.assertEqual(json.loads(res), {'price': '5.10'})
+
+    def test_render_none(self):
+        """Test rendering None returns an empty body"""
+        self.assertEqual(JSONRenderer().render(None), b'')
+
+    def test_render_indent(self):
+        """Test an indent requested through the media type is applied"""
+        res = JSONRenderer().render(
+            {'id': 1}, 'application/json; indent=4'
+        )
+
+        self.assertEqual(res, b'{\n    "id": 1\n}')
+
+    def test_render_escapes_line_separators(self):
+        """Test \\u2028 and \\u2029 are escaped like DRF does"""
+        res = JSONRenderer().render({'title': 'a\u2028b\u2029c'})
+
+        self.assertIn(b'\\u2028', res)
+        self.assertIn(b'\\u2029', res)
+
+    @patch('core.renderers.orjson', None)
+    def test_render_stdlib_fallback(self):
+        """Test the stdlib fallback renders the same output"""
+        data = {'id': 1, 'price': Decimal('2.50'), 'tags': []}
+        fallback = JSONRenderer().render(data)
+
+        self.assertEqual(json.loads(fallback), {
+            'id': 1, 'price': '2.50', 'tags': []
+        })
+
+
+class JSONParserTests(SimpleTestCase):
+    """Test the JSON parser."""
+
+    def test_parse(self):
+        """Test parsing a JSON body"""
+        body = io.BytesIO(b'{"title": "Recipe", "price": "5.25"}')
+
+        res = JSONParser().parse(body)
+
+        self.assertEqual(res, {'title': 'Recipe', 'price': '5.25'})
+
+    def test_parse_invalid_raises_parse_error(self):
+        """Test invalid JSON raises a ParseError"""
+        with self.assertRaises(ParseError):
+            JSONParser().parse(io.BytesIO(b'{"title": NaN}'))
+
+    @patch('core.parsers.orjson', None)
+    def test_parse_stdlib_fallback(self):
+        """Test the stdlib fallback parses the same body"""
+        res = JSONParser().parse(io.BytesIO(b'{"id": 1}'))
+
+        self.assertEqual(res, {'id': 1})
+
+
+@skipUnless(msgpack, 'msgpack is not installed')
+class MessagePackTests(SimpleTestCase):
+    """Test the MessagePack renderer and parser."""
+
+    def test_round_trip(self):
+        """Test data rendered to MessagePack parses back the same"""
+        data = {'id': 1, 'title': 'Recipe', 'tags': [{'id': 2}], 'x': None}
+        body = MessagePackRenderer().render(data)
+
+        self.assertEqual(MessagePackParser().parse(io.BytesIO(body)), data)
+
+    def test_render_decimal_as_string(self):
+        """Test Decimal values are rendered like the JSON renderer does"""
+        body = MessagePackRenderer().render({'price': Decimal('5.10')})
+
+        self.assertEqual(msgpack.unpackb(body), {'price': '5.10'})
+
+    def test_render_datetime(self):
+        """Test datetimes are rendered like the JSON renderer does"""
+        value = datetime(2024, 1, 2, 3, 4, 5, tzinfo=timezone.utc)
+        body = MessagePackRenderer().render({'at': value})
+
+        self.assertEqual(
+            msgpack.unpackb(body)['at'],
+            json.loads(JSONRenderer().render({'at': value}))['at']
+        )
+
+    def test_render_none(self):
+        """Test rendering None returns an empty body"""
+        self.assertEqual(MessagePackRenderer().render(None), b'')
+
+    def test_parse_invalid_raises_parse_error(self):
+        """Test invalid MessagePack raises a ParseError"""
+        with self.assertRaises(ParseError):
+            MessagePackParser().parse(io.BytesIO(b'\x92\x01'))
+
+
+@skipUnless(cbor2, 'cbor2 is not installed')
+class CBORTests(SimpleTestCase):
+    """Test the CBOR renderer and parser."""
+
+    def test_round_trip(self):
+        """Test data rendered to CBOR parses back the same"""
+        data = {'id': 1, 'title': 'Recipe', 'tags': [{'id': 2}], 'x': None}
+        body = CBORRenderer().render(data)
+
+        self.assertEqual(CBORParser().parse(io.BytesIO(body)), data)
+
+    def test_render_decimal_exact(self):
+        """Test Decimal values are rendered as exact decimal fractions"""
+        body = CBORRenderer().render({'price': Decimal('5.10')})
+
+        price = cbor2.loads(body)['price']
+        self.assertIsInstance(price, Decimal)
+        self.assertEqual(str(price), '5.10')
+
+    def test_render_none(self):
+        """Test rendering None returns an empty body"""
+        self.assertEqual(CBORRenderer().render(None), b'')
+
+    def test_parse_invalid_raises_parse_error(self):
+        """Test invalid CBOR raises a ParseError"""
+        with self.assertRaises(ParseError):
+            CBORParser().parse(io.BytesIO(b'\xa1\x01'))
@@ -0,0 +1,130 @@
+"""Tests for the cached OpenAPI schema."""
+import os
+import tempfile
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import schema
+
+SCHEMA_URL = reverse('api-schema')
+DOCS_URL = reverse('api-docs')
+
+
+class SchemaCacheTests(TestCase):
+    """Test serving the schema from the cache."""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.settings = override_settings(SCHEMA_CACHE_DIR=self.tmp_dir.name)
+        self.settings.enable()
+        schema.clear_schema_cache()
+        self.client = APIClient()
+
+    def tearDown(self):
+        schema.clear_schema_cache()
+        self.settings.disable()
+        self.tmp_dir.cleanup()
+
+    def test_schema_generated_once(self):
+        """Test the schema is only generated on the first request"""
+        with patch(
+            'core.schema.generate_schema',
+            wraps=schema.generate_schema
+        ) as generate:
+            res1 = self.client.get(SCHEMA_URL)
+            res2 = self.client.get(SCHEMA_URL)
+
+        self.assertEqual(res1.status_code, status.HTTP_200_OK)
+        self.assertEqual(res1.content, res2.content)
+        self.assertIn(b'/api/recipe/recipes/', res1.content)
+        generate.assert_called_once()
+
+    def test_schema_not_modified(self):
+        """Test a matching If-None-Match returns 304"""
+        res = self.client.get(SCHEMA_URL)
+        etag = res['ETag']
+
+        res = self.client.get(SCHEMA_URL, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(res.content, b'')
+
+    def test_schema_if_none_match_list(self):
+        """Test If-None-Match is compared per listed ETag"""
+        etag = self.client.get(SCHEMA_URL)['ETag']
+
+        for header, expected in [
+            (f'"other", {etag}', status.HTTP_304_NOT_MODIFIED),
+            ('*', status.HTTP_304_NOT_MODIFIED),
+            (f'"x{etag[1:-1]}x"', status.HTTP_200_OK),
+        ]:
+            res = self.client.get(SCHEMA_URL, HTTP_IF_NONE_MATCH=header)
+
+            self.assertEqual(res.status_code, expected)
+
+    def test_schema_etag_per_format(self):
+        """Test the YAML and JSON schemas have their own ETag"""
+        yaml_etag = self.client.get(SCHEMA_URL)['ETag']
+        json_accept = 'application/vnd.oai.openapi+json'
+
+        res = self.client.get(
+            SCHEMA_URL, HTTP_ACCEPT=json_accept, HTTP_IF_NONE_MATCH=yaml_etag
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(res['ETag'], yaml_etag)
+
+    def test_schema_json_format(self):
+        """Test the schema is rendered for the negotiated format"""
+        res = self.client.get(
+            SCHEMA_URL, HTTP_ACCEPT='application/vnd.oai.openapi+json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertIn('openapi', res.json())
+
+    def test_schema_loaded_from_disk(self):
+        """Test the disk cache is used when memory is empty"""
+        self.client.get(SCHEMA_URL)
+        schema.clear_schema_cache()
+
+        with patch('core.schema.generate_schema') as generate:
+            res = self.client.get(SCHEMA_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        generate.assert_not_called()
+
+    def test_code_change_invalidates_disk_cache(self):
+        """Test the disk cache is ignored when the code changes"""
+        self.client.get(SCHEMA_URL)
+        schema.clear_schema_cache()
+
+        with patch(
+            'core.schema.get_code_fingerprint',
+            return_value='changed'
+        ), patch(
+            'core.schema.generate_schema',
+            return_value={'openapi': '3.0.3'}
+        ) as generate:
+            self.client.get(SCHEMA_URL)
+
+        generate.assert_called_once()
+
+    def test_docs_use_versioned_schema_url(self):
+        """Test the Swagger UI loads the schema versioned by its ETag"""
+        res = self.client.get(DOCS_URL)
+
+        version = schema.get_schema_etag().strip('"')
+        self.assertContains(res, f'{SCHEMA_URL}?v={version}')
+
+    def test_generate_schema_command(self):
+        """Test the command writes the schema cache to disk"""
+        call_command('generate_schema', stdout=open(os.devnull, 'w'))
+
+        self.assertTrue(os.path.exists(schema.get_cache_path()))
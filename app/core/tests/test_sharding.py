@@ -0,0 +1,345 @@
+"""
+Tests for user sharding. The tests moving data between databases need a
+second database, like DB_SHARDS=shard1.
+"""
+from decimal import Decimal
+from io import StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from core.models import Recipe, RecipeTag, Tag, Tombstone
+from core.sharding import (
+    get_id_range_start,
+    pick_shard,
+    use_shard,
+    user_transaction,
+)
+
+RECIPES_URL = reverse('recipe:recipe-list')
+SYNC_URL = reverse('recipe:sync')
+BATCH_URL = reverse('batch')
+
+SHARD = next(
+    (alias for alias in settings.DATABASES if alias != 'default'), None
+)
+DATABASES = {'default', SHARD} - {None}
+
+
+def detail_url(recipe_id):
+    """Create and return a recipe detail URL."""
+    return reverse('recipe:recipe-detail', args=[recipe_id])
+
+
+def create_user(email='user@example.com', shard='default'):
+    """Create and return a user placed in shard."""
+    with override_settings(RECIPE_SHARDS=[shard]):
+        return get_user_model().objects.create_user(
+            email=email, password='pass12345'
+        )
+
+
+class PickShardTests(SimpleTestCase):
+    """Test placing users in shards."""
+
+    def test_placement_stable(self):
+        """Test users hash to the same shard every time, and all the
+        shards get users"""
+        shards = ['default', 'shard1', 'shard2']
+
+        placed = [pick_shard(user_id, shards) for user_id in range(300)]
+
+        self.assertEqual(
+            placed, [pick_shard(user_id, shards) for user_id in range(300)]
+        )
+        self.assertEqual(set(placed), set(shards))
+
+    def test_new_shard_only_claims_users(self):
+        """Test adding a shard only moves users to the new shard"""
+        before = ['default', 'shard1']
+        after = before + ['shard2']
+
+        for user_id in range(300):
+            shard = pick_shard(user_id, after)
+            if shard != 'shard2':
+                self.assertEqual(shard, pick_shard(user_id, before))
+
+
+class UserShardTests(TestCase):
+    """Test the shard of new users."""
+
+    @override_settings(RECIPE_SHARDS=['default', 'shard1', 'shard2'])
+    def test_create_user_picks_shard(self):
+        """Test new users are stored with the shard they hash to"""
+        user = get_user_model().objects.create_user(
+            email='user@example.com', password='pass12345'
+        )
+
+        user.refresh_from_db()
+        self.assertEqual(user.shard, pick_shard(user.pk))
+
+    def test_moving_checked_on_locked_row(self):
+        """Test writes check the user's flag again once the row is
+        locked, not only on the user loaded at authentication"""
+        user = create_user()
+        client = APIClient()
+        client.force_authenticate(user)
+        get_user_model().objects.filter(pk=user.pk).update(
+            shard_moving=True
+        )
+
+        res = client.post(RECIPES_URL, {
+            'title': 'Curry', 'time_minutes': 30, 'price': '5.50'
+        }, format='json')
+
+        self.assertEqual(
+            res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_body_parsed_before_lock(self):
+        """Test the request body is read before the user's row is
+        locked"""
+        user = create_user()
+        client = APIClient()
+        client.force_authenticate(user)
+        steps = []
+        parse = Request._parse
+
+        def record_parse(request):
+            steps.append('parse')
+            return parse(request)
+
+        def record_lock(user):
+            steps.append('lock')
+            return user_transaction(user)
+
+        with patch.object(Request, '_parse', record_parse), \
+                patch('core.sharding.user_transaction', record_lock):
+            client.post(RECIPES_URL, {
+                'title': 'Curry', 'time_minutes': 30, 'price': '5.50'
+            }, format='json')
+
+        self.assertEqual(steps, ['parse', 'lock'])
+
+    def test_writes_run_in_user_transaction(self):
+        """Test API writes run in the user's transaction, and reads
+        don't"""
+        user = create_user()
+        client = APIClient()
+        client.force_authenticate(user)
+
+        with patch(
+            'core.sharding.user_transaction', wraps=user_transaction
+        ) as transaction:
+            client.get(RECIPES_URL)
+            transaction.assert_not_called()
+            res = client.post(RECIPES_URL, {
+                'title': 'Curry', 'time_minutes': 30, 'price': '5.50'
+            }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        transaction.assert_called_once_with(user)
+
+
+@skipUnless(SHARD, 'Needs a second database')
+class ShardedApiTests(TestCase):
+    """Test the API of users whose recipes are in a shard."""
+    databases = DATABASES
+
+    def setUp(self):
+        self.user = create_user(shard=SHARD)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_recipes_stored_in_shard(self):
+        """Test recipes and their tags are written to and read from the
+        user's shard, with ids from its range"""
+        payload = {
+            'title': 'Curry',
+            'time_minutes': 30,
+            'price': '5.50',
+            'tags': [{'name': 'Dinner'}],
+        }
+
+        res = self.client.post(RECIPES_URL, payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.using(SHARD).get(id=res.data['id'])
+        self.assertGreater(recipe.id, get_id_range_start(SHARD))
+        self.assertEqual(recipe.tags.get().recipe_count, 1)
+        self.assertFalse(Recipe.objects.using('default').exists())
+        self.assertFalse(Tag.objects.using('default').exists())
+
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual([r['id'] for r in res.data], [recipe.id])
+
+    def test_other_shard_not_visible(self):
+        """Test recipes of users in other databases aren't listed"""
+        other = create_user(email='other@example.com')
+        Recipe.objects.create(
+            user=other, title='Other', time_minutes=5, price=Decimal('1.00')
+        )
+
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.data, [])
+        self.assertTrue(Recipe.objects.using('default').exists())
+
+    def test_delete_leaves_tombstone_in_shard(self):
+        """Test deleted recipes are synced from the shard's tombstones"""
+        with use_shard(SHARD):
+            recipe = Recipe.objects.create(
+                user=self.user, title='Soup', time_minutes=5,
+                price=Decimal('1')
+            )
+        self.user.refresh_from_db()
+        since = self.user.change_seq
+
+        self.client.delete(detail_url(recipe.id))
+        self.user.refresh_from_db()
+        res = self.client.get(SYNC_URL, {'since': since})
+
+        self.assertEqual(res.data['deleted']['recipes'], [recipe.id])
+        self.assertTrue(Tombstone.objects.using(SHARD).exists())
+
+    def test_writes_rejected_while_moving(self):
+        """Test writes are rejected while the user is moved, and reads
+        still work"""
+        self.user.shard_moving = True
+
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Curry', 'time_minutes': 30, 'price': '5.50'
+        }, format='json')
+
+        self.assertEqual(
+            res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+        self.assertIn('Retry-After', res)
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_atomic_batch_rolls_back_shard(self):
+        """Test a failed atomic batch rolls back the writes to the
+        shard"""
+        operation = {
+            'method': 'POST',
+            'path': RECIPES_URL,
+            'body': {'title': 'Curry', 'time_minutes': 30, 'price': '5.50'},
+        }
+        failing = {**operation, 'body': {'title': 'Bad'}}
+
+        res = self.client.post(BATCH_URL, {
+            'operations': [operation, failing], 'atomic': True
+        }, format='json')
+
+        self.assertFalse(res.data['committed'])
+        self.assertFalse(Recipe.objects.using(SHARD).exists())
+
+    def test_delete_user_deletes_shard_rows(self):
+        """Test deleting a user deletes their rows from their shard"""
+        with use_shard(SHARD):
+            recipe = Recipe.objects.create(
+                user=self.user, title='Soup', time_minutes=5,
+                price=Decimal('1')
+            )
+            recipe.tags.create(user=self.user, name='Quick')
+
+        self.user.delete()
+
+        for model in [Recipe, Tag, RecipeTag, Tombstone]:
+            self.assertFalse(model.objects.using(SHARD).exists())
+
+
+@skipUnless(SHARD, 'Needs a second database')
+class RebalanceShardsTests(TestCase):
+    """Test the rebalance_shards command."""
+    databases = DATABASES
+
+    def setUp(self):
+        self.user = create_user()
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def rebalance(self, **options):
+        """Run the command and return its output."""
+        out = StringIO()
+        call_command(
+            'rebalance_shards', grace_period=0, stdout=out, **options
+        )
+        return out.getvalue()
+
+    def test_move_user(self):
+        """Test moving a user copies their rows with their ids and removes
+        them from the old shard"""
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Curry',
+            'time_minutes': 30,
+            'price': '5.50',
+            'tags': [{'name': 'Dinner'}],
+            'ingredients': [{'name': 'Rice'}],
+        }, format='json')
+        recipe_id = res.data['id']
+        self.client.delete(reverse(
+            'recipe:tag-detail', args=[res.data['tags'][0]['id']]
+        ))
+
+        self.rebalance(users=[self.user.id], to=SHARD)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.shard, SHARD)
+        self.assertFalse(self.user.shard_moving)
+        for model in [Recipe, Tag, Tombstone]:
+            self.assertFalse(model.objects.using('default').exists())
+        recipe = Recipe.objects.using(SHARD).get(id=recipe_id)
+        self.assertEqual(recipe.ingredients.get().name, 'Rice')
+        self.assertEqual(Tombstone.objects.using(SHARD).count(), 1)
+
+        self.client.force_authenticate(self.user)
+        res = self.client.get(detail_url(recipe_id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+    def test_moved_rows_keep_shard_ids(self):
+        """Test rows copied into a shard don't move its id sequence"""
+        recipe = Recipe.objects.create(
+            user=self.user, title='Soup', time_minutes=5, price=Decimal('1')
+        )
+        other = create_user(email='other@example.com', shard=SHARD)
+        self.rebalance(users=[self.user.id], to=SHARD)
+
+        with use_shard(SHARD):
+            created = Recipe.objects.create(
+                user=other, title='New', time_minutes=5, price=Decimal('1')
+            )
+
+        self.assertLess(recipe.id, get_id_range_start(SHARD))
+        self.assertGreater(created.id, get_id_range_start(SHARD))
+
+    def test_dry_run_moves_to_hashed_shard(self):
+        """Test users are reported against the shard they hash to"""
+        shards = ['default', SHARD]
+
+        with override_settings(RECIPE_SHARDS=shards):
+            out = self.rebalance(dry_run=True)
+
+        moving = pick_shard(self.user.id, shards) != 'default'
+        self.assertIn(f'{int(moving)} users to move', out)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.shard, 'default')
+
+    def test_unknown_database(self):
+        """Test moving users to an unknown database fails"""
+        with self.assertRaises(CommandError):
+            self.rebalance(to='missing')
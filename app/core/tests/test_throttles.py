@@ -0,0 +1,81 @@
+"""Tests for the sliding window throttles."""
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.test import SimpleTestCase, override_settings
+
+from core.throttles import ActionRateThrottle, get_throttle_cache
+
+
+class Throttle(ActionRateThrottle):
+    """Throttle with fixed rates for tests."""
+    THROTTLE_RATES = {'test': '3/min'}
+
+
+def make_request(user_id=1):
+    """Create and return a fake authenticated request."""
+    user = SimpleNamespace(pk=user_id, is_authenticated=True)
+    return SimpleNamespace(user=user, META={'REMOTE_ADDR': '127.0.0.1'})
+
+
+class ActionRateThrottleTests(SimpleTestCase):
+    """Test the per action sliding window throttle."""
+
+    def setUp(self):
+        get_throttle_cache().clear()
+        self.view = SimpleNamespace(
+            action='create',
+            throttle_scopes={'create': 'test'}
+        )
+
+    def allow(self, now, user_id=1):
+        """Check a request at the given time."""
+        throttle = Throttle()
+        with patch.object(throttle, 'timer', return_value=now):
+            allowed = throttle.allow_request(make_request(user_id), self.view)
+
+        return allowed, throttle
+
+    def test_throttles_over_rate(self):
+        """Test requests over the rate are throttled with a wait time"""
+        for _ in range(3):
+            self.assertTrue(self.allow(6000)[0])
+
+        allowed, throttle = self.allow(6010)
+
+        self.assertFalse(allowed)
+        self.assertEqual(throttle.wait(), 50)
+
+    def test_throttle_is_per_user(self):
+        """Test each user has their own counters"""
+        for _ in range(3):
+            self.allow(6000)
+
+        self.assertTrue(self.allow(6000, user_id=2)[0])
+
+    def test_previous_window_weighted(self):
+        """Test the previous window is weighted by its overlap"""
+        for _ in range(3):
+            self.allow(6050)
+
+        # 5s into the next window, 3 * 55/60 requests still count
+        self.assertTrue(self.allow(6065)[0])
+        allowed, throttle = self.allow(6066)
+        self.assertFalse(allowed)
+        self.assertEqual(throttle.wait(), 14)
+
+        # Once the previous window is weighted down it's allowed again
+        self.assertTrue(self.allow(6081)[0])
+
+    def test_action_without_scope_not_throttled(self):
+        """Test actions without a scope are never throttled"""
+        self.view.action = 'list'
+        for _ in range(5):
+            self.assertTrue(self.allow(6000)[0])
+
+    @override_settings(THROTTLE_CACHE_ALIAS='missing')
+    def test_locmem_fallback(self):
+        """Test a process local cache is used without a throttle cache"""
+        cache = get_throttle_cache()
+
+        self.assertEqual(cache.__class__.__name__, 'LocMemCache')
@@ -0,0 +1,126 @@
+"""
+Throttles shared by the APIs.
+"""
+import math
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from rest_framework.throttling import SimpleRateThrottle
+
+_fallback_cache = LocMemCache('throttle', {})
+
+
+def get_throttle_cache():
+    """Return the cache holding throttle counters: THROTTLE_CACHE_ALIAS
+    when it's configured, a process local cache otherwise."""
+    alias = getattr(settings, 'THROTTLE_CACHE_ALIAS', None)
+    if alias and alias in settings.CACHES:
+        return caches[alias]
+
+    return _fallback_cache
+
+
+class SlidingWindowRateThrottle(SimpleRateThrottle):
+    """
+    Rate throttle using a sliding window counter.
+
+    Rather than storing the timestamp of every request like DRF's
+    SimpleRateThrottle, it keeps one counter per fixed window and weights
+    the previous window by how much of it still overlaps the sliding one.
+    A check is a single get_many and an incr, whatever the rate.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.cache = get_throttle_cache()
+
+    def get_window_counts(self, now):
+        """Return the counters of the current and previous windows."""
+        window = int(now // self.duration)
+        self.current_key = f'{self.key}:{window}'
+        previous_key = f'{self.key}:{window - 1}'
+        counts = self.cache.get_many([self.current_key, previous_key])
+        self.elapsed = now - window * self.duration
+
+        return (
+            counts.get(self.current_key, 0),
+            counts.get(previous_key, 0),
+        )
+
+    def allow_request(self, request, view):
+        if self.rate is None:
+            return True
+
+        self.key = self.get_cache_key(request, view)
+        if self.key is None:
+            return True
+
+        self.now = self.timer()
+        self.current, self.previous = self.get_window_counts(self.now)
+        weight = 1 - self.elapsed / self.duration
+        if self.previous * weight + self.current >= self.num_requests:
+            return self.throttle_failure()
+
+        return self.throttle_success()
+
+    def throttle_success(self):
+        try:
+            self.cache.incr(self.current_key)
+        except ValueError:
+            # Counters outlive their window by one window, as they're
+            # still weighted in while they are the previous window
+            if not self.cache.add(self.current_key, 1, 2 * self.duration):
+                self.cache.incr(self.current_key)
+
+        return True
+
+    def wait(self):
+        """Return the seconds until the next request would be allowed."""
+        remaining = self.duration - self.elapsed
+        if self.current >= self.num_requests:
+            # Wait for the next window, then for the current one to be
+            # weighted down below the limit
+            ratio = self.num_requests / max(self.current, 1)
+            wait = remaining + self.duration * (1 - ratio)
+        else:
+            ratio = (self.num_requests - self.current) / self.previous
+            wait = self.duration * (1 - ratio) - self.elapsed
+
+        # Rounded first so float noise never adds a second
+        return max(math.ceil(round(wait, 3)), 1)
+
+
+class ActionRateThrottle(SlidingWindowRateThrottle):
+    """
+    Per user throttle for individual viewset actions.
+
+    Views declare a `throttle_scopes` mapping of action names to scopes,
+    whose rates are set in DEFAULT_THROTTLE_RATES. Actions without a scope
+    aren't throttled.
+    """
+
+    def __init__(self):
+        # Rate is resolved in allow_request, once the scope is known
+        self.cache = get_throttle_cache()
+
+    def allow_request(self, request, view):
+        self.scope = getattr(view, 'throttle_scopes', {}).get(view.action)
+        if not self.scope:
+            return True
+
+        self.rate = self.get_rate()
+        self.num_requests, self.duration = self.parse_rate(self.rate)
+
+        return super().allow_request(request, view)
+
+    def get_cache_key(self, request, view):
+        if request.user and request.user.is_authenticated:
+            ident = request.user.pk
+        else:
+            ident = self.get_ident(request)
+
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': ident
+        }
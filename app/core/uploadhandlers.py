@@ -0,0 +1,43 @@
+"""
+Upload handlers computing the SHA-256 of uploaded files while they stream
+in, so content addressed storage doesn't need to read them again.
+"""
+import hashlib
+
+from django.core.files.uploadhandler import (
+    MemoryFileUploadHandler,
+    TemporaryFileUploadHandler,
+)
+
+
+class HashingUploadHandlerMixin:
+    """Set `content_hash` on the uploaded files."""
+
+    def new_file(self, *args, **kwargs):
+        self.digest = hashlib.sha256()
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        if file is not None:
+            file.content_hash = self.digest.hexdigest()
+
+        return file
+
+
+class HashingMemoryFileUploadHandler(
+    HashingUploadHandlerMixin,
+    MemoryFileUploadHandler
+):
+    """Keep small uploads in memory, computing their hash."""
+
+
+class HashingTemporaryFileUploadHandler(
+    HashingUploadHandlerMixin,
+    TemporaryFileUploadHandler
+):
+    """Stream large uploads to a temporary file, computing their hash."""
@@ -0,0 +1,138 @@
+"""
+Views for the precomputed OpenAPI schema, media files and batch requests.
+"""
+import json
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.static import serve
+from drf_spectacular.plumbing import set_query_parameters
+from drf_spectacular.utils import extend_schema
+from drf_spectacular.views import (
+    SpectacularAPIView,
+    SpectacularSwaggerView,
+)
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+
+from core.batch import run_batch
+from core.schema import get_rendered_schema, get_schema_etag
+from core.serializers import BatchRequestSerializer, BatchResponseSerializer
+
+
+def get_lang(request):
+    """Return the requested schema language if it's a known one."""
+    lang = request.GET.get('lang')
+    if settings.USE_I18N and lang in dict(settings.LANGUAGES):
+        return lang
+
+    return None
+
+
+class CachedSpectacularAPIView(SpectacularAPIView):
+    """Serve the OpenAPI schema from the schema cache, with an ETag so
+    clients can revalidate without downloading it again."""
+
+    def _get_schema_response(self, request):
+        lang = get_lang(request)
+        renderer = request.accepted_renderer
+        etag = get_schema_etag(lang, renderer.format)
+
+        response = get_conditional_response(request, etag=etag)
+        if response is None:
+            media_type = request.accepted_media_type
+            response = HttpResponse(
+                get_rendered_schema(renderer, media_type, lang),
+                content_type=media_type
+            )
+
+        response['ETag'] = etag
+        patch_cache_control(response, no_cache=True)
+        return response
+
+
+class CachedSpectacularSwaggerView(SpectacularSwaggerView):
+    """Swagger UI loading the schema versioned by its ETag, so browsers
+    hit the cached schema instead of regenerating it."""
+
+    @extend_schema(exclude=True)
+    def get(self, request, *args, **kwargs):
+        response = super().get(request, *args, **kwargs)
+        lang = get_lang(request)
+        response.data['schema_url'] = set_query_parameters(
+            url=response.data['schema_url'],
+            v=get_schema_etag(lang).strip('"')
+        )
+
+        return response
+
+
+def serve_media(request, path, document_root=None):
+    """Serve media files in development. Content addressed recipe images
+    never change, so they are cached forever."""
+    response = serve(request, path, document_root=document_root)
+    if path.startswith('uploads/recipe/'):
+        response['Cache-Control'] = getattr(
+            settings,
+            'RECIPE_IMAGE_CACHE_CONTROL',
+            'public, max-age=31536000, immutable'
+        )
+
+    return response
+
+
+class BatchView(APIView):
+    """Run several API operations in one request, in order."""
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def _get_data(self, request):
+        """Return the batch from a JSON body, or from the form fields of
+        a multipart body carrying files."""
+        data = request.data
+        if not hasattr(data, 'getlist'):
+            return data
+
+        try:
+            operations = json.loads(data.get('operations', ''))
+        except ValueError:
+            raise ValidationError({'operations': 'Invalid JSON.'})
+
+        return {'atomic': data.get('atomic', False), 'operations': operations}
+
+    def _attach_files(self, request, operations):
+        """Replace the file part names of operations with the files."""
+        for operation in operations:
+            files = operation.get('files')
+            if not files:
+                continue
+
+            missing = set(files.values()) - set(request.FILES)
+            if missing:
+                raise ValidationError(
+                    {'files': f'Missing file parts: {", ".join(missing)}.'}
+                )
+            operation['files'] = {
+                field: request.FILES[part] for field, part in files.items()
+            }
+
+    @extend_schema(
+        request=BatchRequestSerializer,
+        responses=BatchResponseSerializer
+    )
+    def post(self, request):
+        """Run the operations and return their statuses and bodies."""
+        serializer = BatchRequestSerializer(data=self._get_data(request))
+        serializer.is_valid(raise_exception=True)
+        operations = serializer.validated_data['operations']
+        self._attach_files(request, operations)
+
+        results, committed = run_batch(
+            request, operations, serializer.validated_data['atomic']
+        )
+
+        return Response({'committed': committed, 'results': results})
@@ -0,0 +1,305 @@
+"""
+Benchmarks for the recipe APIs.
+"""
+import random
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Count, F, Q
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core.benchmarking import register, rollback, timeit
+from core.models import Recipe, Tag, Ingredient
+from core.partitioning import get_partition_sql
+from core.renderers import JSONRenderer
+from recipe import serializers
+from recipe.views import RecipeViewSet
+from recipe.similarity import (
+    JACCARD,
+    WEIGHTED,
+    RecipeIndex,
+    ingredient_feature,
+    tag_feature,
+)
+
+
+def sample_index(count=50000, tags=200, ingredients=2000):
+    """Return an index of count recipes with random tags and ingredients."""
+    rng = random.Random(0)
+    index = RecipeIndex()
+    for recipe_id in range(1, count + 1):
+        features = {
+            tag_feature(rng.randrange(tags)) for _ in range(3)
+        } | {
+            ingredient_feature(rng.randrange(ingredients)) for _ in range(8)
+        }
+        index.set_recipe(recipe_id, features)
+
+    return index
+
+
+@register('similar')
+def bench_similar(number):
+    """Measure similar recipe queries over a 50k recipe index, which
+    should stay in the low milliseconds."""
+    index = sample_index()
+    index.similar(1)
+
+    return [
+        ('similar jaccard', timeit(lambda: index.similar(1, JACCARD), number)),
+        (
+            'similar weighted',
+            timeit(lambda: index.similar(1, WEIGHTED), number)
+        ),
+    ]
+
+
+def cookable_sql(user, ingredient_ids, max_missing, limit=50):
+    """Match recipes against ingredients with GROUP BY/HAVING, the query
+    the in memory index replaces."""
+    return list(Recipe.objects.filter(user=user).annotate(
+        total=Count('ingredients'),
+        covered=Count('ingredients', filter=Q(ingredients__in=ingredient_ids)),
+    ).filter(
+        total__gt=0, total__lte=F('covered') + max_missing
+    ).order_by(
+        F('total') - F('covered'), '-id'
+    ).values_list('id', flat=True)[:limit])
+
+
+@register('cookable')
+def bench_cookable(number, count=5000, ingredients=300):
+    """Compare ingredient matching through the index against SQL."""
+    rng = random.Random(0)
+    with rollback():
+        user = get_user_model().objects.create_user(
+            email='benchmark@example.com', password='benchmark'
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(user=user, name=f'Ingredient {i}')
+            for i in range(ingredients)
+        )
+        Recipe.objects.bulk_create(
+            Recipe(
+                user=user,
+                title=f'Recipe {i}',
+                time_minutes=30,
+                price=Decimal('5.00')
+            )
+            for i in range(count)
+        )
+        # Not every database returns the ids of bulk created rows
+        ingredient_ids = list(Ingredient.objects.filter(
+            user=user
+        ).values_list('id', flat=True))
+        recipe_ids = Recipe.objects.filter(user=user).values_list(
+            'id', flat=True
+        )
+        through = Recipe.ingredients.through
+        through.objects.bulk_create(
+            through(
+                recipe_id=recipe_id,
+                ingredient_id=ingredient_id,
+                user_id=user.pk
+            )
+            for recipe_id in recipe_ids
+            for ingredient_id in rng.sample(ingredient_ids, 6)
+        )
+
+        have = rng.sample(ingredient_ids, 60)
+        index = RecipeIndex()
+        index.update(user.pk, 0)
+
+        number = max(number // 10, 1)
+        return [
+            (
+                'cookable index',
+                timeit(lambda: index.cookable(have, 2), number)
+            ),
+            (
+                'cookable sql',
+                timeit(lambda: cookable_sql(user, have, 2), number)
+            ),
+        ]
+
+
+@register('sideload')
+def bench_sideload(number, count=500):
+    """Compare rendering a recipe page with nested tags and ingredients
+    against the side-loaded format."""
+    rng = random.Random(0)
+    with rollback():
+        user = get_user_model().objects.create_user(
+            email='benchmark@example.com', password='benchmark'
+        )
+        Tag.objects.bulk_create(
+            Tag(user=user, name=f'Tag {i}') for i in range(20)
+        )
+        Ingredient.objects.bulk_create(
+            Ingredient(user=user, name=f'Ingredient {i}') for i in range(50)
+        )
+        Recipe.objects.bulk_create(
+            Recipe(
+                user=user,
+                title=f'Recipe {i}',
+                time_minutes=30,
+                price=Decimal('5.00')
+            )
+            for i in range(count)
+        )
+        # Not every database returns the ids of bulk created rows
+        tag_ids = list(Tag.objects.filter(user=user).values_list(
+            'id', flat=True
+        ))
+        ingredient_ids = list(Ingredient.objects.filter(
+            user=user
+        ).values_list('id', flat=True))
+        recipe_ids = list(Recipe.objects.filter(user=user).values_list(
+            'id', flat=True
+        ))
+        for field, ids, per_recipe in [
+            ('tags', tag_ids, 4), ('ingredients', ingredient_ids, 8)
+        ]:
+            through = getattr(Recipe, field).through
+            column = f'{field[:-1]}_id'
+            through.objects.bulk_create(
+                through(
+                    recipe_id=recipe_id,
+                    user_id=user.pk,
+                    **{column: related_id}
+                )
+                for recipe_id in recipe_ids
+                for related_id in rng.sample(ids, per_recipe)
+            )
+
+        recipes = list(Recipe.objects.filter(user=user).prefetch_related(
+            'tags', 'ingredients'
+        ))
+        renderer = JSONRenderer()
+
+        def nested():
+            return renderer.render(
+                serializers.RecipeSerializer(recipes, many=True).data
+            )
+
+        def sideloaded():
+            serializer = serializers.RecipeSideloadSerializer(
+                recipes, many=True
+            )
+            return renderer.render({
+                'recipes': serializer.data,
+                'included': serializers.get_included(
+                    recipes, serializer.child.fields
+                ),
+            })
+
+        number = max(number // 100, 1)
+        return [
+            (
+                f'nested ({len(nested())} bytes)',
+                timeit(nested, number)
+            ),
+            (
+                f'sideloaded ({len(sideloaded())} bytes)',
+                timeit(sideloaded, number)
+            ),
+        ]
+
+
+def create_recipes(user, rng, count, tags=20, ingredients=50):
+    """Bulk create count recipes for user, with random prices, times, tags
+    and ingredients. Returns the tag ids."""
+    Tag.objects.bulk_create(
+        Tag(user=user, name=f'Tag {i}') for i in range(tags)
+    )
+    Ingredient.objects.bulk_create(
+        Ingredient(user=user, name=f'Ingredient {i}')
+        for i in range(ingredients)
+    )
+    Recipe.objects.bulk_create(
+        Recipe(
+            user=user,
+            title=f'Recipe {i}',
+            time_minutes=rng.randrange(5, 120),
+            price=Decimal(rng.randrange(100, 1000)) / 100
+        )
+        for i in range(count)
+    )
+    # Not every database returns the ids of bulk created rows
+    tag_ids = list(Tag.objects.filter(user=user).values_list('id', flat=True))
+    ingredient_ids = list(Ingredient.objects.filter(
+        user=user
+    ).values_list('id', flat=True))
+    recipe_ids = list(Recipe.objects.filter(user=user).values_list(
+        'id', flat=True
+    ))
+    for field, ids, per_recipe in [
+        ('tags', tag_ids, 3), ('ingredients', ingredient_ids, 6)
+    ]:
+        through = getattr(Recipe, field).through
+        column = f'{field[:-1]}_id'
+        through.objects.bulk_create(
+            through(
+                recipe_id=recipe_id, user_id=user.pk, **{column: related_id}
+            )
+            for recipe_id in recipe_ids
+            for related_id in rng.sample(ids, per_recipe)
+        )
+
+    return tag_ids
+
+
+def list_recipes(user, params):
+    """Return the first page of recipes RecipeViewSet lists for params,
+    with their tags and ingredients."""
+    request = Request(APIRequestFactory().get('/', params))
+    request.user = user
+    view = RecipeViewSet(request=request, action='list', kwargs={})
+
+    return list(view.get_queryset()[:50])
+
+
+@register('partitions')
+def bench_partitions(number, users=20, count=2000, partitions=16):
+    """Time the recipe list and filter queries before and after hash
+    partitioning the recipe tables by user. Partitioning needs PostgreSQL,
+    elsewhere only the unpartitioned times are reported."""
+    rng = random.Random(0)
+    with rollback():
+        for i in range(users):
+            user = get_user_model().objects.create_user(
+                email=f'benchmark{i}@example.com', password='benchmark'
+            )
+            tag_ids = create_recipes(user, rng, count)
+
+        tags = f'{tag_ids[0]},{tag_ids[1]}'
+        queries = [
+            ('list', {}),
+            ('filter tags', {'tags': tags}),
+            ('filter tags all', {'tags': tags, 'match': 'all'}),
+            (
+                'filter price',
+                {'price_min': '3', 'price_max': '6', 'ordering': 'price'}
+            ),
+        ]
+
+        def run(layout):
+            return [
+                (
+                    f'{name} {layout}',
+                    timeit(lambda: list_recipes(user, params), number)
+                )
+                for name, params in queries
+            ]
+
+        number = max(number // 10, 1)
+        results = run('unpartitioned')
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                for statement in get_partition_sql(connection, partitions):
+                    cursor.execute(statement)
+            results += run(f'{partitions} partitions')
+
+        return results
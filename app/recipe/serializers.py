@@ -23,7 +23,19 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class RecipeSerializer(serializers.ModelSerializer):
+class FieldSelectionMixin:
+    """Serializer mixin only rendering the fields passed in `fields`."""
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+
+class RecipeSerializer(FieldSelectionMixin, serializers.ModelSerializer):
     """Serializer for recipes"""
     tags = TagSerializer(many=True, required=False)
     ingredients = IngredientSerializer(many=True, required=False)
@@ -43,7 +55,9 @@ class RecipeSerializer(serializers.ModelSerializer):
                 user=self.context['request'].user,
                 **tag
             )
-            recipe.tags.add(tag_obj)
+            recipe.tags.add(
+                tag_obj, through_defaults={'user_id': recipe.user_id}
+            )
 
     def _get_or_create_ingredients(self, ingredients, recipe):
         """Get or create ingredients"""
@@ -53,7 +67,9 @@ class RecipeSerializer(serializers.ModelSerializer):
                 user=self.context['request'].user,
                 **ingredient
             )
-            recipe.ingredients.add(ingredient_obj)
+            recipe.ingredients.add(
+                ingredient_obj, through_defaults={'user_id': recipe.user_id}
+            )
 
     def create(self, validated_data):
         """Create a recipe"""
@@ -94,6 +110,46 @@ class RecipeDetailSerializer(RecipeSerializer):
         fields = RecipeSerializer.Meta.fields + ['description', 'image']
 
 
+class RelatedIdsField(serializers.Field):
+    """Read only field rendering a to-many relation as a list of ids, from
+    the prefetched objects when available"""
+
+    def __init__(self, **kwargs):
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, value):
+        return [obj.pk for obj in value.all()]
+
+
+class RecipeSideloadSerializer(RecipeSerializer):
+    """Serializer for recipes referencing their tags and ingredients by
+    id, which are rendered once in the response's `included` map"""
+    tags = RelatedIdsField()
+    ingredients = RelatedIdsField()
+
+
+def get_included(recipes, fields):
+    """Return the distinct tags and ingredients of recipes, serialized once
+    each and keyed by id, for the relations in fields."""
+    included = {}
+    related = [
+        ('tags', TagSerializer),
+        ('ingredients', IngredientSerializer),
+    ]
+    for name, serializer_class in related:
+        if name not in fields:
+            continue
+        objects = {}
+        for recipe in recipes:
+            for obj in getattr(recipe, name).all():
+                objects[obj.pk] = obj
+        data = serializer_class(objects.values(), many=True).data
+        included[name] = {str(item['id']): item for item in data}
+
+    return included
+
+
 class RecipeImageSerializer(serializers.ModelSerializer):
     """Serializer for uploading image to recipes"""
 
@@ -103,3 +159,59 @@ class RecipeImageSerializer(serializers.ModelSerializer):
         fields = ['id', 'image']
         read_only_fields = ['id']
         extra_kwargs = {'image': {'required': True}}
+
+
+class SyncDeletedSerializer(serializers.Serializer):
+    """Serializer for the ids deleted since a sync"""
+    recipes = serializers.ListField(child=serializers.IntegerField())
+    tags = serializers.ListField(child=serializers.IntegerField())
+    ingredients = serializers.ListField(child=serializers.IntegerField())
+
+
+class SyncSerializer(serializers.Serializer):
+    """Serializer documenting the delta sync response"""
+    token = serializers.CharField()
+    recipes = RecipeDetailSerializer(many=True)
+    tags = TagSerializer(many=True)
+    ingredients = IngredientSerializer(many=True)
+    deleted = SyncDeletedSerializer()
+
+
+class SimilarRecipeSerializer(serializers.Serializer):
+    """Serializer for a recipe with its similarity score"""
+    recipe = RecipeSerializer()
+    score = serializers.FloatField()
+
+
+class CookableRecipeSerializer(serializers.Serializer):
+    """Serializer for a recipe with the ingredients missing to cook it"""
+    recipe = RecipeSerializer()
+    missing = serializers.ListField(child=serializers.IntegerField())
+
+
+class TimeBucketSerializer(serializers.Serializer):
+    """Serializer for a cooking time histogram bucket"""
+    min = serializers.IntegerField()
+    max = serializers.IntegerField(allow_null=True)
+    count = serializers.IntegerField()
+
+
+class UsageSerializer(serializers.Serializer):
+    """Serializer for a tag or ingredient with its recipe count"""
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    recipe_count = serializers.IntegerField()
+
+
+class RecipeStatsSerializer(serializers.Serializer):
+    """Serializer for the recipe statistics of a user"""
+    total = serializers.IntegerField()
+    average_price = serializers.DecimalField(
+        max_digits=5, decimal_places=2, allow_null=True
+    )
+    median_price = serializers.DecimalField(
+        max_digits=5, decimal_places=2, allow_null=True
+    )
+    time_histogram = TimeBucketSerializer(many=True)
+    top_tags = UsageSerializer(many=True)
+    top_ingredients = UsageSerializer(many=True)
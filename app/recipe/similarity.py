@@ -0,0 +1,320 @@
+"""
+Similar recipes and ingredient matching over an in memory index.
+
+Each process keeps a per user inverted index mapping every tag and
+ingredient to the sorted ids of the recipes using it. It's built the first
+time a user asks for similar recipes and then kept up to date from the
+delta sync data: recipes whose change_seq moved past the index's, and the
+tombstones of deleted recipes, tags and ingredients. A query only reads
+the postings of the recipe's own tags and ingredients, and scoring is
+vectorized with NumPy when it's installed.
+
+The same index answers "what can I cook": the postings of the ingredients
+a user has count, per recipe, how many of its ingredients they cover.
+"""
+import math
+import threading
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict
+
+from django.conf import settings
+
+from core.models import Recipe, Tombstone
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+JACCARD = 'jaccard'
+WEIGHTED = 'weighted'
+METRICS = [JACCARD, WEIGHTED]
+
+
+def tag_feature(tag_id):
+    """Return the index feature of a tag."""
+    return 2 * tag_id
+
+
+def ingredient_feature(ingredient_id):
+    """Return the index feature of an ingredient."""
+    return 2 * ingredient_id + 1
+
+
+class RecipeIndex:
+    """Inverted index of one user's recipes over their tags and
+    ingredients."""
+
+    def __init__(self):
+        # Change sequence the index is up to date with, -1 until built
+        self.seq = -1
+        self.features = {}
+        self.postings = {}
+        self.lock = threading.Lock()
+        self._sizes = None
+
+    def set_recipe(self, recipe_id, features):
+        """Index a recipe with its features, replacing previous ones."""
+        self.remove_recipe(recipe_id)
+        self.features[recipe_id] = frozenset(features)
+        for feature in self.features[recipe_id]:
+            insort(self.postings.setdefault(feature, array('q')), recipe_id)
+
+    def remove_recipe(self, recipe_id):
+        """Remove a recipe from the index."""
+        for feature in self.features.pop(recipe_id, ()):
+            posting = self.postings[feature]
+            index = bisect_left(posting, recipe_id)
+            if index < len(posting) and posting[index] == recipe_id:
+                del posting[index]
+            if not posting:
+                del self.postings[feature]
+        self._sizes = None
+
+    def remove_feature(self, feature):
+        """Remove a deleted tag or ingredient from all recipes."""
+        for recipe_id in self.postings.pop(feature, ()):
+            self.features[recipe_id] = self.features[recipe_id] - {feature}
+        self._sizes = None
+
+    def update(self, user_id, seq):
+        """Apply the user's changes up to change sequence seq."""
+        if seq <= self.seq:
+            return
+
+        recipes = Recipe.objects.filter(user_id=user_id)
+        if self.seq >= 0:
+            recipes = recipes.filter(change_seq__gt=self.seq)
+
+        changed = {recipe_id: set() for recipe_id in recipes.values_list(
+            'id', flat=True
+        )}
+        relations = [
+            (Recipe.tags.through, 'tag_id', tag_feature),
+            (Recipe.ingredients.through, 'ingredient_id', ingredient_feature),
+        ]
+        for through, column, to_feature in relations:
+            rows = through.objects.filter(
+                user_id=user_id, recipe__in=recipes
+            ).values_list('recipe_id', column)
+            for recipe_id, related_id in rows:
+                changed[recipe_id].add(to_feature(related_id))
+
+        for recipe_id, features in changed.items():
+            self.set_recipe(recipe_id, features)
+
+        if self.seq >= 0:
+            self._apply_tombstones(user_id)
+
+        self.seq = seq
+
+    def _apply_tombstones(self, user_id):
+        """Remove what was deleted since the index was last updated."""
+        tombstones = Tombstone.objects.filter(
+            user_id=user_id, change_seq__gt=self.seq
+        ).values_list('kind', 'object_id')
+        for kind, object_id in tombstones:
+            if kind == Tombstone.RECIPE:
+                self.remove_recipe(object_id)
+            elif kind == Tombstone.TAG:
+                self.remove_feature(tag_feature(object_id))
+            else:
+                self.remove_feature(ingredient_feature(object_id))
+
+    def get_weight(self, feature):
+        """Return the inverse document frequency of a feature, so shared
+        rare tags and ingredients count more than common ones."""
+        count = len(self.postings.get(feature, ()))
+        return math.log((1 + len(self.features)) / (1 + count)) + 1
+
+    def similar(self, recipe_id, metric=JACCARD, limit=10):
+        """Return the (recipe id, score) of the recipes most similar to
+        recipe_id, best first. Raises KeyError for unknown recipes."""
+        features = list(self.features[recipe_id])
+        if not features:
+            return []
+
+        if numpy is None:
+            scores = self._score_python(recipe_id, features, metric)
+        else:
+            scores = self._score_numpy(recipe_id, features, metric)
+
+        return scores[:limit]
+
+    def _score_python(self, recipe_id, features, metric):
+        """Score candidates with plain Python counters."""
+        shared = Counter()
+        for feature in features:
+            weight = 1 if metric == JACCARD else self.get_weight(feature)
+            for candidate in self.postings[feature]:
+                shared[candidate] += weight
+        del shared[recipe_id]
+
+        if metric == JACCARD:
+            scores = {
+                candidate: count / (
+                    len(features) + len(self.features[candidate]) - count
+                )
+                for candidate, count in shared.items()
+            }
+        else:
+            total = sum(self.get_weight(feature) for feature in features)
+            scores = {
+                candidate: weight / total
+                for candidate, weight in shared.items()
+            }
+
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def _get_sizes(self):
+        """Return sorted recipe ids, their number of features and their
+        number of ingredients as arrays, rebuilt after recipes change."""
+        if self._sizes is None:
+            count = len(self.features)
+            ids = numpy.fromiter(
+                sorted(self.features), dtype=numpy.int64, count=count
+            )
+            features = [self.features[recipe_id] for recipe_id in ids.tolist()]
+            sizes = numpy.fromiter(
+                (len(recipe) for recipe in features),
+                dtype=numpy.int64,
+                count=count
+            )
+            # Ingredient features are the odd ones
+            ingredient_sizes = numpy.fromiter(
+                (sum(feature & 1 for feature in recipe)
+                 for recipe in features),
+                dtype=numpy.int64,
+                count=count
+            )
+            self._sizes = ids, sizes, ingredient_sizes
+
+        return self._sizes
+
+    def _score_numpy(self, recipe_id, features, metric):
+        """Score candidates with vectorized NumPy operations."""
+        postings = [
+            numpy.frombuffer(self.postings[feature], dtype=numpy.int64)
+            for feature in features
+        ]
+        candidates, inverse = numpy.unique(
+            numpy.concatenate(postings), return_inverse=True
+        )
+
+        if metric == JACCARD:
+            shared = numpy.bincount(inverse, minlength=len(candidates))
+            ids, sizes, _ = self._get_sizes()
+            sizes = sizes[numpy.searchsorted(ids, candidates)]
+            scores = shared / (len(features) + sizes - shared)
+        else:
+            weights = numpy.array(
+                [self.get_weight(feature) for feature in features]
+            )
+            lengths = [len(posting) for posting in postings]
+            shared = numpy.bincount(
+                inverse,
+                weights=numpy.repeat(weights, lengths),
+                minlength=len(candidates)
+            )
+            scores = shared / weights.sum()
+
+        keep = candidates != recipe_id
+        candidates, scores = candidates[keep], scores[keep]
+        order = numpy.lexsort((candidates, -scores))
+
+        return list(zip(
+            candidates[order].tolist(), scores[order].tolist()
+        ))
+
+    def cookable(self, ingredient_ids, max_missing=0, limit=50):
+        """Return the (recipe id, missing ingredient ids) of the recipes
+        lacking at most max_missing of the given ingredients, fewest
+        missing first, then newest."""
+        have = {ingredient_feature(i) for i in ingredient_ids}
+        if numpy is None:
+            matches = self._cookable_python(have, max_missing)
+        else:
+            matches = self._cookable_numpy(have, max_missing)
+
+        return [
+            (recipe_id, sorted(
+                (feature - 1) // 2 for feature in self.features[recipe_id]
+                if feature & 1 and feature not in have
+            ))
+            for recipe_id in matches[:limit]
+        ]
+
+    def _cookable_python(self, have, max_missing):
+        """Match recipes with plain Python sets."""
+        matches = []
+        for recipe_id, features in self.features.items():
+            ingredients = [feature for feature in features if feature & 1]
+            missing = sum(feature not in have for feature in ingredients)
+            if ingredients and missing <= max_missing:
+                matches.append((missing, -recipe_id))
+
+        return [-recipe_id for _, recipe_id in sorted(matches)]
+
+    def _cookable_numpy(self, have, max_missing):
+        """Match recipes with vectorized NumPy operations."""
+        ids, _, ingredient_sizes = self._get_sizes()
+        postings = [
+            numpy.frombuffer(self.postings[feature], dtype=numpy.int64)
+            for feature in have if feature in self.postings
+        ]
+        if postings:
+            positions = numpy.searchsorted(ids, numpy.concatenate(postings))
+            covered = numpy.bincount(positions, minlength=len(ids))
+        else:
+            covered = numpy.zeros(len(ids), dtype=numpy.int64)
+
+        missing = ingredient_sizes - covered
+        keep = (ingredient_sizes > 0) & (missing <= max_missing)
+        ids, missing = ids[keep], missing[keep]
+
+        return ids[numpy.lexsort((-ids, missing))].tolist()
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def get_recipe_index(user):
+    """Return the user's index, creating it if needed. The least recently
+    used indexes are dropped past SIMILARITY_INDEX_MAX_USERS."""
+    max_users = getattr(settings, 'SIMILARITY_INDEX_MAX_USERS', 1000)
+    with _indexes_lock:
+        index = _indexes.get(user.pk)
+        if index is None:
+            index = _indexes[user.pk] = RecipeIndex()
+        _indexes.move_to_end(user.pk)
+        while len(_indexes) > max_users:
+            _indexes.popitem(last=False)
+
+    return index
+
+
+def find_similar_recipes(user, recipe_id, metric=JACCARD, limit=10):
+    """Return the (recipe id, score) of the user's recipes most similar to
+    recipe_id, after bringing the index up to date with their changes.
+    Raises KeyError when the user has no such recipe."""
+    index = get_recipe_index(user)
+    with index.lock:
+        index.update(user.pk, user.change_seq)
+        return index.similar(recipe_id, metric, limit)
+
+
+def find_cookable_recipes(user, ingredient_ids, max_missing=0, limit=50):
+    """Return the (recipe id, missing ingredient ids) of the user's recipes
+    needing at most max_missing ingredients besides ingredient_ids."""
+    index = get_recipe_index(user)
+    with index.lock:
+        index.update(user.pk, user.change_seq)
+        return index.cookable(ingredient_ids, max_missing, limit)
+
+
+def clear_recipe_indexes():
+    """Drop all the indexes of this process."""
+    with _indexes_lock:
+        _indexes.clear()
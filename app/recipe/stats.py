@@ -0,0 +1,129 @@
+"""
+Per user recipe statistics.
+
+Totals, average and median price and the cooking time histogram come from
+a single aggregate query over the user's recipes, with the histogram
+buckets counted in the database. Top tags and ingredients are read from
+their denormalized recipe_count, so the M2M tables aren't scanned.
+
+Results are cached under the user's change sequence, which moves forward
+on every write to their recipes, tags or ingredients, so a write
+invalidates them without any explicit cache deletion.
+"""
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.db.models import (
+    Aggregate,
+    Avg,
+    Count,
+    DecimalField,
+    FloatField,
+    Q,
+)
+
+from core.models import Recipe, Tag, Ingredient
+
+# Lower bounds of the cooking time buckets, in minutes
+TIME_BUCKETS = [0, 15, 30, 60, 120]
+TOP_COUNT = 5
+CENTS = Decimal('0.01')
+
+
+class Median(Aggregate):
+    """PostgreSQL median of an expression."""
+    function = 'PERCENTILE_CONT'
+    template = '%(function)s(0.5) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = FloatField()
+
+
+def _time_bucket_filters():
+    """Return the (min, max, filter) of each cooking time bucket."""
+    bounds = TIME_BUCKETS[1:] + [None]
+    buckets = []
+    for low, high in zip(TIME_BUCKETS, bounds):
+        condition = Q(time_minutes__gte=low)
+        if high is not None:
+            condition &= Q(time_minutes__lt=high)
+        buckets.append((low, high - 1 if high else None, condition))
+
+    return buckets
+
+
+def _median_price(recipes, total):
+    """Return the median price by reading the middle rows of the
+    (user, price) index, for databases without a median aggregate."""
+    if not total:
+        return None
+
+    prices = recipes.order_by('price').values_list('price', flat=True)
+    middle = list(prices[(total - 1) // 2:total // 2 + 1])
+    return sum(middle) / len(middle)
+
+
+def _to_cents(value):
+    """Round a price to cents, keeping None."""
+    if value is None:
+        return None
+
+    return Decimal(value).quantize(CENTS)
+
+
+def _top(model, user):
+    """Return the user's most used tags or ingredients."""
+    return list(
+        model.objects.filter(user=user, recipe_count__gt=0).order_by(
+            '-recipe_count', 'name'
+        ).values('id', 'name', 'recipe_count')[:TOP_COUNT]
+    )
+
+
+def compute_recipe_stats(user):
+    """Compute the recipe statistics of a user."""
+    recipes = Recipe.objects.filter(user=user)
+    buckets = _time_bucket_filters()
+
+    aggregates = {
+        'total': Count('id'),
+        'average_price': Avg(
+            'price', output_field=DecimalField(max_digits=5, decimal_places=2)
+        ),
+    }
+    for index, (_, _, condition) in enumerate(buckets):
+        aggregates[f'bucket_{index}'] = Count('id', filter=condition)
+
+    postgres = connections[recipes.db].vendor == 'postgresql'
+    if postgres:
+        aggregates['median_price'] = Median('price')
+
+    result = recipes.aggregate(**aggregates)
+    if not postgres:
+        result['median_price'] = _median_price(recipes, result['total'])
+
+    return {
+        'total': result['total'],
+        'average_price': _to_cents(result['average_price']),
+        'median_price': _to_cents(result['median_price']),
+        'time_histogram': [
+            {'min': low, 'max': high, 'count': result[f'bucket_{index}']}
+            for index, (low, high, _) in enumerate(buckets)
+        ],
+        'top_tags': _top(Tag, user),
+        'top_ingredients': _top(Ingredient, user),
+    }
+
+
+def get_recipe_stats(user):
+    """Return the recipe statistics of a user, from the cache when they
+    didn't change since they were computed."""
+    key = f'recipe_stats:{user.pk}:{user.change_seq}'
+    stats = cache.get(key)
+    if stats is None:
+        stats = compute_recipe_stats(user)
+        cache.set(
+            key, stats, getattr(settings, 'RECIPE_STATS_CACHE_TIMEOUT', 3600)
+        )
+
+    return stats
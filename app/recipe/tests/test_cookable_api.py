@@ -0,0 +1,100 @@
+"""Tests for the "what can I cook" API."""
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Ingredient
+from recipe.similarity import clear_recipe_indexes
+
+COOKABLE_URL = reverse('recipe:recipe-cookable')
+
+
+def create_user(email='user@example.com', password='testpass123'):
+    """Create and return a new user."""
+    return get_user_model().objects.create_user(email=email, password=password)
+
+
+def create_recipe(user, ingredients=(), **params):
+    """Create and return a sample recipe with ingredients."""
+    defaults = {
+        'title': 'sample recipe title',
+        'time_minutes': 22,
+        'price': Decimal('5.25'),
+    }
+    defaults.update(params)
+    recipe = Recipe.objects.create(user=user, **defaults)
+    recipe.ingredients.add(*ingredients)
+
+    return recipe
+
+
+class CookableApiTest(TestCase):
+    """Tests for matching recipes against the ingredients at hand."""
+
+    def setUp(self):
+        clear_recipe_indexes()
+        self.user = create_user()
+        # Token auth, so the user's change sequence is loaded per request
+        token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        self.rice, self.tofu, self.soy, self.egg = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ['Rice', 'Tofu', 'Soy sauce', 'Egg']
+        ]
+        self.fried_rice = create_recipe(
+            self.user, [self.rice, self.soy, self.egg]
+        )
+        self.tofu_rice = create_recipe(self.user, [self.rice, self.tofu])
+        self.plain_rice = create_recipe(self.user, [self.rice])
+        create_recipe(self.user)
+
+    def get_cookable(self, ingredients, **params):
+        """Return the (id, missing) pairs of the cookable recipes."""
+        params['ingredients'] = ','.join(str(i.id) for i in ingredients)
+        res = self.client.get(COOKABLE_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        return [(item['recipe']['id'], item['missing']) for item in res.data]
+
+    def test_cookable_with_all_ingredients(self):
+        """Test only recipes whose ingredients are all at hand match"""
+        self.assertEqual(
+            self.get_cookable([self.rice, self.tofu]),
+            [(self.plain_rice.id, []), (self.tofu_rice.id, [])]
+        )
+
+    def test_cookable_missing_at_most_k(self):
+        """Test recipes missing up to max_missing ingredients are ranked"""
+        self.assertEqual(
+            self.get_cookable([self.rice, self.soy], max_missing=1),
+            [
+                (self.plain_rice.id, []),
+                (self.tofu_rice.id, [self.tofu.id]),
+                (self.fried_rice.id, [self.egg.id]),
+            ]
+        )
+
+    def test_cookable_python_fallback(self):
+        """Test matches are the same without NumPy"""
+        expected = self.get_cookable([self.rice], max_missing=2)
+        clear_recipe_indexes()
+
+        with patch('recipe.similarity.numpy', None):
+            self.assertEqual(
+                self.get_cookable([self.rice], max_missing=2), expected
+            )
+
+    def test_cookable_requires_ingredients(self):
+        """Test the ingredients parameter is required"""
+        res = self.client.get(COOKABLE_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,24 +1,33 @@
 """Tests for recipe APIs."""
 from decimal import Decimal
 import tempfile
+from unittest import skipUnless
+from unittest.mock import patch
 import os
 
 from PIL import Image
 
 from django.contrib.auth import get_user_model
-from django.test import TestCase
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
 from rest_framework import status
 from rest_framework.test import APIClient
 
-from core.models import Recipe, Tag, Ingredient
+from core.models import Recipe, Tag, Ingredient, Job
+from core.renderers import cbor2, msgpack
 from recipe.serializers import (
     RecipeSerializer,
     RecipeDetailSerializer
 )
 
 RECIPES_URL = reverse('recipe:recipe-list')
+BATCH_URL = reverse('recipe:recipe-batch-retrieve')
 
 
 def detail_url(recipe_id):
@@ -31,6 +40,11 @@ def image_upload_url(recipe_id):
     return reverse('recipe:recipe-upload-image', args=[recipe_id])
 
 
+def image_url(recipe_id):
+    """Create and return a recipe image URL"""
+    return reverse('recipe:recipe-image', args=[recipe_id])
+
+
 def create_recipe(user, **params):
     """Create and return a sample recipe."""
     defaults = {
@@ -95,6 +109,8 @@ class PrivateRecipeApiTest(TestCase):
             password='testpass123'
         )
         self.client.force_authenticate(self.user)
+        # Reset the write throttles
+        cache.clear()
 
     def test_retrieve_recipes(self):
         """Test retrieving a list of recipes"""
@@ -241,6 +257,29 @@ class PrivateRecipeApiTest(TestCase):
         self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
         self.assertTrue(Recipe.objects.filter(id=recipe.id))
 
+    @patch.dict(
+        'core.throttles.ActionRateThrottle.THROTTLE_RATES',
+        {'recipe_create': '2/min'}
+    )
+    def test_create_recipe_throttled(self):
+        """Test creating recipes is throttled per user"""
+        payload = {
+            'title': 'Sample recipe',
+            'time_minutes': 30,
+            'price': Decimal('5.99')
+        }
+        for _ in range(2):
+            res = self.client.post(RECIPES_URL, payload)
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+
+        res = self.client.post(RECIPES_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+        # Reads aren't throttled
+        res = self.client.get(RECIPES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
     def test_create_recipe_with_new_tags(self):
         """Test creating a recipe with new tags"""
         payload = {
@@ -343,6 +382,21 @@ class PrivateRecipeApiTest(TestCase):
         self.assertIn(existing_tag, recipe_tags)
         self.assertNotIn(existing_tag_2, recipe_tags)
 
+    def test_update_recipe_tags_updates_counts(self):
+        """Test replacing recipe tags keeps tag recipe counts in sync"""
+        old_tag = create_tag(self.user, name="Old Tag")
+        recipe = create_recipe(self.user)
+        recipe.tags.add(old_tag)
+
+        payload = {'tags': [{'name': 'New Tag'}]}
+        res = self.client.patch(detail_url(recipe.id), payload, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        old_tag.refresh_from_db()
+        self.assertEqual(old_tag.recipe_count, 0)
+        new_tag = Tag.objects.get(user=self.user, name='New Tag')
+        self.assertEqual(new_tag.recipe_count, 1)
+
     def test_clear_recipe_tag(self):
         """Test clearing recipes tags"""
         existing_tag = create_tag(self.user)
@@ -549,6 +603,319 @@ class PrivateRecipeApiTest(TestCase):
         self.assertIn(serialized_recipe2.data, res.data)
         self.assertNotIn(serialized_recipe3.data, res.data)
 
+    def test_filter_match_all(self):
+        """Test match=all only returns recipes with every selected tag
+        and ingredient"""
+        vegan = create_tag(user=self.user, name="Vegan")
+        quick = create_tag(user=self.user, name="Quick")
+        rice = create_ingredient(user=self.user, name="Rice")
+        both = create_recipe(self.user)
+        both.tags.add(vegan, quick)
+        both.ingredients.add(rice)
+        without_rice = create_recipe(self.user)
+        without_rice.tags.add(vegan, quick)
+        only_vegan = create_recipe(self.user)
+        only_vegan.tags.add(vegan)
+        only_vegan.ingredients.add(rice)
+
+        params = {'tags': f"{vegan.id},{quick.id},{vegan.id}", 'match': 'all'}
+        res = self.client.get(RECIPES_URL, params)
+        self.assertEqual(
+            [item['id'] for item in res.data], [without_rice.id, both.id]
+        )
+
+        params['ingredients'] = str(rice.id)
+        res = self.client.get(RECIPES_URL, params)
+        self.assertEqual([item['id'] for item in res.data], [both.id])
+
+    def test_filter_match_all_query_count(self):
+        """Test match=all filters in the main query, whatever the number of
+        selected ids"""
+        tags = [create_tag(user=self.user, name=f"Tag {i}") for i in range(5)]
+        for _ in range(3):
+            create_recipe(self.user).tags.add(*tags)
+        params = {
+            'tags': ','.join(str(tag.id) for tag in tags),
+            'match': 'all',
+        }
+
+        # Recipes, then the tags and ingredients prefetches
+        with self.assertNumQueries(3):
+            res = self.client.get(RECIPES_URL, params)
+
+        self.assertEqual(len(res.data), 3)
+
+    def test_filter_match_all_plan_uses_indexes(self):
+        """Test the match=all subquery reads the link table through its
+        indexes instead of scanning it"""
+        tag = create_tag(user=self.user, name="Vegan")
+        create_recipe(self.user).tags.add(tag)
+        params = {'tags': str(tag.id), 'match': 'all'}
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(RECIPES_URL, params)
+        sql = queries.captured_queries[0]['sql']
+
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # Tables are tiny, so make scans the last resort
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+                plan = [row[0] for row in cursor.fetchall()]
+                scans = [line for line in plan if 'Seq Scan' in line]
+            else:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = [row[-1] for row in cursor.fetchall()]
+                scans = [line for line in plan if line.startswith('SCAN')]
+
+        self.assertTrue(any('core_recipe_tags' in line for line in plan))
+        self.assertEqual(scans, [])
+
+    def test_filter_invalid_match(self):
+        """Test an unknown match mode returns an error"""
+        res = self.client.get(RECIPES_URL, {'tags': '1', 'match': 'some'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_filters_ignored_on_detail(self):
+        """Test the list filters don't apply to single recipe requests"""
+        recipe = create_recipe(self.user)
+        url = f"{detail_url(recipe.id)}?match=some&tags=999&price_max=x"
+
+        res = self.client.get(url)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        res = self.client.patch(url, {'title': 'New'}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        res = self.client.delete(url)
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_recipe_with_two_matching_tags_listed_once(self):
+        """Test a recipe matching several filtered tags isn't repeated"""
+        recipe = create_recipe(self.user)
+        tag1 = create_tag(user=self.user, name="Vegan")
+        tag2 = create_tag(user=self.user, name="Quick")
+        recipe.tags.add(tag1, tag2)
+
+        res = self.client.get(RECIPES_URL, {'tags': f"{tag1.id},{tag2.id}"})
+
+        self.assertEqual([item['id'] for item in res.data], [recipe.id])
+
+    def test_filter_by_price_and_time(self):
+        """Test filtering recipes by price range and maximum time"""
+        cheap = create_recipe(self.user, price=Decimal('3.00'))
+        medium = create_recipe(self.user, price=Decimal('8.00'))
+        create_recipe(self.user, price=Decimal('20.00'))
+        create_recipe(self.user, price=Decimal('8.00'), time_minutes=90)
+
+        res = self.client.get(RECIPES_URL, {
+            'price_min': '5',
+            'price_max': '10.50',
+            'time_max': 30,
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['id'] for item in res.data], [medium.id])
+
+        res = self.client.get(RECIPES_URL, {'price_max': '3'})
+        self.assertEqual([item['id'] for item in res.data], [cheap.id])
+
+    def test_range_filters_compose_with_tags(self):
+        """Test range filters and tag filters apply together"""
+        tag = create_tag(user=self.user, name="Vegan")
+        cheap = create_recipe(self.user, price=Decimal('3.00'))
+        expensive = create_recipe(self.user, price=Decimal('30.00'))
+        create_recipe(self.user, price=Decimal('3.00'))
+        cheap.tags.add(tag)
+        expensive.tags.add(tag)
+
+        res = self.client.get(RECIPES_URL, {
+            'tags': str(tag.id),
+            'price_max': '10',
+        })
+
+        self.assertEqual([item['id'] for item in res.data], [cheap.id])
+
+    def test_invalid_range_filter(self):
+        """Test non numeric range filters return an error"""
+        res = self.client.get(RECIPES_URL, {'price_min': 'cheap'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('price_min', res.data)
+
+    def test_order_by_price_and_time(self):
+        """Test ordering recipes by price and time, ties broken by id"""
+        recipe1 = create_recipe(
+            self.user, price=Decimal('9.00'), time_minutes=10
+        )
+        recipe2 = create_recipe(
+            self.user, price=Decimal('4.00'), time_minutes=30
+        )
+        recipe3 = create_recipe(
+            self.user, price=Decimal('4.00'), time_minutes=20
+        )
+
+        expected = {
+            'price': [recipe2.id, recipe3.id, recipe1.id],
+            '-price': [recipe1.id, recipe3.id, recipe2.id],
+            'time_minutes': [recipe1.id, recipe3.id, recipe2.id],
+            '-time_minutes': [recipe2.id, recipe3.id, recipe1.id],
+            'unknown': [recipe3.id, recipe2.id, recipe1.id],
+        }
+        for ordering, ids in expected.items():
+            res = self.client.get(RECIPES_URL, {'ordering': ordering})
+            self.assertEqual([item['id'] for item in res.data], ids)
+
+    def test_list_sideloaded(self):
+        """Test the side-loaded format renders each tag and ingredient once"""
+        vegan = create_tag(user=self.user, name="Vegan")
+        quick = create_tag(user=self.user, name="Quick")
+        rice = create_ingredient(user=self.user, name="Rice")
+        recipe1 = create_recipe(self.user)
+        recipe1.tags.add(vegan, quick)
+        recipe1.ingredients.add(rice)
+        recipe2 = create_recipe(self.user)
+        recipe2.tags.add(vegan)
+
+        with self.assertNumQueries(3):
+            res = self.client.get(RECIPES_URL, {'sideload': 1})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        recipes = res.data['recipes']
+        self.assertEqual([item['id'] for item in recipes],
+                         [recipe2.id, recipe1.id])
+        self.assertEqual(recipes[0]['tags'], [vegan.id])
+        self.assertEqual(sorted(recipes[1]['tags']), [vegan.id, quick.id])
+        self.assertEqual(recipes[1]['ingredients'], [rice.id])
+        self.assertEqual(res.data['included'], {
+            'tags': {
+                str(vegan.id): {'id': vegan.id, 'name': 'Vegan'},
+                str(quick.id): {'id': quick.id, 'name': 'Quick'},
+            },
+            'ingredients': {
+                str(rice.id): {'id': rice.id, 'name': 'Rice'},
+            },
+        })
+
+    def test_list_sideloaded_selected_fields(self):
+        """Test side-loading only includes the selected relations"""
+        recipe = create_recipe(self.user)
+        recipe.tags.add(create_tag(user=self.user, name="Vegan"))
+
+        res = self.client.get(
+            RECIPES_URL, {'sideload': 1, 'fields': 'id,tags'}
+        )
+
+        self.assertEqual(set(res.data['recipes'][0]), {'id', 'tags'})
+        self.assertEqual(list(res.data['included']), ['tags'])
+
+    def test_list_selected_fields(self):
+        """Test ?fields= limits rendered fields and skips prefetches"""
+        recipe = create_recipe(self.user)
+        recipe.tags.add(create_tag(self.user))
+
+        with self.assertNumQueries(1):
+            res = self.client.get(RECIPES_URL, {'fields': 'id,title'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, [{'id': recipe.id, 'title': recipe.title}])
+
+    def test_list_omitted_fields(self):
+        """Test ?omit= leaves fields out of the response"""
+        create_recipe(self.user)
+
+        with self.assertNumQueries(2):
+            res = self.client.get(RECIPES_URL, {'omit': 'ingredients,link'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(res.data[0]),
+            {'id', 'title', 'time_minutes', 'price', 'tags'}
+        )
+
+    def test_list_prefetches_relations(self):
+        """Test the list doesn't query tags and ingredients per recipe"""
+        for _ in range(3):
+            recipe = create_recipe(self.user)
+            recipe.tags.add(create_tag(self.user))
+            recipe.ingredients.add(create_ingredient(self.user))
+
+        with self.assertNumQueries(3):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(len(res.data), 3)
+
+    def test_detail_selected_fields(self):
+        """Test ?fields= on the detail endpoint"""
+        recipe = create_recipe(self.user)
+
+        res = self.client.get(
+            detail_url(recipe.id), {'fields': 'id,description'}
+        )
+
+        self.assertEqual(res.data, {
+            'id': recipe.id,
+            'description': recipe.description
+        })
+
+    def test_batch_retrieve(self):
+        """Test retrieving several recipes by id, in the requested order"""
+        r1 = create_recipe(self.user, title='First')
+        r2 = create_recipe(self.user, title='Second')
+        r2.tags.add(create_tag(self.user))
+        r2.ingredients.add(create_ingredient(self.user))
+        ids = [r2.id, r1.id]
+
+        # Recipes, then the tags and ingredients prefetches
+        with self.assertNumQueries(3):
+            res = self.client.get(BATCH_URL, {'ids': f'{r2.id},{r1.id}'})
+
+        recipes = Recipe.objects.filter(id__in=ids).order_by('-id')
+        serializer = RecipeDetailSerializer(recipes, many=True)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data, serializer.data)
+
+    def test_batch_retrieve_skips_missing_and_other_users(self):
+        """Test ids of missing recipes and other users' recipes are
+        skipped"""
+        other_user = create_user(email='other@example.com', password='pass123')
+        recipe = create_recipe(self.user)
+        other = create_recipe(other_user)
+        ids = f'{other.id},{recipe.id},{recipe.id},{recipe.id + other.id}'
+
+        res = self.client.get(BATCH_URL, {'ids': ids})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['id'] for r in res.data], [recipe.id])
+
+    def test_batch_retrieve_selected_fields(self):
+        """Test ?fields= on the batch endpoint"""
+        recipe = create_recipe(self.user)
+
+        res = self.client.get(
+            BATCH_URL, {'ids': str(recipe.id), 'fields': 'id,title'}
+        )
+
+        self.assertEqual(res.data, [{'id': recipe.id, 'title': recipe.title}])
+
+    @override_settings(RECIPE_BATCH_MAX_SIZE=2)
+    def test_batch_retrieve_too_many_ids(self):
+        """Test requesting more than the maximum batch size fails"""
+        res = self.client.get(BATCH_URL, {'ids': '1,2,3'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_batch_retrieve_invalid_ids(self):
+        """Test missing or invalid ids are rejected"""
+        for params in [{}, {'ids': '1,a'}]:
+            res = self.client.get(BATCH_URL, params)
+
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class ImageUploadTests(TestCase):
     """Tests for the image upload API"""
@@ -586,6 +953,26 @@ class ImageUploadTests(TestCase):
         self.assertIn('image', res.data)
         self.assertTrue(os.path.exists(self.recipe.image.path))
 
+    def test_replaced_image_deleted_later(self):
+        """Test replacing an image queues the deletion of the old one"""
+        images = []
+        for color in ['black', 'white']:
+            with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+                Image.new('RGB', (10, 10), color).save(image_file, 'JPEG')
+                image_file.seek(0)
+                self.client.post(
+                    image_upload_url(self.recipe.id),
+                    {'image': image_file},
+                    format='multipart'
+                )
+            self.recipe.refresh_from_db()
+            images.append(self.recipe.image.name)
+
+        job = Job.objects.get()
+        self.assertEqual(job.task, 'core.tasks.delete_unused_image')
+        self.assertEqual(job.kwargs, {'name': images[0]})
+        self.assertGreater(job.run_at, timezone.now())
+
     def test_upload_image_bad_request(self):
         """Test uploading invalid image to a recipe"""
         url = image_upload_url(self.recipe.id)
@@ -595,3 +982,273 @@ class ImageUploadTests(TestCase):
         self.recipe.refresh_from_db()
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertFalse(self.recipe.image.name)
+
+
+class ImageServeTests(TestCase):
+    """Tests for the image serving API"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email="user@example.com", password="pass12345")
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user)
+        self.recipe.image.save('image.jpg', ContentFile(b'0123456789'))
+        self.etag = '"%s"' % os.path.splitext(
+            os.path.basename(self.recipe.image.name)
+        )[0]
+
+    def tearDown(self):
+        self.recipe.image.delete()
+
+    def test_serve_image(self):
+        """Test the owner gets the image with validators"""
+        res = self.client.get(image_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(res.streaming_content), b'0123456789')
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertEqual(res['ETag'], self.etag)
+        self.assertIn('Last-Modified', res)
+        self.assertEqual(res['Accept-Ranges'], 'bytes')
+
+    def test_serve_image_other_user(self):
+        """Test the image of another user's recipe isn't served"""
+        other_user = create_user(email="other@example.com", password="pass")
+        self.client.force_authenticate(other_user)
+
+        res = self.client.get(image_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_serve_missing_image(self):
+        """Test a recipe without an image returns 404"""
+        recipe = create_recipe(user=self.user)
+
+        res = self.client.get(image_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_serve_image_not_modified(self):
+        """Test conditional requests get a 304"""
+        res = self.client.get(
+            image_url(self.recipe.id), HTTP_IF_NONE_MATCH=self.etag
+        )
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        res = self.client.get(
+            image_url(self.recipe.id),
+            HTTP_IF_MODIFIED_SINCE=res['Last-Modified']
+        )
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_serve_image_range(self):
+        """Test range requests get partial content"""
+        res = self.client.get(
+            image_url(self.recipe.id), HTTP_RANGE='bytes=2-5'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(res.streaming_content), b'2345')
+        self.assertEqual(res['Content-Range'], 'bytes 2-5/10')
+        self.assertEqual(res['Content-Length'], '4')
+
+    def test_serve_image_unsatisfiable_range(self):
+        """Test ranges past the end of the image get a 416"""
+        res = self.client.get(
+            image_url(self.recipe.id), HTTP_RANGE='bytes=20-'
+        )
+
+        self.assertEqual(
+            res.status_code,
+            status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+        self.assertEqual(res['Content-Range'], 'bytes */10')
+
+    @override_settings(
+        MEDIA_SENDFILE='x-accel-redirect',
+        MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/'
+    )
+    def test_serve_image_accel_redirect(self):
+        """Test the image is handed off to the web server"""
+        res = self.client.get(image_url(self.recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.content, b'')
+        self.assertEqual(
+            res['X-Accel-Redirect'],
+            f'/protected-media/{self.recipe.image.name}'
+        )
+
+
+class BinaryFormatTests(TestCase):
+    """Tests for the MessagePack and CBOR content negotiation"""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user(email="user@example.com", password="pass12345")
+        self.client.force_authenticate(self.user)
+        self.recipe = create_recipe(user=self.user, price=Decimal('7.05'))
+        self.recipe.image.save('image.jpg', ContentFile(b'0123456789'))
+
+    def tearDown(self):
+        self.recipe.image.delete()
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_retrieve_recipe_msgpack(self):
+        """Test a recipe in MessagePack has the same data as in JSON"""
+        url = detail_url(self.recipe.id)
+        expected = self.client.get(url).json()
+
+        res = self.client.get(url, HTTP_ACCEPT='application/msgpack')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/msgpack')
+        data = msgpack.unpackb(res.content)
+        self.assertEqual(data, expected)
+        self.assertEqual(data['price'], '7.05')
+        self.assertTrue(data['image'].startswith('http://testserver/'))
+
+    @skipUnless(cbor2, 'cbor2 is not installed')
+    def test_retrieve_recipe_cbor(self):
+        """Test a recipe in CBOR has the same data as in JSON"""
+        url = detail_url(self.recipe.id)
+        expected = self.client.get(url).json()
+
+        res = self.client.get(url, {'format': 'cbor'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/cbor')
+        self.assertEqual(cbor2.loads(res.content), expected)
+
+    @skipUnless(cbor2, 'cbor2 is not installed')
+    def test_create_recipe_cbor(self):
+        """Test creating a recipe from a CBOR body with an exact price"""
+        payload = {
+            'title': 'Binary recipe',
+            'time_minutes': 10,
+            'price': Decimal('3.15'),
+            'tags': [{'name': 'Quick'}],
+        }
+        res = self.client.post(
+            RECIPES_URL, cbor2.dumps(payload),
+            content_type='application/cbor',
+            HTTP_ACCEPT='application/cbor'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        recipe = Recipe.objects.get(id=cbor2.loads(res.content)['id'])
+        self.assertEqual(recipe.price, Decimal('3.15'))
+        self.assertEqual(recipe.tags.get().name, 'Quick')
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_create_recipe_invalid_msgpack(self):
+        """Test an invalid MessagePack body returns an error"""
+        res = self.client.post(
+            RECIPES_URL, b'\x92\x01', content_type='application/msgpack'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class IdempotencyKeyTests(TestCase):
+    """Test retrying recipe writes with an Idempotency-Key."""
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user(email='user@example.com', password='pass123')
+        self.client.force_authenticate(self.user)
+        self.payload = {
+            'title': 'Curry',
+            'time_minutes': 30,
+            'price': '5.50',
+            'tags': [{'name': 'Dinner'}],
+        }
+
+    def post(self, url, payload, key='key-1', **kwargs):
+        """Post with an Idempotency-Key."""
+        kwargs.setdefault('format', 'json')
+        return self.client.post(
+            url, payload, HTTP_IDEMPOTENCY_KEY=key, **kwargs
+        )
+
+    def test_create_replayed(self):
+        """Test a retried create returns the first response without
+        creating the recipe again"""
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.post(RECIPES_URL, self.payload)
+        retry = self.post(RECIPES_URL, self.payload)
+
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertNotIn('Idempotent-Replayed', first)
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(Tag.objects.filter(user=self.user).count(), 1)
+
+    def test_keys_per_user_and_key(self):
+        """Test other keys and other users' requests with the same key
+        aren't replayed"""
+        other = create_user(email='other@example.com', password='pass123')
+
+        self.post(RECIPES_URL, self.payload)
+        self.post(RECIPES_URL, self.payload, key='key-2')
+        self.client.force_authenticate(other)
+        res = self.post(RECIPES_URL, self.payload)
+
+        self.assertNotIn('Idempotent-Replayed', res)
+        self.assertEqual(Recipe.objects.filter(user=self.user).count(), 2)
+        self.assertEqual(Recipe.objects.filter(user=other).count(), 1)
+
+    def test_key_reused_for_other_request(self):
+        """Test reusing a key with another payload is rejected"""
+        self.post(RECIPES_URL, self.payload)
+
+        res = self.post(RECIPES_URL, {**self.payload, 'title': 'Soup'})
+
+        self.assertEqual(
+            res.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+        self.assertEqual(Recipe.objects.count(), 1)
+
+    def test_invalid_request_not_stored(self):
+        """Test a request failing validation releases its key"""
+        res = self.post(RECIPES_URL, {'title': 'Curry'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        res = self.post(RECIPES_URL, self.payload)
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertNotIn('Idempotent-Replayed', res)
+
+    def test_invalid_key(self):
+        """Test keys longer than 255 characters are rejected"""
+        res = self.post(RECIPES_URL, self.payload, key='k' * 256)
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_upload_image_replayed(self):
+        """Test a retried image upload returns the first response"""
+        recipe = create_recipe(user=self.user)
+        url = image_upload_url(recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as image_file:
+            Image.new('RGB', (10, 10)).save(image_file, format='JPEG')
+            image_file.seek(0)
+            with self.captureOnCommitCallbacks(execute=True):
+                first = self.post(
+                    url, {'image': image_file}, format='multipart'
+                )
+            image_file.seek(0)
+            serializer = 'recipe.serializers.RecipeImageSerializer'
+            with patch(f'{serializer}.save') as save:
+                retry = self.post(
+                    url, {'image': image_file}, format='multipart'
+                )
+
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        save.assert_not_called()
+        recipe.refresh_from_db()
+        recipe.image.delete()
@@ -0,0 +1,160 @@
+"""Tests for the similar recipes API."""
+from decimal import Decimal
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, Ingredient
+from recipe.similarity import RecipeIndex, clear_recipe_indexes
+
+
+def similar_url(recipe_id):
+    """Create and return a similar recipes URL"""
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+def create_user(email='user@example.com', password='testpass123'):
+    """Create and return a new user."""
+    return get_user_model().objects.create_user(email=email, password=password)
+
+
+def create_recipe(user, tags=(), ingredients=(), **params):
+    """Create and return a sample recipe with tags and ingredients."""
+    defaults = {
+        'title': 'sample recipe title',
+        'time_minutes': 22,
+        'price': Decimal('5.25'),
+    }
+    defaults.update(params)
+    recipe = Recipe.objects.create(user=user, **defaults)
+    recipe.tags.add(*tags)
+    recipe.ingredients.add(*ingredients)
+
+    return recipe
+
+
+class SimilarRecipesApiTest(TestCase):
+    """Tests for the similar recipes API."""
+
+    def setUp(self):
+        clear_recipe_indexes()
+        self.user = create_user()
+        # Token auth, so the user's change sequence is loaded per request
+        token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+        self.vegan = Tag.objects.create(user=self.user, name='Vegan')
+        self.quick = Tag.objects.create(user=self.user, name='Quick')
+        self.rice = Ingredient.objects.create(user=self.user, name='Rice')
+        self.tofu = Ingredient.objects.create(user=self.user, name='Tofu')
+
+    def get_similar(self, recipe, **params):
+        """Return the (id, score) pairs of the similar recipes."""
+        res = self.client.get(similar_url(recipe.id), params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        return [
+            (item['recipe']['id'], round(item['score'], 3))
+            for item in res.data
+        ]
+
+    def test_similar_jaccard(self):
+        """Test recipes are ranked by Jaccard similarity"""
+        recipe = create_recipe(
+            self.user, tags=[self.vegan, self.quick], ingredients=[self.tofu]
+        )
+        close = create_recipe(
+            self.user, tags=[self.vegan, self.quick], ingredients=[self.rice]
+        )
+        far = create_recipe(self.user, tags=[self.vegan])
+        create_recipe(self.user, ingredients=[self.rice])
+
+        self.assertEqual(
+            self.get_similar(recipe),
+            [(close.id, 0.5), (far.id, 0.333)]
+        )
+
+    def test_similar_weighted(self):
+        """Test shared rare features count more with the weighted metric"""
+        recipe = create_recipe(
+            self.user, tags=[self.vegan], ingredients=[self.tofu]
+        )
+        common = create_recipe(self.user, tags=[self.vegan])
+        rare = create_recipe(self.user, ingredients=[self.tofu])
+        create_recipe(self.user, tags=[self.vegan])
+
+        ids = [recipe_id for recipe_id, _ in self.get_similar(
+            recipe, metric='weighted'
+        )]
+
+        self.assertEqual(ids[0], rare.id)
+        self.assertIn(common.id, ids)
+
+    def test_similar_python_fallback(self):
+        """Test scores are the same without NumPy"""
+        recipe = create_recipe(
+            self.user, tags=[self.vegan, self.quick], ingredients=[self.tofu]
+        )
+        create_recipe(self.user, tags=[self.vegan, self.quick])
+        create_recipe(self.user, tags=[self.vegan], ingredients=[self.tofu])
+
+        for metric in ['jaccard', 'weighted']:
+            expected = self.get_similar(recipe, metric=metric)
+            clear_recipe_indexes()
+            with patch('recipe.similarity.numpy', None):
+                self.assertEqual(
+                    self.get_similar(recipe, metric=metric), expected
+                )
+
+    def test_index_updated_incrementally(self):
+        """Test the index follows changes after it's built"""
+        recipe = create_recipe(self.user, tags=[self.vegan])
+        other = create_recipe(self.user, tags=[self.quick])
+        self.assertEqual(self.get_similar(recipe), [])
+
+        other.tags.add(self.vegan)
+        self.assertEqual(self.get_similar(recipe), [(other.id, 0.5)])
+
+        self.quick.delete()
+        self.assertEqual(self.get_similar(recipe), [(other.id, 1.0)])
+
+        other.delete()
+        self.assertEqual(self.get_similar(recipe), [])
+
+    def test_similar_other_users_recipe(self):
+        """Test similar recipes of another user's recipe return 404"""
+        recipe = create_recipe(create_user('other@example.com'))
+
+        res = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_similar_invalid_metric(self):
+        """Test an unknown metric returns an error"""
+        recipe = create_recipe(self.user)
+
+        res = self.client.get(similar_url(recipe.id), {'metric': 'cosine'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RecipeIndexTests(TestCase):
+    """Tests for the in memory inverted index."""
+
+    def test_postings_stay_sorted(self):
+        """Test postings are sorted recipe ids as recipes change"""
+        index = RecipeIndex()
+        for recipe_id in [5, 1, 3]:
+            index.set_recipe(recipe_id, {10, 11})
+        index.set_recipe(3, {11})
+        index.remove_recipe(1)
+
+        self.assertEqual(list(index.postings[10]), [5])
+        self.assertEqual(list(index.postings[11]), [3, 5])
@@ -0,0 +1,121 @@
+"""Tests for the recipe statistics API."""
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, Ingredient
+
+STATS_URL = reverse('recipe:stats')
+
+
+def create_user(email='user@example.com', password='testpass123'):
+    """Create and return a new user."""
+    return get_user_model().objects.create_user(email=email, password=password)
+
+
+def create_recipe(user, **params):
+    """Create and return a sample recipe."""
+    defaults = {
+        'title': 'sample recipe title',
+        'time_minutes': 22,
+        'price': Decimal('5.25'),
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PublicStatsApiTest(TestCase):
+    """Tests for unauthenticated statistics API requests."""
+
+    def test_auth_required(self):
+        """Test auth is required to call API"""
+        res = APIClient().get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateStatsApiTest(TestCase):
+    """Tests for authenticated statistics API requests."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user()
+        # Token auth, so the user's change sequence is loaded per request
+        token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def test_empty_stats(self):
+        """Test statistics of a user without recipes"""
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['total'], 0)
+        self.assertIsNone(res.data['average_price'])
+        self.assertIsNone(res.data['median_price'])
+        self.assertEqual(
+            [bucket['count'] for bucket in res.data['time_histogram']],
+            [0, 0, 0, 0, 0]
+        )
+        self.assertEqual(res.data['top_tags'], [])
+
+    def test_stats(self):
+        """Test totals, prices, histogram and top tags and ingredients"""
+        vegan = Tag.objects.create(user=self.user, name='Vegan')
+        quick = Tag.objects.create(user=self.user, name='Quick')
+        salt = Ingredient.objects.create(user=self.user, name='Salt')
+        for price, minutes in [('2.00', 10), ('4.00', 20), ('9.00', 45),
+                               ('13.00', 150)]:
+            recipe = create_recipe(
+                self.user, price=Decimal(price), time_minutes=minutes
+            )
+            recipe.tags.add(vegan)
+            recipe.ingredients.add(salt)
+        recipe.tags.add(quick)
+        create_recipe(create_user('other@example.com'), price=Decimal('99'))
+
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['total'], 4)
+        self.assertEqual(res.data['average_price'], '7.00')
+        self.assertEqual(res.data['median_price'], '6.50')
+        self.assertEqual(res.data['time_histogram'], [
+            {'min': 0, 'max': 14, 'count': 1},
+            {'min': 15, 'max': 29, 'count': 1},
+            {'min': 30, 'max': 59, 'count': 1},
+            {'min': 60, 'max': 119, 'count': 0},
+            {'min': 120, 'max': None, 'count': 1},
+        ])
+        self.assertEqual(
+            [(tag['name'], tag['recipe_count'])
+             for tag in res.data['top_tags']],
+            [('Vegan', 4), ('Quick', 1)]
+        )
+        self.assertEqual(
+            [ingredient['name'] for ingredient in res.data['top_ingredients']],
+            ['Salt']
+        )
+
+    def test_stats_cached_until_write(self):
+        """Test statistics are cached and recomputed after a write"""
+        create_recipe(self.user)
+        self.client.get(STATS_URL)
+
+        # Only the token lookup when cached
+        with self.assertNumQueries(1):
+            res = self.client.get(STATS_URL)
+        self.assertEqual(res.data['total'], 1)
+
+        create_recipe(self.user)
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['total'], 2)
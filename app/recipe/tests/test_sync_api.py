@@ -0,0 +1,167 @@
+"""Tests for the delta sync API."""
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db.models import F
+from django.test import TestCase
+from django.urls import reverse
+
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core.models import Recipe, Tag, Ingredient, Tombstone
+
+SYNC_URL = reverse('recipe:sync')
+
+
+def create_user(email='user@example.com', password='testpass123'):
+    """Create and return a new user."""
+    return get_user_model().objects.create_user(email=email, password=password)
+
+
+def create_recipe(user, **params):
+    """Create and return a sample recipe."""
+    defaults = {
+        'title': 'sample recipe title',
+        'time_minutes': 22,
+        'price': Decimal('5.25'),
+    }
+    defaults.update(params)
+
+    return Recipe.objects.create(user=user, **defaults)
+
+
+class PublicSyncApiTest(TestCase):
+    """Tests for unauthenticated sync API requests."""
+
+    def test_auth_required(self):
+        """Test auth is required to call API"""
+        res = APIClient().get(SYNC_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateSyncApiTest(TestCase):
+    """Tests for authenticated sync API requests."""
+
+    def setUp(self):
+        self.user = create_user()
+        # Token auth, so the user's sync watermark is loaded per request
+        token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def sync(self, since=None):
+        """Sync and return the response data."""
+        params = {'since': since} if since is not None else {}
+        res = self.client.get(SYNC_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+
+        return res.data
+
+    def test_full_sync(self):
+        """Test a sync without a token returns everything"""
+        recipe = create_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        Ingredient.objects.create(user=self.user, name='Salt')
+        recipe.tags.add(tag)
+        create_recipe(create_user(email='other@example.com'))
+
+        data = self.sync()
+
+        self.assertEqual([r['id'] for r in data['recipes']], [recipe.id])
+        self.assertEqual(data['recipes'][0]['tags'][0]['name'], 'Vegan')
+        self.assertEqual(len(data['tags']), 1)
+        self.assertEqual(len(data['ingredients']), 1)
+        self.assertGreater(int(data['token']), 0)
+
+    def test_sync_without_changes_skips_queries(self):
+        """Test a sync with no changes only costs the auth lookup"""
+        create_recipe(self.user)
+        token = self.sync()['token']
+
+        with self.assertNumQueries(1):
+            data = self.sync(token)
+
+        self.assertEqual(data['token'], token)
+        self.assertEqual(data['recipes'], [])
+
+    def test_sync_returns_changes_since_token(self):
+        """Test only rows changed after the token are returned"""
+        recipe1 = create_recipe(self.user, title='Unchanged')
+        recipe2 = create_recipe(self.user, title='Original')
+        token = self.sync()['token']
+
+        recipe2.title = 'Updated'
+        recipe2.save()
+        data = self.sync(token)
+
+        self.assertEqual([r['id'] for r in data['recipes']], [recipe2.id])
+        self.assertNotIn(recipe1.id, [r['id'] for r in data['recipes']])
+        self.assertGreater(int(data['token']), int(token))
+
+    def test_sync_returns_membership_changes(self):
+        """Test recipes whose tags changed are returned"""
+        recipe = create_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        token = self.sync()['token']
+
+        recipe.tags.add(tag)
+        data = self.sync(token)
+
+        self.assertEqual([r['id'] for r in data['recipes']], [recipe.id])
+        self.assertEqual(data['tags'], [])
+
+        token = data['token']
+        tag.recipe_set.remove(recipe)
+        data = self.sync(token)
+        self.assertEqual(data['recipes'][0]['tags'], [])
+
+    def test_sync_returns_tombstones(self):
+        """Test deleted rows are returned as tombstones"""
+        recipe = create_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        token = self.sync()['token']
+
+        recipe_id, tag_id = recipe.id, tag.id
+        recipe.delete()
+        tag.delete()
+        data = self.sync(token)
+
+        self.assertEqual(data['deleted'], {
+            'recipes': [recipe_id],
+            'tags': [tag_id],
+            'ingredients': [],
+        })
+
+    def test_invalid_token(self):
+        """Test an invalid token returns an error"""
+        res = self.client.get(SYNC_URL, {'since': 'abc'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_token_before_pruned_tombstones_expired(self):
+        """Test tokens older than pruned tombstones need a full sync,
+        and newer tokens keep working"""
+        recipe = create_recipe(self.user)
+        create_recipe(self.user)
+        old_token = self.sync()['token']
+        recipe.delete()
+        token = self.sync(old_token)['token']
+        Tombstone.objects.update(deleted_at=F('deleted_at') - timedelta(
+            days=2
+        ))
+
+        out = StringIO()
+        call_command('prune_tombstones', retention=24 * 60 * 60, stdout=out)
+
+        self.assertIn('1 tombstones deleted', out.getvalue())
+        self.assertFalse(Tombstone.objects.exists())
+        res = self.client.get(SYNC_URL, {'since': old_token})
+        self.assertEqual(res.status_code, status.HTTP_410_GONE)
+        self.assertEqual(self.sync(token)['deleted']['recipes'], [])
+        self.assertEqual(len(self.sync()['recipes']), 1)
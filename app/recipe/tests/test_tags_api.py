@@ -168,3 +168,21 @@ class PrivateTagApiTest(TestCase):
         self.assertIn(serialized_tag1.data, res.data)
         self.assertNotIn(serialized_tag2.data, res.data)
         self.assertEqual(len(res.data), 1)
+
+    def test_order_tags_by_usage(self):
+        """Test ordering tags by the number of recipes using them"""
+        recipe1 = create_recipe(user=self.user, title="Apple Crumble")
+        recipe2 = create_recipe(user=self.user, title="Apple Pie")
+        tag1 = create_tag(self.user, name="Breakfast")
+        tag2 = create_tag(self.user, name="Sweet")
+        tag3 = create_tag(self.user, name="Unused")
+        recipe1.tags.add(tag1, tag2)
+        recipe2.tags.add(tag2)
+
+        res = self.client.get(TAGS_URL, {'ordering': '-usage'})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [tag['id'] for tag in res.data],
+            [tag2.id, tag1.id, tag3.id]
+        )
@@ -16,5 +16,7 @@ router.register('ingredients', views.IngredientViewSet)
 app_name = 'recipe'
 
 urlpatterns = [
+    path('sync/', views.SyncView.as_view(), name='sync'),
+    path('stats/', views.RecipeStatsView.as_view(), name='stats'),
     path('', include(router.urls))
 ]
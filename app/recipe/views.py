@@ -1,4 +1,12 @@
 """Views for the recipe APIs"""
+import os
+from datetime import timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import Count
+from django.http import Http404
+from django.utils import timezone
 from drf_spectacular.utils import (
     extend_schema_view,
     extend_schema,
@@ -9,10 +17,67 @@ from rest_framework import viewsets, mixins, status
 from rest_framework.authentication import TokenAuthentication
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
-from core.models import Recipe, Tag, Ingredient
+from core.idempotency import HEADER as IDEMPOTENCY_HEADER, idempotent
+from core.jobs import enqueue
+from core.media import serve_file
+from core.models import Recipe, Tag, Ingredient, Tombstone
+from core.sharding import UserShardMixin
+from core.sync import SyncTokenExpired
+from core.tasks import delete_unused_image
+from core.throttles import ActionRateThrottle
 from recipe import serializers
+from recipe.similarity import (
+    METRICS,
+    JACCARD,
+    find_cookable_recipes,
+    find_similar_recipes,
+)
+from recipe.stats import get_recipe_stats
+
+
+FIELD_SELECTION_PARAMETERS = [
+    OpenApiParameter(
+        'fields',
+        OpenApiTypes.STR,
+        description='Comma separated list of fields to return'
+    ),
+    OpenApiParameter(
+        'omit',
+        OpenApiTypes.STR,
+        description='Comma separated list of fields to leave out'
+    )
+]
+
+IDEMPOTENCY_PARAMETERS = [
+    OpenApiParameter(
+        IDEMPOTENCY_HEADER,
+        OpenApiTypes.STR,
+        location=OpenApiParameter.HEADER,
+        description=(
+            'Unique key of the request, sent again with its retries, which '
+            'get the response of the first request instead of running again'
+        )
+    )
+]
+
+# Values of ?match=, whether recipes need any or all of the selected tags
+# and ingredients
+MATCH_ANY = 'any'
+MATCH_ALL = 'all'
+
+# Values of ?ordering= on recipes. Ties are broken by id, so pages are
+# stable, and each ordering can walk the matching (user, column) index
+RECIPE_ORDERINGS = {
+    'price': ('price', 'id'),
+    '-price': ('-price', '-id'),
+    'time_minutes': ('time_minutes', 'id'),
+    '-time_minutes': ('-time_minutes', '-id'),
+}
 
 
 @extend_schema_view(
@@ -27,39 +92,216 @@ from recipe import serializers
                 'ingredients',
                 OpenApiTypes.STR,
                 description='Comma separated list of ingredient IDs to filter'
+            ),
+            OpenApiParameter(
+                'match',
+                OpenApiTypes.STR,
+                enum=[MATCH_ANY, MATCH_ALL],
+                description=(
+                    'Whether recipes need any (default) or all of the '
+                    'selected tags and ingredients'
+                )
+            ),
+            OpenApiParameter(
+                'sideload',
+                OpenApiTypes.INT,
+                enum=[0, 1],
+                description=(
+                    'Return {"recipes": [...], "included": {...}}, recipes '
+                    'referencing their tags and ingredients by id'
+                )
+            ),
+            OpenApiParameter(
+                'price_min',
+                OpenApiTypes.DECIMAL,
+                description='Only recipes costing at least this price'
+            ),
+            OpenApiParameter(
+                'price_max',
+                OpenApiTypes.DECIMAL,
+                description='Only recipes costing at most this price'
+            ),
+            OpenApiParameter(
+                'time_max',
+                OpenApiTypes.INT,
+                description='Only recipes taking at most these minutes'
+            ),
+            OpenApiParameter(
+                'ordering',
+                OpenApiTypes.STR,
+                enum=list(RECIPE_ORDERINGS),
+                description='Order by price or time, newest first by default'
             )
-        ]
+        ] + FIELD_SELECTION_PARAMETERS
+    ),
+    retrieve=extend_schema(parameters=FIELD_SELECTION_PARAMETERS),
+    create=extend_schema(parameters=IDEMPOTENCY_PARAMETERS),
+    upload_image=extend_schema(parameters=IDEMPOTENCY_PARAMETERS),
+    batch_retrieve=extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'ids',
+                OpenApiTypes.STR,
+                required=True,
+                description=(
+                    'Comma separated list of recipe IDs, at most '
+                    'RECIPE_BATCH_MAX_SIZE. Unknown IDs are skipped'
+                )
+            )
+        ] + FIELD_SELECTION_PARAMETERS
     )
 )
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(UserShardMixin, viewsets.ModelViewSet):
     """View for manage recipe APIs."""
     serializer_class = serializers.RecipeDetailSerializer
     queryset = Recipe.objects.all()
     authentication_classes = [TokenAuthentication]
     permission_classes = [IsAuthenticated]
+    throttle_classes = [ActionRateThrottle]
+    # Per user limits on writes, rates are set in DEFAULT_THROTTLE_RATES
+    throttle_scopes = {
+        'create': 'recipe_create',
+        'update': 'recipe_update',
+        'partial_update': 'recipe_update',
+        'upload_image': 'recipe_upload_image',
+    }
+
+    # Actions that support ?fields= and ?omit=
+    field_selection_actions = ['list', 'retrieve', 'batch_retrieve']
+    # Actions listing recipes, filtered by the tag, ingredient, price and
+    # time parameters
+    filter_actions = ['list', 'batch_retrieve']
+    # Relations prefetched when the matching field is rendered
+    prefetch_fields = ['tags', 'ingredients']
 
     def _params_to_ints(self, qs):
         """"Convert a list of stringts to integers"""
         return [int(str_id) for str_id in qs.split(",")]
 
-    # Override get_queryset method to only return recipes created by the user
-    # instead of returning all recipes which would be the default behavior
-    def get_queryset(self):
-        """Retrieve recipes for authenticated user."""
-        queryset = self.queryset
+    def _params_to_list(self, qs):
+        """Convert a comma separated string to a list of names"""
+        return [name.strip() for name in qs.split(",") if name.strip()]
+
+    def _get_param(self, name, convert):
+        """Return a query parameter converted by convert, or None."""
+        value = self.request.query_params.get(name)
+        if not value:
+            return None
+
+        try:
+            return convert(value)
+        except (ValueError, InvalidOperation):
+            raise ValidationError({name: 'Invalid number.'})
+
+    def _filter_related(self, queryset, through, column, ids, match):
+        """Filter recipes linked to any or all of the related ids.
+
+        Relations are filtered with semi-joins (id IN subquery) rather than
+        joins, so no DISTINCT is needed and the ordering can still be read
+        from the (user, column) indexes. For all, the subquery groups the
+        link rows of the selected ids by recipe and keeps the recipes
+        linked to each of them, so it reads as many rows as the selected
+        ids have links, whatever the number of recipes."""
+        ids = set(ids)
+        # Links store their user, which also limits partitioned link
+        # tables to the user's partition
+        links = through.objects.filter(
+            user=self.request.user, **{f'{column}__in': ids}
+        )
+        if match == MATCH_ALL:
+            links = links.values('recipe_id').annotate(
+                matched=Count(column)
+            ).filter(matched=len(ids))
+
+        return queryset.filter(id__in=links.values('recipe_id'))
+
+    def _filter_ranges(self, queryset):
+        """Apply the price and time range filters."""
+        price_min = self._get_param('price_min', Decimal)
+        if price_min is not None:
+            queryset = queryset.filter(price__gte=price_min)
+
+        price_max = self._get_param('price_max', Decimal)
+        if price_max is not None:
+            queryset = queryset.filter(price__lte=price_max)
+
+        time_max = self._get_param('time_max', int)
+        if time_max is not None:
+            queryset = queryset.filter(time_minutes__lte=time_max)
+
+        return queryset
+
+    def get_selected_fields(self):
+        """Return the serializer fields selected with ?fields= and ?omit=,
+        or None to render all of them."""
+        if self.action not in self.field_selection_actions:
+            return None
+
+        fields = self.request.query_params.get('fields')
+        omit = self.request.query_params.get('omit')
+        if not fields and not omit:
+            return None
+
+        selected = list(self.get_serializer_class().Meta.fields)
+        if fields:
+            requested = self._params_to_list(fields)
+            selected = [name for name in selected if name in requested]
+        if omit:
+            omitted = self._params_to_list(omit)
+            selected = [name for name in selected if name not in omitted]
+
+        return selected
+
+    def _narrow_queryset(self, queryset):
+        """Only load the columns and relations that will be rendered."""
+        if self.action not in self.field_selection_actions:
+            return queryset
+
+        selected = self.get_selected_fields()
+        if selected is None:
+            return queryset.prefetch_related(*self.prefetch_fields)
+
+        prefetch = [name for name in self.prefetch_fields if name in selected]
+        columns = [
+            name for name in selected if name not in self.prefetch_fields
+        ]
+
+        return queryset.only('id', *columns).prefetch_related(*prefetch)
+
+    def _filter_recipes(self, queryset):
+        """Apply the tag, ingredient, price and time filters."""
+        match = self.request.query_params.get('match') or MATCH_ANY
+        if match not in (MATCH_ANY, MATCH_ALL):
+            raise ValidationError({'match': 'Must be any or all.'})
+
         tags = self.request.query_params.get('tags')
         if tags:
-            tag_ids = self._params_to_ints(tags)
-            queryset = queryset.filter(tags__id__in=tag_ids)
+            queryset = self._filter_related(
+                queryset, Recipe.tags.through, 'tag_id',
+                self._params_to_ints(tags), match
+            )
 
         ingredients = self.request.query_params.get('ingredients')
         if ingredients:
-            ingredient_ids = self._params_to_ints(ingredients)
-            queryset = queryset.filter(ingredients__id__in=ingredient_ids)
+            queryset = self._filter_related(
+                queryset, Recipe.ingredients.through, 'ingredient_id',
+                self._params_to_ints(ingredients), match
+            )
+
+        return self._filter_ranges(queryset)
+
+    # Override get_queryset method to only return recipes created by the user
+    # instead of returning all recipes which would be the default behavior
+    def get_queryset(self):
+        """Retrieve recipes for authenticated user."""
+        queryset = self.queryset.filter(user=self.request.user)
+        if self.action in self.filter_actions:
+            queryset = self._filter_recipes(queryset)
+        ordering = RECIPE_ORDERINGS.get(
+            self.request.query_params.get('ordering'), ('-id',)
+        )
 
-        return queryset.filter(
-            user=self.request.user
-        ).order_by('-id').distinct()
+        return self._narrow_queryset(queryset.order_by(*ordering))
 
     # Most of the methods we perform in the viewset use the detail serializer.
     # By default, we've included multiple methods like creating, updating and
@@ -68,29 +310,218 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def get_serializer_class(self):
         """Return the serializer class for a request"""
         if self.action == 'list':
+            if self._sideload():
+                return serializers.RecipeSideloadSerializer
             return serializers.RecipeSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
 
         return self.serializer_class
 
+    def _sideload(self):
+        """Check the client asked for the side-loaded list format."""
+        return self.request.query_params.get('sideload') == '1'
+
+    def list(self, request, *args, **kwargs):
+        """List recipes, optionally in the side-loaded format"""
+        if not self._sideload():
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        recipes = list(queryset if page is None else page)
+        serializer = self.get_serializer(recipes, many=True)
+        data = {
+            'recipes': serializer.data,
+            'included': serializers.get_included(
+                recipes, serializer.child.fields
+            ),
+        }
+
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def get_serializer(self, *args, **kwargs):
+        """Return the serializer limited to the selected fields"""
+        selected = self.get_selected_fields()
+        if selected is not None:
+            kwargs['fields'] = selected
+
+        return super().get_serializer(*args, **kwargs)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        """Create a recipe, once per Idempotency-Key"""
+        return super().create(request, *args, **kwargs)
+
     # Override create Recipe to set self as creating user
     def perform_create(self, serializer):
         """Create a new recipe"""
         serializer.save(user=self.request.user)
 
     @action(methods=['POST'], detail=True, url_path='upload-image')
+    @idempotent
     def upload_image(self, request, pk=None):
         """Upload an image to recipe"""
         recipe = self.get_object()
+        previous = recipe.image.name
         serializer = self.get_serializer(recipe, data=request.data)
 
         if serializer.is_valid():
             serializer.save()
+            if previous and previous != recipe.image.name:
+                # Delete the replaced image once uploads in flight had
+                # time to reuse it
+                enqueue(
+                    delete_unused_image,
+                    run_at=timezone.now() + timedelta(
+                        seconds=getattr(settings, 'MEDIA_DELETE_DELAY', 300)
+                    ),
+                    name=previous
+                )
             return Response(serializer.data, status=status.HTTP_200_OK)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(methods=['GET'], detail=False, url_path='batch')
+    def batch_retrieve(self, request):
+        """Retrieve several recipes by id, in the requested order. Ids of
+        missing recipes or of other users' recipes are skipped."""
+        ids = self._get_param('ids', self._params_to_ints)
+        if not ids:
+            raise ValidationError({'ids': 'This field is required.'})
+
+        ids = list(dict.fromkeys(ids))
+        max_size = getattr(settings, 'RECIPE_BATCH_MAX_SIZE', 100)
+        if len(ids) > max_size:
+            raise ValidationError(
+                {'ids': f'At most {max_size} recipes can be requested.'}
+            )
+
+        recipes = self.get_queryset().filter(id__in=ids).in_bulk()
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in ids if pk in recipes], many=True
+        )
+
+        return Response(serializer.data)
+
+    @extend_schema(responses={(200, 'image/*'): OpenApiTypes.BINARY})
+    @action(methods=['GET'], detail=True, url_path='image')
+    def image(self, request, pk=None):
+        """Serve the image of a recipe"""
+        # A single primary key lookup doubles as the ownership check
+        name = get_object_or_404(
+            Recipe.objects.filter(user=request.user).values_list(
+                'image', flat=True
+            ),
+            pk=pk
+        )
+        if not name:
+            raise Http404('Recipe has no image.')
+
+        storage = Recipe._meta.get_field('image').storage
+        # Images are named after their content hash, a free strong ETag
+        content_hash = os.path.splitext(os.path.basename(name))[0]
+        return serve_file(request, storage, name, etag=content_hash)
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'metric',
+                OpenApiTypes.STR,
+                enum=METRICS,
+                description=(
+                    'Jaccard similarity (default) or overlap weighted by '
+                    'how rare each tag and ingredient is'
+                )
+            ),
+            OpenApiParameter(
+                'limit',
+                OpenApiTypes.INT,
+                description='Number of recipes to return, at most 50'
+            )
+        ],
+        responses=serializers.SimilarRecipeSerializer(many=True)
+    )
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        """Return the recipes sharing the most tags and ingredients"""
+        metric = request.query_params.get('metric') or JACCARD
+        if metric not in METRICS:
+            raise ValidationError({'metric': 'Unknown metric.'})
+        limit = min(max(self._get_param('limit', int) or 10, 1), 50)
+
+        # The index only holds the user's recipes, so it checks ownership
+        try:
+            scores = find_similar_recipes(request.user, int(pk), metric, limit)
+        except (KeyError, ValueError):
+            raise Http404('Recipe not found.')
+
+        recipes = Recipe.objects.filter(
+            id__in=[recipe_id for recipe_id, _ in scores]
+        ).prefetch_related(*self.prefetch_fields).in_bulk()
+        results = [
+            {'recipe': recipes[recipe_id], 'score': score}
+            for recipe_id, score in scores if recipe_id in recipes
+        ]
+
+        return Response(
+            serializers.SimilarRecipeSerializer(results, many=True).data
+        )
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'ingredients',
+                OpenApiTypes.STR,
+                required=True,
+                description='Comma separated list of the ingredient IDs owned'
+            ),
+            OpenApiParameter(
+                'max_missing',
+                OpenApiTypes.INT,
+                description='Number of ingredients that may be missing'
+            ),
+            OpenApiParameter(
+                'limit',
+                OpenApiTypes.INT,
+                description='Number of recipes to return, at most 200'
+            )
+        ],
+        responses=serializers.CookableRecipeSerializer(many=True)
+    )
+    @action(methods=['GET'], detail=False)
+    def cookable(self, request):
+        """Return the recipes that can be cooked with the given
+        ingredients, fewest missing ingredients first"""
+        ingredient_ids = self._get_param('ingredients', self._params_to_ints)
+        if not ingredient_ids:
+            raise ValidationError({'ingredients': 'This field is required.'})
+        max_missing = max(self._get_param('max_missing', int) or 0, 0)
+        limit = min(max(self._get_param('limit', int) or 50, 1), 200)
+
+        matches = find_cookable_recipes(
+            request.user, ingredient_ids, max_missing, limit
+        )
+
+        recipes = Recipe.objects.filter(
+            id__in=[recipe_id for recipe_id, _ in matches]
+        ).prefetch_related(*self.prefetch_fields).in_bulk()
+        results = [
+            {'recipe': recipes[recipe_id], 'missing': missing}
+            for recipe_id, missing in matches if recipe_id in recipes
+        ]
+
+        return Response(
+            serializers.CookableRecipeSerializer(results, many=True).data
+        )
+
+    def perform_content_negotiation(self, request, force=False):
+        # Images aren't rendered, so any Accept header is fine
+        force = force or self.action == 'image'
+        return super().perform_content_negotiation(request, force=force)
+
 
 @extend_schema_view(
     list=extend_schema(
@@ -100,11 +531,18 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 OpenApiTypes.INT,
                 enum=[0, 1],
                 description='Filter by items assigned to recipes.'
+            ),
+            OpenApiParameter(
+                'ordering',
+                OpenApiTypes.STR,
+                enum=['name', '-usage'],
+                description='Order by name (default) or by most used.'
             )
         ]
     )
 )
 class BaseRecipeAttrViewSet(
+    UserShardMixin,
     mixins.UpdateModelMixin,
     mixins.DestroyModelMixin,
     mixins.ListModelMixin,
@@ -122,20 +560,22 @@ class BaseRecipeAttrViewSet(
 
     # Override get_queryset method to only return objects created by the user
     # instead of returning all objects which would be the default behavior.
-    # We also filter out elements that aren't assigned
+    # We also filter out elements that aren't assigned. Both use the
+    # denormalized recipe_count column instead of joining the recipes.
     def get_queryset(self):
         """Retrieve objects for authenticated user."""
         assigned_only = bool(
             int(self.request.query_params.get('assigned_only', 0))
         )
 
-        queryset = self.queryset
+        queryset = self.queryset.filter(user=self.request.user)
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
+            queryset = queryset.filter(recipe_count__gt=0)
+
+        if self.request.query_params.get('ordering') == '-usage':
+            return queryset.order_by('-recipe_count', 'name')
 
-        return queryset.filter(
-            user=self.request.user
-        ).order_by('name').distinct()
+        return queryset.order_by('name')
 
 
 class TagViewSet(BaseRecipeAttrViewSet):
@@ -148,3 +588,100 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
     """View for manage ingredient APIs."""
     serializer_class = serializers.IngredientSerializer
     queryset = Ingredient.objects.all()
+
+
+class SyncView(UserShardMixin, APIView):
+    """Return what changed in the user's recipes, tags and ingredients
+    since the token a client got from its previous sync."""
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    def _get_since(self):
+        """Return the change sequence the client is synced up to."""
+        since = self.request.query_params.get('since') or '0'
+        try:
+            since = int(since)
+        except ValueError:
+            raise ValidationError({'since': 'Invalid sync token.'})
+
+        return max(since, 0)
+
+    def _changed(self, queryset, since):
+        """Filter queryset to the user's rows changed after since."""
+        queryset = queryset.filter(user=self.request.user)
+        if since:
+            queryset = queryset.filter(change_seq__gt=since)
+
+        return queryset.order_by('change_seq')
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                'since',
+                OpenApiTypes.STR,
+                description='Token returned by the previous sync. Leave '
+                            'empty for a full sync, which is required '
+                            'when an old token gets a 410.'
+            )
+        ],
+        responses=serializers.SyncSerializer
+    )
+    def get(self, request):
+        """Return the changes since the given token."""
+        since = self._get_since()
+        if since and since < request.user.sync_horizon:
+            # Tombstones after since were pruned
+            raise SyncTokenExpired()
+
+        # The token is read before the changes, so a change committed
+        # while they're being read is sent again on the next sync rather
+        # than missed. Changes up to the token are committed, see
+        # core.sharding.user_transaction
+        token = request.user.change_seq
+        data = {
+            'token': str(max(token, since)),
+            'recipes': [],
+            'tags': [],
+            'ingredients': [],
+            'deleted': {'recipes': [], 'tags': [], 'ingredients': []},
+        }
+
+        # Nothing changed since the last sync, which the user's watermark
+        # tells without querying any of the synced tables
+        if since and token <= since:
+            return Response(data)
+
+        data['recipes'] = serializers.RecipeDetailSerializer(
+            self._changed(Recipe.objects.all(), since).prefetch_related(
+                'tags', 'ingredients'
+            ),
+            many=True,
+            context={'request': request}
+        ).data
+        data['tags'] = serializers.TagSerializer(
+            self._changed(Tag.objects.all(), since), many=True
+        ).data
+        data['ingredients'] = serializers.IngredientSerializer(
+            self._changed(Ingredient.objects.all(), since), many=True
+        ).data
+
+        if since:
+            deleted = Tombstone.objects.filter(
+                user_id=request.user.id,
+                change_seq__gt=since
+            ).values_list('kind', 'object_id')
+            for kind, object_id in deleted:
+                data['deleted'][f'{kind}s'].append(object_id)
+
+        return Response(data)
+
+
+class RecipeStatsView(UserShardMixin, APIView):
+    """Return statistics about the user's recipes."""
+    authentication_classes = [TokenAuthentication]
+    permission_classes = [IsAuthenticated]
+
+    @extend_schema(responses=serializers.RecipeStatsSerializer)
+    def get(self, request):
+        stats = get_recipe_stats(request.user)
+        return Response(serializers.RecipeStatsSerializer(stats).data)
@@ -1,12 +1,16 @@
 """Tests for user API."""
+from unittest import skipUnless
 
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import TestCase, override_settings
 from django.contrib.auth import get_user_model
 from django.urls import reverse
 
 from rest_framework.test import APIClient
 from rest_framework import status
 
+from core.renderers import msgpack
+
 CREATE_USER_URL = reverse('user:create')
 TOKEN_URL = reverse('user:token')
 ME_URL = reverse('user:me')
@@ -24,6 +28,8 @@ class PublicUserApiTsts(TestCase):
 
     def setUp(self):
         self.client = APIClient()
+        # Reset the token endpoint throttles
+        cache.clear()
 
     def test_create_user_success(self):
         """Test creating a user is successful."""
@@ -123,6 +129,51 @@ class PublicUserApiTsts(TestCase):
         self.assertNotIn('token', res.data)
         self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_create_token_rehashes_password(self):
+        """Test the password is rehashed with the configured work factor
+        on a successful login"""
+        user = create_user(email='test@example.com', password='testpass123')
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$'))
+
+        with override_settings(PASSWORD_HASH_ITERATIONS=1000):
+            payload = {'email': 'test@example.com', 'password': 'testpass123'}
+            res = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith('pbkdf2_sha256$1000$'))
+        self.assertTrue(user.check_password('testpass123'))
+
+    def test_create_token_throttled_per_email(self):
+        """Test token requests for an email are throttled"""
+        payload = {'email': 'test@example.com', 'password': 'wrong-password'}
+        for _ in range(5):
+            res = self.client.post(TOKEN_URL, payload)
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+        payload['email'] = 'TEST@example.com'
+        res = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertIn('Retry-After', res)
+
+    def test_create_token_invalid_body(self):
+        """Test a token request whose body isn't an object is rejected"""
+        res = self.client.post(TOKEN_URL, ['test@example.com'], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_create_token_throttled_per_ip(self):
+        """Test token requests from an IP are throttled"""
+        for i in range(30):
+            payload = {'email': f'user{i}@example.com', 'password': 'wrong'}
+            self.client.post(TOKEN_URL, payload)
+
+        payload = {'email': 'other@example.com', 'password': 'wrong'}
+        res = self.client.post(TOKEN_URL, payload)
+
+        self.assertEqual(res.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
     def test_retrieve_user_unauthorized(self):
         """Test authentication is required for users"""
         res = self.client.get(ME_URL)
@@ -172,3 +223,21 @@ class PrivateUserApiTest(TestCase):
         self.assertEqual(res.status_code, status.HTTP_200_OK)
         self.assertEqual(self.user.name, payload['name'])
         self.assertTrue(self.user.check_password(payload['password']))
+
+    @skipUnless(msgpack, 'msgpack is not installed')
+    def test_update_user_profile_msgpack(self):
+        """Test updating the profile with a MessagePack body and response"""
+        res = self.client.generic(
+            'PATCH', ME_URL, msgpack.packb({'name': 'Binary name'}),
+            content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack'
+        )
+
+        self.user.refresh_from_db()
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/msgpack')
+        self.assertEqual(msgpack.unpackb(res.content), {
+            'name': 'Binary name',
+            'email': self.user.email,
+        })
+        self.assertEqual(self.user.name, 'Binary name')
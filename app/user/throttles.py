@@ -0,0 +1,39 @@
+"""Throttles for the user API"""
+import hashlib
+from collections.abc import Mapping
+
+from rest_framework.throttling import AnonRateThrottle, SimpleRateThrottle
+
+
+class LoginIPRateThrottle(AnonRateThrottle):
+    """Limit token requests per client IP."""
+    scope = 'login_ip'
+
+    def get_cache_key(self, request, view):
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': self.get_ident(request)
+        }
+
+
+class LoginEmailRateThrottle(SimpleRateThrottle):
+    """Limit token requests per email, so distributed attacks on a single
+    account can't force unlimited password hash computations."""
+    scope = 'login_email'
+
+    def get_cache_key(self, request, view):
+        if not isinstance(request.data, Mapping):
+            # Invalid bodies, like JSON arrays, are rejected by the view
+            return None
+
+        email = request.data.get('email')
+        if not email or not isinstance(email, str):
+            return None
+
+        # Emails are matched case insensitively so the limit can't be
+        # bypassed by changing the case, and hashed to get a safe cache key
+        ident = hashlib.sha256(email.strip().lower().encode()).hexdigest()
+        return self.cache_format % {
+            'scope': self.scope,
+            'ident': ident
+        }
@@ -7,6 +7,7 @@ from user.serializers import (
     UserSerializer,
     AuthTokenSerializer
 )
+from user.throttles import LoginIPRateThrottle, LoginEmailRateThrottle
 
 
 class CreateUserView(generics.CreateAPIView):
@@ -18,6 +19,9 @@ class CreateTokenView(ObtainAuthToken):
     """Create a new auth token from user."""
     serializer_class = AuthTokenSerializer
     renderer_classes = api_settings.DEFAULT_RENDERER_CLASSES
+    # Checked before authenticate() so attackers can't force unlimited
+    # password hash computations
+    throttle_classes = [LoginIPRateThrottle, LoginEmailRateThrottle]
 
 
 class ManageUserView(generics.RetrieveUpdateAPIView):